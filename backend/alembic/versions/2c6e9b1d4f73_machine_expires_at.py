@@ -0,0 +1,29 @@
+"""machine expires_at
+
+Revision ID: 2c6e9b1d4f73
+Revises: 7b1d3f9e5a24
+Create Date: 2024-06-18 11:42:19.530217
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2c6e9b1d4f73"
+down_revision = "7b1d3f9e5a24"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("machines", sa.Column("expires_at", sa.Integer(), nullable=True))
+    op.create_index(
+        "ix_machines_machine_status", "machines", ["machine_status"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_machines_machine_status", table_name="machines")
+    op.drop_column("machines", "expires_at")
@@ -0,0 +1,34 @@
+"""warm pool
+
+Revision ID: 3f7a1c5e8d62
+Revises: 8e4b2d6a9c51
+Create Date: 2024-06-26 15:40:18.274903
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f7a1c5e8d62"
+down_revision = "8e4b2d6a9c51"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "ALTER TYPE machine_status_1714448743 ADD VALUE IF NOT EXISTS 'IDLE'"
+        )
+    op.add_column("machines", sa.Column("cuda", sa.String(), nullable=True))
+    op.add_column("machines", sa.Column("key", sa.String(), nullable=True))
+    op.create_index(op.f("ix_machines_key"), "machines", ["key"], unique=False)
+
+
+def downgrade() -> None:
+    # Postgres can't drop a value from an enum, so IDLE stays in the type.
+    op.drop_index(op.f("ix_machines_key"), table_name="machines")
+    op.drop_column("machines", "key")
+    op.drop_column("machines", "cuda")
@@ -0,0 +1,80 @@
+"""numeric content metadata
+
+Revision ID: 4e8a2d6c1f05
+Revises: 9c1f4e2a7b3d
+Create Date: 2024-06-12 11:02:48.190375
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "4e8a2d6c1f05"
+down_revision = "9c1f4e2a7b3d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column(
+        "content",
+        "size",
+        type_=sa.BigInteger(),
+        postgresql_using=(
+            "NULLIF(regexp_replace(size, '[^0-9.]', '', 'g'), '')::numeric::bigint"
+        ),
+    )
+    op.alter_column(
+        "content",
+        "duration",
+        type_=sa.Float(),
+        postgresql_using=(
+            "CASE "
+            "WHEN duration ~ '^[0-9]+:[0-9]{1,2}:[0-9]{1,2}(\\.[0-9]+)?$' THEN "
+            "split_part(duration, ':', 1)::float * 3600 "
+            "+ split_part(duration, ':', 2)::float * 60 "
+            "+ split_part(duration, ':', 3)::float "
+            "WHEN duration ~ '^[0-9]+(\\.[0-9]+)?$' THEN duration::float "
+            "END"
+        ),
+    )
+    op.alter_column(
+        "content",
+        "fps",
+        type_=sa.Float(),
+        postgresql_using=(
+            "CASE "
+            "WHEN fps ~ '^[0-9]+(\\.[0-9]+)?$' THEN fps::float "
+            "WHEN fps ~ '^[0-9]+/[0-9]+$' AND split_part(fps, '/', 2)::float > 0 THEN "
+            "split_part(fps, '/', 1)::float / split_part(fps, '/', 2)::float "
+            "END"
+        ),
+    )
+    op.alter_column(
+        "content",
+        "hz",
+        type_=sa.Float(),
+        postgresql_using="CASE WHEN hz ~ '^[0-9]+(\\.[0-9]+)?$' THEN hz::float END",
+    )
+
+
+def downgrade() -> None:
+    op.alter_column(
+        "content", "size", type_=sa.String(), postgresql_using="size::varchar"
+    )
+    op.alter_column(
+        "content",
+        "duration",
+        type_=sa.String(),
+        postgresql_using=(
+            "lpad((floor(duration)::bigint / 3600)::varchar, 2, '0') || ':' "
+            "|| lpad((floor(duration)::bigint % 3600 / 60)::varchar, 2, '0') || ':' "
+            "|| lpad((floor(duration)::bigint % 60)::varchar, 2, '0')"
+        ),
+    )
+    op.alter_column(
+        "content", "fps", type_=sa.String(), postgresql_using="fps::varchar"
+    )
+    op.alter_column("content", "hz", type_=sa.String(), postgresql_using="hz::varchar")
@@ -0,0 +1,58 @@
+"""processing results
+
+Revision ID: 5a3c8e7f2b19
+Revises: 2c6e9b1d4f73
+Create Date: 2024-06-21 09:13:52.118406
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5a3c8e7f2b19"
+down_revision = "2c6e9b1d4f73"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "processing_results",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("result_key", sa.String(), nullable=True),
+        sa.Column("job_id", sa.Integer(), nullable=True),
+        sa.Column("outputs", sa.String(), nullable=True),
+        sa.Column("hits", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("created_at", sa.Integer(), nullable=True),
+        sa.Column("updated_at", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_processing_results_id"), "processing_results", ["id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_processing_results_result_key"),
+        "processing_results",
+        ["result_key"],
+        unique=True,
+    )
+    op.add_column("jobs", sa.Column("result_key", sa.String(), nullable=True))
+    op.create_index(op.f("ix_jobs_result_key"), "jobs", ["result_key"], unique=False)
+    op.create_index(op.f("ix_content_link"), "content", ["link"], unique=False)
+    op.create_index(
+        op.f("ix_content_thumbnail"), "content", ["thumbnail"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_content_thumbnail"), table_name="content")
+    op.drop_index(op.f("ix_content_link"), table_name="content")
+    op.drop_index(op.f("ix_jobs_result_key"), table_name="jobs")
+    op.drop_column("jobs", "result_key")
+    op.drop_index(
+        op.f("ix_processing_results_result_key"), table_name="processing_results"
+    )
+    op.drop_index(op.f("ix_processing_results_id"), table_name="processing_results")
+    op.drop_table("processing_results")
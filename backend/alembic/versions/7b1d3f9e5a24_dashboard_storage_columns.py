@@ -0,0 +1,85 @@
+"""dashboard storage columns
+
+Revision ID: 7b1d3f9e5a24
+Revises: 4e8a2d6c1f05
+Create Date: 2024-06-14 16:27:05.804113
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7b1d3f9e5a24"
+down_revision = "4e8a2d6c1f05"
+branch_labels = None
+depends_on = None
+
+STORAGE_COLUMNS = {
+    "video": "storage_video_bytes",
+    "audio": "storage_audio_bytes",
+    "image": "storage_image_bytes",
+}
+
+
+def upgrade() -> None:
+    for column in STORAGE_COLUMNS.values():
+        op.add_column(
+            "dashboard",
+            sa.Column(column, sa.BigInteger(), nullable=False, server_default="0"),
+        )
+    op.execute(
+        """
+        WITH totals AS (
+            SELECT user_id,
+                   content_type::text AS content_type,
+                   count(*) AS processed,
+                   coalesce(sum(size), 0) AS bytes
+            FROM content
+            WHERE status::text = 'completed'
+              AND content_type::text IN ('video', 'audio', 'image')
+              AND title NOT LIKE '%.srt'
+              AND title NOT LIKE '%.zip'
+            GROUP BY user_id, content_type
+        ),
+        per_user AS (
+            SELECT user_id,
+                   sum(processed) FILTER (WHERE content_type = 'video') AS video,
+                   sum(processed) FILTER (WHERE content_type = 'audio') AS audio,
+                   sum(processed) FILTER (WHERE content_type = 'image') AS image,
+                   sum(bytes) FILTER (WHERE content_type = 'video') AS video_bytes,
+                   sum(bytes) FILTER (WHERE content_type = 'audio') AS audio_bytes,
+                   sum(bytes) FILTER (WHERE content_type = 'image') AS image_bytes,
+                   sum(bytes) AS total_bytes
+            FROM totals
+            GROUP BY user_id
+        )
+        UPDATE dashboard
+        SET video_processed = coalesce(per_user.video, 0),
+            audio_processed = coalesce(per_user.audio, 0),
+            image_processed = coalesce(per_user.image, 0),
+            storage_video_bytes = coalesce(per_user.video_bytes, 0),
+            storage_audio_bytes = coalesce(per_user.audio_bytes, 0),
+            storage_image_bytes = coalesce(per_user.image_bytes, 0),
+            storage_used = coalesce(per_user.total_bytes, 0)
+        FROM dashboard AS d
+        LEFT JOIN per_user ON per_user.user_id = d.user_id
+        WHERE dashboard.user_id = d.user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        UPDATE dashboard
+        SET storage_json = json_build_object(
+            'video', round(storage_video_bytes / 1048576.0, 2),
+            'audio', round(storage_audio_bytes / 1048576.0, 2),
+            'image', round(storage_image_bytes / 1048576.0, 2)
+        )::text
+        """
+    )
+    for column in STORAGE_COLUMNS.values():
+        op.drop_column("dashboard", column)
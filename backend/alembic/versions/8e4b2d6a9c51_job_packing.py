@@ -0,0 +1,31 @@
+"""job packing
+
+Revision ID: 8e4b2d6a9c51
+Revises: 5a3c8e7f2b19
+Create Date: 2024-06-24 11:02:37.540193
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8e4b2d6a9c51"
+down_revision = "5a3c8e7f2b19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("jobs", sa.Column("machine_id", sa.Integer(), nullable=True))
+    op.create_index(op.f("ix_jobs_machine_id"), "jobs", ["machine_id"], unique=False)
+    op.create_foreign_key(
+        "jobs_machine_id_fkey", "jobs", "machines", ["machine_id"], ["machine_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("jobs_machine_id_fkey", "jobs", type_="foreignkey")
+    op.drop_index(op.f("ix_jobs_machine_id"), table_name="jobs")
+    op.drop_column("jobs", "machine_id")
@@ -0,0 +1,55 @@
+"""adding listing indexes
+
+Revision ID: 9c1f4e2a7b3d
+Revises: 60b7b4a547c4
+Create Date: 2024-06-10 09:14:37.512904
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9c1f4e2a7b3d"
+down_revision = "60b7b4a547c4"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    (
+        "ix_content_user_listing",
+        "content",
+        ["user_id", "id_related", "content_type", "status", "created_at"],
+    ),
+    ("ix_content_job_id", "content", ["job_id"]),
+    ("ix_content_tags_content_id", "content_tags", ["content_id"]),
+    ("ix_jobs_user_listing", "jobs", ["user_id", "job_status", "created_at"]),
+    ("ix_jobs_job_id_key", "jobs", ["job_id", "key"]),
+    ("ix_machines_job_id", "machines", ["job_id"]),
+    ("ix_invoices_user_listing", "invoices", ["user_id", "status", "created_at"]),
+    ("ix_invoices_session_id", "invoices", ["session_id"]),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
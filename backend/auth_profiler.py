@@ -0,0 +1,63 @@
+import ast
+import timeit
+from datetime import datetime, timedelta
+
+from jose import jwt
+
+from utils import (
+    JWT_ALGORITHM,
+    JWT_SECRET,
+    _decoded_tokens,
+    create_access_token,
+    decode_token,
+)
+
+ROUNDS = 20000
+
+
+def legacy_token():
+    subject = {"id": 1042, "refreshVersion": 17, "accessVersion": 31}
+    to_encode = {
+        "exp": datetime.utcnow() + timedelta(minutes=30),
+        "sub": str(subject),
+    }
+    return jwt.encode(to_encode, JWT_SECRET, JWT_ALGORITHM)
+
+
+def legacy_decode(token):
+    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    return ast.literal_eval(payload["sub"])
+
+
+def structured_decode_uncached(token):
+    _decoded_tokens.clear()
+    return decode_token(token, JWT_SECRET)
+
+
+def report(name, seconds):
+    print(f"{name:<40} {seconds / ROUNDS * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    old_token = legacy_token()
+    new_token = create_access_token(
+        {"id": 1042, "refreshVersion": 17, "accessVersion": 31, "user_tier": "free"},
+        expires_delta=timedelta(minutes=30),
+    )
+    report(
+        "before: jwt.decode + ast.literal_eval",
+        timeit.timeit(lambda: legacy_decode(old_token), number=ROUNDS),
+    )
+    report(
+        "after: structured claims, cold LRU",
+        timeit.timeit(lambda: structured_decode_uncached(new_token), number=ROUNDS),
+    )
+    report(
+        "after: legacy token, cold LRU",
+        timeit.timeit(lambda: structured_decode_uncached(old_token), number=ROUNDS),
+    )
+    decode_token(new_token, JWT_SECRET)
+    report(
+        "after: structured claims, warm LRU",
+        timeit.timeit(lambda: decode_token(new_token, JWT_SECRET), number=ROUNDS),
+    )
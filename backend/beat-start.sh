@@ -0,0 +1,6 @@
+#! /usr/bin/env bash
+set -e
+
+# Periodic tasks (machine and dashboard reconcilers), see beat_schedule in celeryworker.py.
+# RedBeat keeps the schedule and a lock in Redis, so only one beat runs at a time.
+celery -A celeryworker.celeryapp beat -S redbeat.RedBeatScheduler --loglevel=info
@@ -1,5 +1,6 @@
 from celery import Celery
-from celery.signals import worker_init
+from kombu import Queue
+from celery.signals import worker_init, worker_process_init
 from dotenv import load_dotenv
 import os
 
@@ -21,6 +22,54 @@ REDIS_HOST = str(os.getenv("REDIS_HOST"))
 
 redbeat_redis_url = REDIS_BROKER
 
+# Workloads run on their own queues so slow jobs can't hold up the rest:
+#   media        ffmpeg/librosa/cv2 indexing, CPU bound (prefork)
+#   notify       emails and Discord updates, network bound (threads)
+#   storage      R2 deletes, network bound (threads)
+#   orchestrate  GPU job launches and the periodic reconcilers (threads)
+# Tasks that aren't routed stay on the default "celery" queue.
+CELERY_QUEUES = ("media", "notify", "storage", "orchestrate", "celery")
+TASK_ROUTES = {
+    "routers.upload.index_media_task": "media",
+    "routers.auth.send_email_task": "notify",
+    "routers.options.resend_email_task": "notify",
+    "routers.billing.send_paymentInitiated_email_task": "notify",
+    "routers.billing.send_paymentSuccessfull_email_task": "notify",
+    "routers.billing.send_paymentFailed_email_task": "notify",
+    "utils.job_email": "notify",
+    "utils.send_discord_update": "notify",
+    "utils.delete_r2_object": "storage",
+    "routers.jobs.image_process": "orchestrate",
+    "routers.jobs.image_prediction_done": "orchestrate",
+    "routers.jobs.cancel_image_prediction": "orchestrate",
+    "routers.jobs.video_process": "orchestrate",
+    "routers.jobs.audio_process": "orchestrate",
+    "routers.jobs.pack_gpu_jobs": "orchestrate",
+    "routers.jobs.schedule_jobs": "orchestrate",
+    "routers.machines.reconcile_machines_celery": "orchestrate",
+    "routers.machines.refresh_gpu_offers_celery": "orchestrate",
+    "routers.machines.maintain_warm_pool_celery": "orchestrate",
+    "routers.dashboard.reconcile_dashboard_celery": "orchestrate",
+}
+# Nobody reads the result of these, so don't write it to the backend.
+# index_media_task and image_process keep theirs for status checks and aborts.
+CELERY_IGNORE_RESULT = os.getenv("CELERY_IGNORE_RESULT", "true").lower() == "true"
+FIRE_AND_FORGET_QUEUES = ("notify", "storage")
+FIRE_AND_FORGET_TASKS = [
+    name for name, queue in TASK_ROUTES.items() if queue in FIRE_AND_FORGET_QUEUES
+] + [
+    "routers.jobs.image_prediction_done",
+    "routers.jobs.cancel_image_prediction",
+    "routers.jobs.video_process",
+    "routers.jobs.audio_process",
+    "routers.jobs.pack_gpu_jobs",
+    "routers.jobs.schedule_jobs",
+    "routers.machines.reconcile_machines_celery",
+    "routers.machines.refresh_gpu_offers_celery",
+    "routers.machines.maintain_warm_pool_celery",
+    "routers.dashboard.reconcile_dashboard_celery",
+]
+
 celeryapp = Celery(
     "celeryworker",
     broker=REDIS_BROKER,
@@ -31,18 +80,67 @@ celeryapp = Celery(
     broker_connection_retry_on_startup=True,
     broker_connection_max_retries=10,
     worker_prefetch_multiplier=1,
-    task_track_started=True
+    task_track_started=True,
+    redbeat_redis_url=redbeat_redis_url,
+    beat_scheduler="redbeat.RedBeatScheduler",
+    task_queues=[Queue(name) for name in CELERY_QUEUES],
+    task_default_queue="celery",
+    task_routes={name: {"queue": queue} for name, queue in TASK_ROUTES.items()},
+    task_annotations={name: {"ignore_result": CELERY_IGNORE_RESULT} for name in FIRE_AND_FORGET_TASKS},
 )
 
+MACHINE_RECONCILE_INTERVAL = int(os.getenv("MACHINE_RECONCILE_INTERVAL", 15))
+DASHBOARD_RECONCILE_INTERVAL = int(os.getenv("DASHBOARD_RECONCILE_INTERVAL", 86400))
+GPU_OFFERS_REFRESH_INTERVAL = int(os.getenv("GPU_OFFERS_REFRESH_INTERVAL", 60))
+WARM_POOL_INTERVAL = int(os.getenv("WARM_POOL_INTERVAL", 60))
+SCHEDULER_INTERVAL = int(os.getenv("SCHEDULER_INTERVAL", 5))
+
+celeryapp.conf.beat_schedule = {
+    "reconcile-machines": {
+        "task": "routers.machines.reconcile_machines_celery",
+        "schedule": MACHINE_RECONCILE_INTERVAL,
+        "options": {"expires": MACHINE_RECONCILE_INTERVAL},
+    },
+    "refresh-gpu-offers": {
+        "task": "routers.machines.refresh_gpu_offers_celery",
+        "schedule": GPU_OFFERS_REFRESH_INTERVAL,
+        "options": {"expires": GPU_OFFERS_REFRESH_INTERVAL},
+    },
+    "schedule-jobs": {
+        "task": "routers.jobs.schedule_jobs",
+        "schedule": SCHEDULER_INTERVAL,
+        "options": {"expires": SCHEDULER_INTERVAL},
+    },
+    "maintain-warm-pool": {
+        "task": "routers.machines.maintain_warm_pool_celery",
+        "schedule": WARM_POOL_INTERVAL,
+        "options": {"expires": WARM_POOL_INTERVAL},
+    },
+    "reconcile-dashboards": {
+        "task": "routers.dashboard.reconcile_dashboard_celery",
+        "schedule": DASHBOARD_RECONCILE_INTERVAL,
+    },
+}
+
 def restore_all_unacknowledged_messages():
     conn = celeryapp.connection(transport_options={'visibility_timeout': 0})
     qos = conn.channel().qos
     qos.restore_visible()
     print('Unacknowledged messages restored')
 
+# The restore covers every queue, so only one worker should do it, otherwise
+# tasks still running on the other workers get delivered twice.
+CELERY_RESTORE_UNACKED = os.getenv("CELERY_RESTORE_UNACKED", "true").lower() == "true"
+
 @worker_init.connect
 def configure(sender=None, conf=None, **kwargs):
-    restore_all_unacknowledged_messages()
+    if CELERY_RESTORE_UNACKED:
+        restore_all_unacknowledged_messages()
+
+@worker_process_init.connect
+def reset_db_pools(**kwargs):
+    from database import dispose_inherited_pools
+    dispose_inherited_pools()
 
 if __name__ == '__main__':
     celeryapp.start()
\ No newline at end of file
@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from prometheus_client import Gauge, Histogram
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 
@@ -13,12 +17,131 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DATABASE = os.getenv("POSTGRES_DATABASE")
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}"
 
+# Connections per process for each pool (pool_size, max_overflow). The
+# worst case for a deployment is roughly
+#   api_workers * (sync + async) + celery_children * sync
+# which has to stay below Postgres max_connections (or the PgBouncer pool).
+#   api             gunicorn/uvicorn worker, sync routes run in the threadpool
+#   celery_prefork  one task at a time per child process
+#   celery_gevent   many greenlets share one process
+#   celery_threads  thread pool workers for the network bound queues
+POOL_PROFILES = {
+    "api": {"sync": (5, 5), "async": (10, 5)},
+    "celery_prefork": {"sync": (1, 1), "async": (1, 0)},
+    "celery_gevent": {"sync": (10, 10), "async": (1, 0)},
+    "celery_threads": {"sync": (10, 10), "async": (1, 0)},
+}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, pool_size=20, max_overflow=40, pool_pre_ping=True
+DB_PROCESS_TYPE = os.getenv("DB_PROCESS_TYPE", "api")
+if DB_PROCESS_TYPE not in POOL_PROFILES:
+    raise ValueError(f"Unknown DB_PROCESS_TYPE {DB_PROCESS_TYPE}")
+DB_POOL_SIZE = os.getenv("DB_POOL_SIZE")
+DB_MAX_OVERFLOW = os.getenv("DB_MAX_OVERFLOW")
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# PgBouncer in transaction pooling mode hands out a server connection per
+# transaction, so pooling again on our side only pins them. Prepared
+# statements can't survive across transactions either.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "sqlalchemy_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["pool", "process_type"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+POOL_CONNECTIONS_IN_USE = Gauge(
+    "sqlalchemy_pool_connections_in_use",
+    "Connections currently checked out of the pool",
+    ["pool", "process_type"],
+    multiprocess_mode="livesum",
 )
 
+
+class TimedPoolMixin:
+    metrics_label = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_label, DB_PROCESS_TYPE).observe(
+                time.perf_counter() - start
+            )
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    metrics_label = "sync"
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+
+def pool_settings(kind: str):
+    if DB_PGBOUNCER:
+        return {"poolclass": NullPool}
+    pool_size, max_overflow = POOL_PROFILES[DB_PROCESS_TYPE][kind]
+    return {
+        "poolclass": TimedQueuePool if kind == "sync" else TimedAsyncQueuePool,
+        "pool_size": int(DB_POOL_SIZE or pool_size),
+        "max_overflow": int(DB_MAX_OVERFLOW or max_overflow),
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def track_connections(sync_engine, label: str):
+    in_use = POOL_CONNECTIONS_IN_USE.labels(label, DB_PROCESS_TYPE)
+
+    @event.listens_for(sync_engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        in_use.inc()
+
+    @event.listens_for(sync_engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        in_use.dec()
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, **kwargs):
+    db_engine = create_engine(
+        url, pool_pre_ping=True, **{**pool_settings("sync"), **kwargs}
+    )
+    track_connections(db_engine, "sync")
+    return db_engine
+
+
+def create_async_db_engine(url: str = ASYNC_SQLALCHEMY_DATABASE_URL, **kwargs):
+    connect_args = {}
+    if DB_PGBOUNCER:
+        connect_args = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    db_engine = create_async_engine(
+        url,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+        **{**pool_settings("async"), **kwargs},
+    )
+    track_connections(db_engine.sync_engine, "async")
+    return db_engine
+
+
+def dispose_inherited_pools():
+    # Connections opened before a fork belong to the parent process.
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+
+engine = create_db_engine()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_db_engine()
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
@@ -2,6 +2,6 @@
 
 set -e 
 
-celery -A celeryworker.celeryapp worker --loglevel=info &
+celery -A celeryworker.celeryapp worker -Q media,notify,storage,orchestrate,celery --loglevel=info &
 
 python main.py
\ No newline at end of file
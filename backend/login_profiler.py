@@ -0,0 +1,84 @@
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+BASE_URL = os.getenv("PROFILE_BASE_URL", "http://localhost:8000")
+LOGIN_EMAIL = os.getenv("PROFILE_EMAIL", "admin@tnsr.ai")
+LOGIN_PASSWORD = os.getenv("PROFILE_PASSWORD", "password")
+LOGINS = int(os.getenv("PROFILE_LOGINS", 200))
+CONCURRENCY = int(os.getenv("PROFILE_CONCURRENCY", 50))
+
+# Start the API with the rate limiter relaxed (or from several source IPs),
+# otherwise /auth/login answers 429 after 20 requests per minute.
+
+
+async def login(client, semaphore, statuses):
+    async with semaphore:
+        response = await client.post(
+            "/auth/login",
+            data={"username": LOGIN_EMAIL, "password": LOGIN_PASSWORD},
+        )
+        statuses[response.status_code] += 1
+
+
+async def probe(client, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def main():
+    statuses = Counter()
+    latencies = []
+    stop = asyncio.Event()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    limits = httpx.Limits(max_connections=CONCURRENCY + 5)
+    async with httpx.AsyncClient(
+        base_url=BASE_URL, limits=limits, timeout=60
+    ) as client:
+        baseline = []
+        baseline_stop = asyncio.Event()
+        baseline_task = asyncio.create_task(probe(client, baseline_stop, baseline))
+        await asyncio.sleep(2)
+        baseline_stop.set()
+        await baseline_task
+
+        probe_task = asyncio.create_task(probe(client, stop, latencies))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[login(client, semaphore, statuses) for _ in range(LOGINS)]
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+
+    print(f"logins: {LOGINS} in {elapsed:.2f}s ({LOGINS / elapsed:.1f}/s)")
+    print(f"login status codes: {dict(statuses)}")
+    print(
+        f"GET / idle     p50 {statistics.median(baseline) * 1000:.1f}ms "
+        f"p99 {percentile(baseline, 99) * 1000:.1f}ms"
+    )
+    print(
+        f"GET / in burst p50 {statistics.median(latencies) * 1000:.1f}ms "
+        f"p99 {percentile(latencies, 99) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        BASE_URL = sys.argv[1]
+    asyncio.run(main())
@@ -31,6 +31,7 @@ from fastapi_limiter import FastAPILimiter
 from fastapi_limiter.depends import RateLimiter
 import time
 from utils import PrometheusMiddleware, metrics, logger, r2_client
+from script_utils.password_pool import get_password_pool, shutdown_password_pool
 from dotenv import load_dotenv
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
@@ -49,8 +50,12 @@ from prometheus_client import (
     make_asgi_app,
 )
 import logging
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 from botocore.exceptions import ClientError
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
 
 load_dotenv()
 
@@ -58,6 +63,7 @@ APP_ENV = os.getenv("APP_ENV")
 APP_NAME = os.environ.get("APP_NAME", "fastapi-backend")
 EXPOSE_PORT = os.environ.get("EXPOSE_PORT", 8000)
 OTLP_GRPC_ENDPOINT = os.environ.get("OTLP_GRPC_ENDPOINT", "http://tempo:4317")
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 def get_db():
@@ -104,8 +110,6 @@ app.add_middleware(
 
 app.add_middleware(SessionMiddleware, secret_key=GOOGLE_SECRET)
 
-models.Base.metadata.create_all(bind=engine)
-
 app.include_router(auth.router)
 app.include_router(dashboard.router)
 app.include_router(upload.router)
@@ -118,6 +122,33 @@ app.include_router(billing.router)
 app.include_router(dev.router)
 
 
+def check_schema():
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    script = ScriptDirectory.from_config(config)
+    head = script.get_current_head()
+    with engine.begin() as conn:
+        context = MigrationContext.configure(conn)
+        current = context.get_current_revision()
+        if current == head:
+            return
+        # An empty development or CI database is built from the models and
+        # stamped, anything else has to go through alembic upgrade head.
+        if (
+            current is None
+            and APP_ENV != "production"
+            and not inspect(conn).has_table(models.Users.__tablename__)
+        ):
+            models.Base.metadata.create_all(bind=conn)
+            context.stamp(script, head)
+            logger.info(f"Created database schema at revision {head}")
+            return
+    raise RuntimeError(
+        f"Database schema is at revision {current}, expected {head}. "
+        "Run alembic upgrade head before starting the API."
+    )
+
+
 def init_db():
     with Session(engine) as db:
         if db.query(models.Tags).first() is None:
@@ -156,6 +187,7 @@ def init_db():
 
 @app.on_event("startup")
 async def startup():
+    check_schema()
     init_db()
     if APP_ENV == "production" or APP_ENV == "development":
         os.environ["REPLICATE_API_TOKEN"] = REPLICATE_API_TOKEN
@@ -175,6 +207,12 @@ async def startup():
         f"redis://{REDIS_HOST}:{REDIS_PORT}", encoding="utf-8", decode_responses=True
     )
     await FastAPILimiter.init(redis_connection)
+    get_password_pool()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    shutdown_password_pool()
 
 
 @app.get("/", dependencies=[Depends(RateLimiter(times=60, seconds=60))])
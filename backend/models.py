@@ -7,6 +7,7 @@ from sqlalchemy import (
     Enum,
     Float,
     BigInteger,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from database import Base
@@ -74,6 +75,9 @@ class Dashboard(Base):
     storage_limit = Column(BigInteger)
     gpu_usage = Column(BigInteger)
     storage_json = Column(String)
+    storage_video_bytes = Column(BigInteger, nullable=False, server_default="0")
+    storage_audio_bytes = Column(BigInteger, nullable=False, server_default="0")
+    storage_image_bytes = Column(BigInteger, nullable=False, server_default="0")
     created_at = Column(Integer, nullable=True)
     updated_at = Column(Integer, nullable=True)
 
@@ -82,18 +86,28 @@ class Dashboard(Base):
 
 class Content(Base):
     __tablename__ = "content"
+    __table_args__ = (
+        Index(
+            "ix_content_user_listing",
+            "user_id",
+            "id_related",
+            "content_type",
+            "status",
+            "created_at",
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     title = Column(String)
-    link = Column(String)
-    size = Column(String)
-    thumbnail = Column(String)
+    link = Column(String, index=True)
+    size = Column(BigInteger)
+    thumbnail = Column(String, index=True)
     md5 = Column(String)
     created_at = Column(Integer, nullable=True)
     updated_at = Column(Integer, nullable=True)
     id_related = Column(Integer, nullable=True)
-    job_id = Column(Integer, nullable=True)
+    job_id = Column(Integer, nullable=True, index=True)
     status = Column(
         Enum(
             ContentStatus,
@@ -112,10 +126,10 @@ class Content(Base):
             create_type=False,
         )
     )
-    duration = Column(String, nullable=True)
+    duration = Column(Float, nullable=True)
     resolution = Column(String, nullable=True)
-    fps = Column(String, nullable=True)
-    hz = Column(String, nullable=True)
+    fps = Column(Float, nullable=True)
+    hz = Column(Float, nullable=True)
 
     user = relationship("Users", back_populates="content")
 
@@ -134,11 +148,14 @@ class Balance(Base):
 
 class Invoices(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        Index("ix_invoices_user_listing", "user_id", "status", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     payment_gateway = Column(String)
-    session_id = Column(String, nullable=True)
+    session_id = Column(String, nullable=True, index=True)
     data = Column(String)
     amount = Column(Float)
     currency = Column(String)
@@ -171,20 +188,29 @@ class Machines(Base):
             "EXITED",
             "CANCELLED",
             "FAILED",
+            "IDLE",
             name="machine_status_" + str(int(time.time())),
             create_type=False,
-        )
+        ),
+        index=True,
     )
-    job_id = Column(Integer, ForeignKey("jobs.job_id"))
+    job_id = Column(Integer, ForeignKey("jobs.job_id"), index=True)
     provider = Column(String)
     created_at = Column(Integer, nullable=True)
     updated_at = Column(Integer, nullable=True)
+    expires_at = Column(Integer, nullable=True)
+    cuda = Column(String, nullable=True)
+    key = Column(String, nullable=True, index=True)
 
     user = relationship("Users", back_populates="machine")
 
 
 class Jobs(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_user_listing", "user_id", "job_status", "created_at"),
+        Index("ix_jobs_job_id_key", "job_id", "key"),
+    )
 
     job_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -200,11 +226,31 @@ class Jobs(Base):
     config_json = Column(String)
     job_process = Column(String)
     key = Column(String)
+    result_key = Column(String, nullable=True, index=True)
+    # Machines also points at its lead job, so this side is created separately.
+    machine_id = Column(
+        Integer,
+        ForeignKey("machines.machine_id", use_alter=True),
+        nullable=True,
+        index=True,
+    )
 
     user = relationship("Users", back_populates="jobs")
     content = relationship("Content")
 
 
+class ProcessingResult(Base):
+    __tablename__ = "processing_results"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    result_key = Column(String, unique=True, index=True)
+    job_id = Column(Integer, nullable=True)
+    outputs = Column(String)
+    hits = Column(Integer, nullable=False, server_default="0")
+    created_at = Column(Integer, nullable=True)
+    updated_at = Column(Integer, nullable=True)
+
+
 class UserSetting(Base):
     __tablename__ = "user_settings"
 
@@ -243,7 +289,7 @@ class ContentTags(Base):
     __tablename__ = "content_tags"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    content_id = Column(Integer, ForeignKey("content.id"))
+    content_id = Column(Integer, ForeignKey("content.id"), index=True)
     tag_id = Column(Integer, ForeignKey("tags.id"))
     created_at = Column(Integer, nullable=True)
     updated_at = Column(Integer, nullable=True)
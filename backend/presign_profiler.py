@@ -0,0 +1,74 @@
+import timeit
+
+import boto3, botocore
+
+from script_utils.signer import PresignedUrlSigner
+
+KEYS = [f"1/thumbnails/{i:04d}_thumbnail.jpg" for i in range(1000)]
+BUCKET = "metadata"
+EXPIRES = 604800
+ENDPOINT = "https://account.r2.cloudflarestorage.com"
+ROUNDS = 5
+
+
+def client_per_key():
+    urls = []
+    for key in KEYS:
+        r2_client = boto3.client(
+            "s3",
+            aws_access_key_id="access",
+            aws_secret_access_key="secret",
+            endpoint_url=ENDPOINT,
+            config=botocore.config.Config(
+                s3={"addressing_style": "path"},
+                signature_version="s3v4",
+                retries=dict(max_attempts=3),
+            ),
+        )
+        urls.append(
+            r2_client.generate_presigned_url(
+                ClientMethod="get_object",
+                Params={"Bucket": BUCKET, "Key": key},
+                ExpiresIn=EXPIRES,
+            )
+        )
+    return urls
+
+
+def shared_client(r2_client):
+    return [
+        r2_client.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": BUCKET, "Key": key},
+            ExpiresIn=EXPIRES,
+        )
+        for key in KEYS
+    ]
+
+
+def report(name, seconds):
+    print(f"{name:<40} {seconds / ROUNDS * 1e3:10.2f} ms / 1000 keys")
+
+
+if __name__ == "__main__":
+    r2_client = boto3.client(
+        "s3",
+        aws_access_key_id="access",
+        aws_secret_access_key="secret",
+        endpoint_url=ENDPOINT,
+        config=botocore.config.Config(
+            s3={"addressing_style": "path"}, signature_version="s3v4"
+        ),
+    )
+    signer = PresignedUrlSigner("access", "secret", ENDPOINT)
+    report("before: boto3 client per key", timeit.timeit(client_per_key, number=ROUNDS))
+    report(
+        "boto3 shared client",
+        timeit.timeit(lambda: shared_client(r2_client), number=ROUNDS),
+    )
+    report(
+        "after: presign_get_many",
+        timeit.timeit(
+            lambda: signer.presign_get_many(KEYS, BUCKET, EXPIRES), number=ROUNDS
+        ),
+    )
@@ -1,5 +1,4 @@
 #! /usr/bin/env bash
 
 # Run migrations
-alembic revision --autogenerate -m "Initial migrate" 
-alembic upgrade head
\ No newline at end of file
+alembic upgrade head
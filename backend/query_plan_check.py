@@ -0,0 +1,214 @@
+# Usage: python query_plan_check.py [--rows 200000]
+# Seeds the database in a transaction, runs EXPLAIN ANALYZE on the router
+# query shapes and rolls everything back. Exits 1 if a sequential scan hits
+# one of the large tables. Point it at a disposable database.
+import argparse
+import json
+import random
+import sys
+import time
+
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.dialects import postgresql
+
+import models
+from database import create_db_engine
+from routers.content import content_with_tags
+
+BIG_TABLES = {"content", "content_tags", "jobs", "machines", "invoices"}
+USERS = 500
+TAGS = 20
+
+
+def seed(conn, rows: int):
+    now = int(time.time())
+    user_ids = [
+        row[0]
+        for row in conn.execute(
+            models.Users.__table__.insert().returning(models.Users.id),
+            [
+                {
+                    "email": f"plan_check_{now}_{i}@tnsr.ai",
+                    "user_tier": "free",
+                    "verified": True,
+                    "created_at": now,
+                }
+                for i in range(USERS)
+            ],
+        )
+    ]
+    tag_ids = [
+        row[0]
+        for row in conn.execute(
+            models.Tags.__table__.insert().returning(models.Tags.id),
+            [{"tag": f"plan_check_{i}", "readable": f"Tag {i}"} for i in range(TAGS)],
+        )
+    ]
+    jobs = [
+        {
+            "user_id": random.choice(user_ids),
+            "job_status": random.choice(["Completed", "Failed", "Running"]),
+            "key": f"key{i}",
+            "created_at": now - i,
+        }
+        for i in range(rows // 4)
+    ]
+    job_ids = [
+        row[0]
+        for row in conn.execute(
+            models.Jobs.__table__.insert().returning(models.Jobs.job_id), jobs
+        )
+    ]
+
+    def insert_content(count, parent_ids):
+        return [
+            row[0]
+            for row in conn.execute(
+                models.Content.__table__.insert().returning(models.Content.id),
+                [
+                    {
+                        "user_id": random.choice(user_ids),
+                        "title": f"content{i}",
+                        "status": random.choice(list(models.ContentStatus)),
+                        "content_type": random.choice(["video", "audio", "image"]),
+                        "id_related": random.choice(parent_ids) if parent_ids else None,
+                        "job_id": random.choice(job_ids) if parent_ids else None,
+                        "created_at": now - i,
+                    }
+                    for i in range(count)
+                ],
+            )
+        ]
+
+    parent_ids = insert_content(rows // 3, None)
+    content_ids = parent_ids + insert_content(rows - rows // 3, parent_ids)
+    conn.execute(
+        models.ContentTags.__table__.insert(),
+        [
+            {"content_id": content_id, "tag_id": random.choice(tag_ids)}
+            for content_id in content_ids
+            for _ in range(2)
+        ],
+    )
+    conn.execute(
+        models.Machines.__table__.insert(),
+        [
+            {"job_id": job_id, "user_id": jobs[i]["user_id"], "provider": "vast"}
+            for i, job_id in enumerate(job_ids)
+        ],
+    )
+    conn.execute(
+        models.Invoices.__table__.insert(),
+        [
+            {
+                "user_id": random.choice(user_ids),
+                "session_id": f"cs_{i}",
+                "status": random.choice(["pending", "completed", "failed"]),
+                "created_at": now - i,
+            }
+            for i in range(rows // 4)
+        ],
+    )
+    for table in BIG_TABLES:
+        conn.execute(text(f"ANALYZE {table}"))
+    return user_ids[0], content_ids[0], job_ids[0], now
+
+
+def router_queries(user_id: int, content_id: int, job_id: int, now: int):
+    Content, Jobs, Invoices = models.Content, models.Jobs, models.Invoices
+    listing_status = or_(
+        Content.status == "completed",
+        Content.status == "indexing",
+        and_(Content.status == "cancelled", Content.created_at >= now),
+    )
+    related_status = or_(Content.status == "processing", Content.status == "completed")
+    invoice_status = or_(Invoices.status == "completed", Invoices.status == "pending")
+    return {
+        "content.get_content_table": select(Content)
+        .where(Content.user_id == user_id)
+        .where(Content.id_related == None)
+        .where(Content.content_type == "video")
+        .where(listing_status)
+        .order_by(Content.created_at.desc(), Content.id.desc())
+        .limit(12),
+        "content.get_content_table count": select(func.count(Content.id))
+        .where(Content.user_id == user_id)
+        .where(Content.id_related == None)
+        .where(or_(Content.status == "completed", Content.status == "indexing")),
+        "content.get_content_list_celery": content_with_tags()
+        .where(Content.user_id == user_id)
+        .where(Content.id_related == content_id)
+        .where(Content.content_type == "video")
+        .where(related_status)
+        .order_by(Content.created_at.desc(), Content.id.desc())
+        .limit(5),
+        "jobs.fetch_jobs": select(Jobs)
+        .where(Jobs.job_id == job_id)
+        .where(Jobs.key == "key0"),
+        "jobs.get_active_jobs": select(Jobs)
+        .where(Jobs.user_id == user_id)
+        .where(Jobs.job_status.in_(["Processing", "Loading", "Running"])),
+        "jobs.get_past_jobs": select(Jobs)
+        .where(Jobs.job_status != "Processing")
+        .where(Jobs.user_id == user_id)
+        .order_by(Jobs.created_at.desc(), Jobs.job_id.desc())
+        .limit(5),
+        "jobs content by job_id": select(Content.id).where(Content.job_id == job_id),
+        "jobs tags by job_id": select(models.ContentTags.tag_id).where(
+            models.ContentTags.content_id.in_(
+                select(Content.id).where(Content.job_id == job_id)
+            )
+        ),
+        "machines by job_id": select(models.Machines).where(
+            models.Machines.job_id == job_id
+        ),
+        "billing.get_invoices_task": select(Invoices)
+        .where(Invoices.user_id == user_id)
+        .where(invoice_status)
+        .order_by(Invoices.created_at.desc(), Invoices.id.desc())
+        .limit(10),
+        "billing.get_invoices_task count": select(func.count(Invoices.id))
+        .where(Invoices.user_id == user_id)
+        .where(invoice_status),
+        "billing.stripe_webhook": select(Invoices).where(Invoices.session_id == "cs_0"),
+    }
+
+
+def seq_scans(plan):
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in BIG_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    engine = create_db_engine()
+    failed = False
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            queries = router_queries(*seed(conn, args.rows))
+            for name, query in queries.items():
+                sql = query.compile(
+                    dialect=postgresql.dialect(),
+                    compile_kwargs={"literal_binds": True},
+                )
+                plan = conn.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"
+                ).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = seq_scans(plan[0]["Plan"])
+                runtime = plan[0]["Execution Time"]
+                result = f"SEQ SCAN on {', '.join(scans)}" if scans else "ok"
+                print(f"{name:<36} {runtime:9.2f} ms  {result}")
+                failed = failed or bool(scans)
+        finally:
+            transaction.rollback()
+    sys.exit(1 if failed else 0)
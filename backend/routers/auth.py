@@ -2,7 +2,6 @@ import sys
 
 sys.path.append("..")
 
-import ast
 import copy
 import json
 import os
@@ -18,7 +17,6 @@ from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi_limiter.depends import RateLimiter
 from fastapi_sso.sso.google import GoogleSSO
-from jose import jwt
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from starlette import status
@@ -27,11 +25,10 @@ from opentelemetry import trace
 
 import models
 from celeryworker import celeryapp
-from database import SessionLocal, engine
+from database import SessionLocal
 from utils import (
     GOOGLE_REDIRECT_URI,
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES,
-    JWT_ALGORITHM,
     JWT_REFRESH_SECRET,
     JWT_REFRESH_TOKEN_EXPIRE_MINUTES,
     JWT_SECRET,
@@ -41,15 +38,16 @@ from utils import (
     APP_ENV,
     create_access_token,
     create_refresh_token,
+    decode_token,
     forgotpassword_email,
-    get_hashed_password,
     hide_email,
     isValidEmail,
     logger,
     registration_email,
-    verify_password,
     logger,
 )
+from script_utils.password_pool import check_password, hash_password
+from script_utils.user_cache import get_user_versions, publish_user_versions
 
 load_dotenv()
 
@@ -57,8 +55,6 @@ router = APIRouter(
     prefix="/auth", tags=["auth"], responses={401: {"user": "Not authorized"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 
 def get_db():
     try:
@@ -110,6 +106,7 @@ class TokenData(BaseModel):
     user_id: int
     refreshVersion: int
     accessVersion: int
+    user_tier: Optional[str] = None
 
 
 class RefreshToken(BaseModel):
@@ -131,13 +128,13 @@ def user_exists(email: str, db: db_dependency):
     return True
 
 
-def authenticate_user(email: str, password: str, db: db_dependency):
+async def authenticate_user(email: str, password: str, db: db_dependency):
     user = db.query(models.Users).filter(models.Users.email == email).first()
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await check_password(password, user.hashed_password):
         return False
-    return True
+    return user
 
 
 def minutes_to_delta(minutes: int):
@@ -166,9 +163,8 @@ def get_current_user(db: db_dependency, token: str = Depends(oauth2_bearer)):
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    payload = ast.literal_eval(payload["sub"])
-    get_user = db.query(models.Users).filter(models.Users.id == payload["id"]).first()
+    payload = decode_token(token, JWT_SECRET)
+    get_user = get_user_versions(payload["id"], db)
     if not get_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -176,8 +172,8 @@ def get_current_user(db: db_dependency, token: str = Depends(oauth2_bearer)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     if (
-        get_user.refreshVersion != payload["refreshVersion"]
-        or get_user.accessVersion != payload["accessVersion"]
+        get_user["refreshVersion"] != payload["refreshVersion"]
+        or get_user["accessVersion"] != payload["accessVersion"]
     ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -188,24 +184,22 @@ def get_current_user(db: db_dependency, token: str = Depends(oauth2_bearer)):
         user_id=payload["id"],
         refreshVersion=payload["refreshVersion"],
         accessVersion=payload["accessVersion"],
+        user_tier=get_user["user_tier"],
     )
     return token_data
 
 
 def get_current_user_refresh(db: db_dependency, token: str = Depends(oauth2_bearer)):
     try:
-        payload = jwt.decode(token, JWT_REFRESH_SECRET, algorithms=[JWT_ALGORITHM])
-        payload = ast.literal_eval(payload["sub"])
-        get_user = (
-            db.query(models.Users).filter(models.Users.id == payload["id"]).first()
-        )
+        payload = decode_token(token, JWT_REFRESH_SECRET)
+        get_user = get_user_versions(payload["id"], db)
         if not get_user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User not found",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        if get_user.refreshVersion != payload["refreshVersion"]:
+        if get_user["refreshVersion"] != payload["refreshVersion"]:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password",
@@ -215,6 +209,7 @@ def get_current_user_refresh(db: db_dependency, token: str = Depends(oauth2_bear
             user_id=payload["id"],
             refreshVersion=payload["refreshVersion"],
             accessVersion=payload["accessVersion"],
+            user_tier=get_user["user_tier"],
         )
     except Exception as e:
         raise HTTPException(
@@ -225,7 +220,7 @@ def get_current_user_refresh(db: db_dependency, token: str = Depends(oauth2_bear
     return token_data
 
 
-def create_user_task(
+async def create_user_task(
     firstname: str,
     lastname: str,
     email: str,
@@ -244,7 +239,7 @@ def create_user_task(
             first_name=firstname,
             last_name=lastname,
             email=email,
-            hashed_password=get_hashed_password(password),
+            hashed_password=await hash_password(password),
             user_tier=user_tier,
             verified=False,
             google_login=google_login,
@@ -274,7 +269,6 @@ def create_user_task(
             storage_used=0,
             storage_limit=storage_limit,
             gpu_usage=0,
-            storage_json="""{"video":0, "audio":0, "image":0}""",
             created_at=created_at,
             updated_at=0,
         )
@@ -288,6 +282,8 @@ def create_user_task(
                 "email_token": email_token["token"],
             },
         }
+    except HTTPException:
+        raise
     except Exception as e:
         return {"detail": "Failed", "data": str(e)}
 
@@ -350,7 +346,7 @@ async def create_user(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="First name and last name cannot be more than 50 characters",
         )
-    result = create_user_task(
+    result = await create_user_task(
         create_user_request.firstname,
         create_user_request.lastname,
         create_user_request.email,
@@ -380,6 +376,7 @@ async def create_user(
         "id": get_user.id,
         "refreshVersion": get_user.refreshVersion,
         "accessVersion": get_user.accessVersion,
+        "user_tier": get_user.user_tier,
     }
     access_token = create_access_token(
         token_payload, expires_delta=timedelta(minutes=JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -447,15 +444,16 @@ async def create_user(
     }
 
 
-def login_user_task(email: str, password: str, db: db_dependency):
+async def login_user_task(email: str, password: str, db: db_dependency):
     try:
-        user = authenticate_user(email, password, db)
+        user = await authenticate_user(email, password, db)
         if user is False:
             return {"detail": "Failed", "data": "Invalid email or password"}
         if not user:
             return {"detail": "Failed", "data": "Invalid email or password"}
-        get_user = db.query(models.Users).filter(models.Users.email == email).first()
-        return {"detail": "Success", "data": int(get_user.id)}
+        return {"detail": "Success", "data": int(user.id)}
+    except HTTPException:
+        raise
     except Exception as e:
         return {"detail": "Failed", "data": str(e)}
 
@@ -471,7 +469,7 @@ async def login_user(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Session = Depends(get_db),
 ):
-    result = login_user_task(form_data.username, form_data.password, db)
+    result = await login_user_task(form_data.username, form_data.password, db)
     if result["detail"] == "Failed":
         logger.error(
             f"Failed to login user - {hide_email(form_data.username)}, data - {result['data']}"
@@ -479,11 +477,12 @@ async def login_user(
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=result["data"]
         )
-    user = db.query(models.Users).filter(models.Users.id == result["data"]).first()
+    user = db.get(models.Users, result["data"])
     user.refreshVersion += 1
     user.accessVersion += 1
     db.commit()
     db.refresh(user)
+    publish_user_versions(user)
     content = {
         "id": int(user.id),
         "firstname": user.first_name,
@@ -494,6 +493,7 @@ async def login_user(
         "id": user.id,
         "refreshVersion": user.refreshVersion,
         "accessVersion": user.accessVersion,
+        "user_tier": user.user_tier,
     }
     access_token = create_access_token(
         token_payload, expires_delta=timedelta(minutes=JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -564,6 +564,7 @@ def logout_user_task(user_id: int, db: db_dependency):
         user.refreshVersion += 1
         user.accessVersion += 1
         db.commit()
+        publish_user_versions(user)
         return {"detail": "Success", "data": "Logged out successfully"}
     except Exception as e:
         return {"detail": "Failed", "data": str(e)}
@@ -643,7 +644,7 @@ async def check_user(
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    payload = jwt.decode(auth_token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    payload = decode_token(auth_token, JWT_SECRET)
     result = verify_user_task(
         current_user.user_id, auth_token, int(payload["exp"]), rd, db
     )
@@ -669,6 +670,7 @@ def refresh_user_task(user_id: int, db: db_dependency):
                 "id": user.id,
                 "refreshVersion": user.refreshVersion,
                 "accessVersion": user.accessVersion + 1,
+                "user_tier": user.user_tier,
             }
         )
         newRefreshToken = create_refresh_token(
@@ -676,10 +678,12 @@ def refresh_user_task(user_id: int, db: db_dependency):
                 "id": user.id,
                 "refreshVersion": user.refreshVersion + 1,
                 "accessVersion": user.accessVersion + 1,
+                "user_tier": user.user_tier,
             }
         )
         user.accessVersion += 1
         db.commit()
+        publish_user_versions(user)
         return {
             "detail": "Success",
             "data": {"access_token": token, "refreshToken": newRefreshToken},
@@ -819,7 +823,6 @@ def google_callback_task(user_data: dict, db: db_dependency):
                 storage_used=0,
                 storage_limit=storage_limit,
                 gpu_usage=0,
-                storage_json="""{'video':0, 'audio':0, 'image':0}""",
                 created_at=created_at,
             )
             db.add(create_dashboard_model)
@@ -864,6 +867,7 @@ async def google_callback(
             "id": user_db.id,
             "refreshVersion": user_db.refreshVersion,
             "accessVersion": user_db.accessVersion,
+            "user_tier": user_db.user_tier,
         }
         access_token = create_access_token(
             token_payload,
@@ -1003,6 +1007,7 @@ def verify_email_task(
         user.email_token = None
         user.verified = True
         db.commit()
+        publish_user_versions(user)
         redis_key = "accessToken_" + str(user_id)
         rd.delete(redis_key)
         return {"detail": "Success", "data": "Email verified successfully"}
@@ -1070,8 +1075,11 @@ async def reset_password(reset_model: ResetPassword, db: Session = Depends(get_d
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="Password must be less than 50 characters",
         )
-    user.hashed_password = get_hashed_password(reset_model.password)
+    user.hashed_password = await hash_password(reset_model.password)
     user.forgotpassword_token = "{}"
+    user.refreshVersion += 1
+    user.accessVersion += 1
     db.add(user)
     db.commit()
+    publish_user_versions(user)
     return {"detail": "Success", "data": "Password reset complete"}
@@ -6,11 +6,13 @@ sys.path.append("..")
 from typing import Optional
 from fastapi import Depends, HTTPException, APIRouter, BackgroundTasks, status, Request
 import models
-from database import engine, SessionLocal
-from sqlalchemy import or_
+from database import engine, SessionLocal, AsyncSessionLocal
+from sqlalchemy import or_, select, func
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 import time
+import redis
 from celeryworker import celeryapp
 from routers.auth import get_current_user, TokenData
 import json
@@ -18,7 +20,6 @@ import os
 import requests
 import pystache
 from pathlib import Path
-from pyhtml2pdf import converter
 from fastapi_limiter.depends import RateLimiter
 import stripe
 from utils import TNSR_DOMAIN, STRIPE_SECRET_KEY, OPENEXCHANGERATES_API_KEY
@@ -28,16 +29,22 @@ from utils import (
     paymentsuccessfull_email,
     paymentfailed_email,
     increase_and_round,
+    REDIS_HOST,
+    REDIS_PORT,
 )
 from utils import logger
+from script_utils.pagination import (
+    encode_cursor,
+    get_cached_count,
+    keyset_filter,
+    set_cached_count,
+)
 
 
 router = APIRouter(
     prefix="/billing", tags=["billing"], responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 stripe.api_key = STRIPE_SECRET_KEY
 
 with open("script_utils/symbol.json") as f:
@@ -57,17 +64,32 @@ def get_db():
         db.close()
 
 
-def billing_task(id: int, db: Session):
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_redis():
+    try:
+        rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+        yield rd
+    finally:
+        rd.close()
+
+
+async def billing_task(id: int, db: AsyncSession):
     try:
-        user = db.query(models.Balance).filter(models.Balance.user_id == id).first()
-        user_details = db.query(models.Users).filter(models.Users.id == id).first()
+        user = await db.scalar(
+            select(models.Balance).where(models.Balance.user_id == id)
+        )
+        user_details = await db.get(models.Users, id)
         if not user:
             create_balance_model = models.Balance(
                 user_id=id, balance=0.0, lifetime_usage=0.0, created_at=int(time.time())
             )
             db.add(create_balance_model)
-            db.commit()
-            db.refresh(create_balance_model)
+            await db.commit()
+            await db.refresh(create_balance_model)
             data = sql_dict(create_balance_model)
             data["name"] = user_details.first_name
             return {
@@ -92,9 +114,10 @@ def billing_task(id: int, db: Session):
     dependencies=[Depends(RateLimiter(times=60, seconds=60))],
 )
 async def get_stats(
-    current_user: TokenData = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user: TokenData = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    result = billing_task(current_user.user_id, db)
+    result = await billing_task(current_user.user_id, db)
     if result["detail"] == "Success":
         logger.info(f"User {current_user.user_id} get balance")
         return result
@@ -443,9 +466,11 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
         )
 
 
-def get_invoices_task(user_id: int, limit: int, offset: int, db: Session):
+def get_invoices_task(
+    user_id: int, limit: int, offset: int, db: Session, rd=None, cursor=None
+):
     try:
-        invoices = (
+        invoices_query = (
             db.query(models.Invoices)
             .filter(models.Invoices.user_id == user_id)
             .filter(
@@ -454,25 +479,29 @@ def get_invoices_task(user_id: int, limit: int, offset: int, db: Session):
                     models.Invoices.status == "pending",
                 )
             )
-            .order_by(models.Invoices.created_at.desc())
-            .limit(limit)
-            .offset(offset)
-            .all()
+            .order_by(models.Invoices.created_at.desc(), models.Invoices.id.desc())
         )
-        all_invoices = (
-            db.query(models.Invoices)
-            .filter(models.Invoices.user_id == user_id)
-            .filter(
-                or_(
-                    models.Invoices.status == "completed",
-                    models.Invoices.status == "pending",
+        if cursor is not None:
+            invoices_query = invoices_query.filter(
+                keyset_filter(models.Invoices.created_at, models.Invoices.id, cursor)
+            )
+        else:
+            invoices_query = invoices_query.offset(offset)
+        invoices = invoices_query.limit(limit).all()
+        total_invoices, counts_generation = get_cached_count(rd, user_id, "invoices")
+        if total_invoices is None:
+            total_invoices = (
+                db.query(func.count(models.Invoices.id))
+                .filter(models.Invoices.user_id == user_id)
+                .filter(
+                    or_(
+                        models.Invoices.status == "completed",
+                        models.Invoices.status == "pending",
+                    )
                 )
+                .scalar()
             )
-            .all()
-        )
-        if invoices is None:
-            return {"detail": "Failed", "data": "Invoice not found"}
-        total_invoices = len(all_invoices)
+            set_cached_count(rd, user_id, "invoices", total_invoices, counts_generation)
         data = []
         for invoice in invoices:
             invoice_data = sql_dict(invoice)
@@ -497,7 +526,15 @@ def get_invoices_task(user_id: int, limit: int, offset: int, db: Session):
                 "payment_details": payment_details,
             }
             data.append(result)
-        return {"detail": "Success", "data": data, "total": total_invoices}
+        last = invoices[-1] if len(invoices) == limit else None
+        return {
+            "detail": "Success",
+            "data": data,
+            "total": total_invoices,
+            "next_cursor": (
+                encode_cursor(last.created_at, last.id) if last is not None else None
+            ),
+        }
     except Exception as e:
         return {"detail": "Failed", "data": str(e)}
 
@@ -510,13 +547,15 @@ def get_invoices_task(user_id: int, limit: int, offset: int, db: Session):
 async def get_invoices(
     limit: int = 5,
     offset: int = 0,
+    cursor: Optional[str] = None,
     current_user: TokenData = Depends(get_current_user),
     db: Session = Depends(get_db),
+    rd: redis.Redis = Depends(get_redis),
 ):
     if limit > 10:
         logger.error(f"User {current_user.user_id} get invoices failed - Limit > 10")
         raise HTTPException(status_code=400, detail="Limit cannot be greater than 10")
-    result = get_invoices_task(current_user.user_id, limit, offset, db)
+    result = get_invoices_task(current_user.user_id, limit, offset, db, rd, cursor)
     if result["detail"] == "Success":
         logger.info(f"User {current_user.user_id} get invoices")
         return result
@@ -608,6 +647,8 @@ async def download_invoice(
 ):
     result = download_invoice_task(current_user.user_id, invoice_id, db)
     if result["detail"] == "Success":
+        from pyhtml2pdf import converter
+
         path = os.path.abspath(f"invoice/{invoice_id}.html")
         converter.convert(f"file:///{path}", f"invoice/{invoice_id}.pdf", compress=True)
         background_tasks.add_task(remove_file, f"invoice/{invoice_id}.html")
@@ -1,17 +1,17 @@
 import sys
 
-from script_utils.util import niceBytes
+from script_utils.util import niceBytes, convert_seconds
 
 sys.path.append("..")
 
 from typing import Optional
 from fastapi import Depends, HTTPException, APIRouter, status
 import models
-from database import engine, SessionLocal
+from database import SessionLocal, AsyncSessionLocal
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, and_, select, func
 from pydantic import BaseModel, Field
-import boto3, botocore
 import redis
 from celeryworker import celeryapp
 from routers.auth import get_current_user, TokenData
@@ -22,23 +22,33 @@ from fastapi_limiter.depends import RateLimiter
 from utils import (
     REDIS_HOST,
     REDIS_PORT,
-    CLOUDFLARE_ACCESS_KEY,
-    CLOUDFLARE_SECRET_KEY,
-    CLOUDFLARE_ACCOUNT_ENDPOINT,
     CLOUDFLARE_METADATA,
     CLOUDFLARE_CONTENT,
     CONTENT_EXPIRE,
 )
-from utils import remove_key, logger, presigned_get, delete_r2_file
-from script_utils.util import bytes_to_mb
+from utils import (
+    remove_key,
+    logger,
+    r2_client,
+    presigned_get_many,
+    count_redis_round_trip,
+    CACHE_LOOKUPS,
+)
+from script_utils.signer import presign_get
+from script_utils.pagination import (
+    get_cached_count,
+    keyset_filter,
+    next_cursor,
+    set_cached_count,
+)
+from routers.dashboard import content_removed, increment_dashboard
+from script_utils.result_cache import release_r2_objects
 
 
 router = APIRouter(
     prefix="/content", tags=["content"], responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 
 def get_redis():
     try:
@@ -56,74 +66,29 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 class ContentDict(BaseModel):
     limit: int
     offset: int
     content_type: str
 
 
-def allTags(id: bool = False):
-    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
-    if id == False:
-        rd_key = "all_tags"
-    else:
-        rd_key = "all_tags_id"
-    if rd.exists(rd_key):
-        return json.loads(rd.get(rd_key).decode("utf-8"))
-    with Session(engine) as db:
-        tags = db.query(models.Tags).all()
-        all_tags = {}
-        if id == False:
-            for tag in tags:
-                all_tags[tag.tag] = {
-                    "id": int(tag.id),
-                    "readable": tag.readable,
-                }
-            rd.set(rd_key, json.dumps(all_tags))
-            return all_tags
-        else:
-            for tag in tags:
-                all_tags[int(tag.id)] = {
-                    "tag": tag.tag,
-                    "readable": tag.readable,
-                }
-            rd.set(rd_key, json.dumps(all_tags))
-            return all_tags
-
-
 def add_presigned(data, key, result_key, bucket, rd):
-    for x in data:
-        x[result_key] = presigned_get(x[key], bucket, rd)
+    urls = presigned_get_many([x[key] for x in data], bucket, rd)
+    for x, url in zip(data, urls):
+        x[result_key] = url
     return data
 
 
 def add_presigned_single(file_key, bucket, rd):
     try:
-        if rd is not None and rd.exists(file_key):
-            return rd.get(file_key).decode("utf-8")
-        r2_client = boto3.client(
-            "s3",
-            aws_access_key_id=CLOUDFLARE_ACCESS_KEY,
-            aws_secret_access_key=CLOUDFLARE_SECRET_KEY,
-            endpoint_url=CLOUDFLARE_ACCOUNT_ENDPOINT,
-            config=botocore.config.Config(
-                s3={"addressing_style": "path"},
-                signature_version="s3v4",
-                retries=dict(max_attempts=3),
-            ),
-        )
-        response = r2_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={
-                "Bucket": bucket,
-                "Key": file_key,
-            },
-            ExpiresIn=CONTENT_EXPIRE,
-        )
-        if rd is not None:
-            rd.set(file_key, response)
-            rd.expire(file_key, CONTENT_EXPIRE - 43200)
-        return response
+        if rd is None:
+            return presign_get(file_key, bucket, CONTENT_EXPIRE)
+        return presigned_get_many([file_key], bucket, rd, CONTENT_EXPIRE - 43200)[0]
     except Exception as e:
         return None
 
@@ -131,23 +96,16 @@ def add_presigned_single(file_key, bucket, rd):
 def get_object_data(file_key, bucket, rd):
     try:
         redis_key = file_key + "_object"
-        if rd.exists(redis_key):
-            return json.loads(rd.get(redis_key).decode("utf-8"))
-        r2_client = boto3.client(
-            "s3",
-            aws_access_key_id=CLOUDFLARE_ACCESS_KEY,
-            aws_secret_access_key=CLOUDFLARE_SECRET_KEY,
-            endpoint_url=CLOUDFLARE_ACCOUNT_ENDPOINT,
-            config=botocore.config.Config(
-                s3={"addressing_style": "path"},
-                signature_version="s3v4",
-                retries=dict(max_attempts=3),
-            ),
-        )
+        cached = rd.get(redis_key)
+        count_redis_round_trip()
+        if cached is not None:
+            CACHE_LOOKUPS.labels(cache="object", result="hit").inc()
+            return json.loads(cached.decode("utf-8"))
+        CACHE_LOOKUPS.labels(cache="object", result="miss").inc()
         response = r2_client.head_object(Bucket=bucket, Key=file_key)
         response = response["ResponseMetadata"]
-        rd.set(redis_key, json.dumps(response))
-        rd.expire(redis_key, CONTENT_EXPIRE - 60)
+        rd.set(redis_key, json.dumps(response), ex=CONTENT_EXPIRE - 60)
+        count_redis_round_trip()
         return response
     except Exception as e:
         return None
@@ -161,18 +119,24 @@ def filter_data(data):
                 del x[key]
         if x["size"] is not None:
             x["size"] = niceBytes(x["size"])
+        if x.get("duration") is not None:
+            x["duration"] = convert_seconds(int(x["duration"]))
+        if x.get("hz") is not None:
+            x["hz"] = f"{x['hz']:g}"
     return data
 
 
-def get_content_table(user_id, table_name, limit, offset, db):
+async def get_content_table(
+    user_id, table_name, limit, offset, db: AsyncSession, rd=None, cursor=None
+):
     try:
         current_time = int(time.time()) - 60
-        get_table = (
-            db.query(models.Content)
-            .filter(models.Content.user_id == user_id)
-            .filter(models.Content.id_related == None)
-            .filter(models.Content.content_type == table_name)
-            .filter(
+        table_query = (
+            select(models.Content)
+            .where(models.Content.user_id == user_id)
+            .where(models.Content.id_related == None)
+            .where(models.Content.content_type == table_name)
+            .where(
                 or_(
                     models.Content.status == "completed",
                     models.Content.status == "indexing",
@@ -182,30 +146,41 @@ def get_content_table(user_id, table_name, limit, offset, db):
                     ),
                 )
             )
-            .order_by(models.Content.created_at.desc())
+            .order_by(models.Content.created_at.desc(), models.Content.id.desc())
             .limit(limit)
-            .offset(offset)
-            .all()
         )
-        user_data = db.query(models.Users).filter(models.Users.id == user_id).first()
+        if cursor is not None:
+            table_query = table_query.where(
+                keyset_filter(models.Content.created_at, models.Content.id, cursor)
+            )
+        else:
+            table_query = table_query.offset(offset)
+        get_table = await db.scalars(table_query)
+        user_data = await db.get(models.Users, user_id)
         if user_data.verified == False:
             return {"detail": "Failed", "data": "User not verified"}
-        all_result = [x.__dict__ for x in get_table]
+        all_result = [x.__dict__ for x in get_table.all()]
         remove_key(all_result, "_sa_instance_state")
 
-        get_counts = (
-            db.query(models.Content)
-            .filter(models.Content.user_id == user_id)
-            .filter(models.Content.id_related == None)
-            .filter(
-                or_(
-                    models.Content.status == "completed",
-                    models.Content.status == "indexing",
+        get_counts, counts_generation = get_cached_count(rd, user_id, "content")
+        if get_counts is None:
+            get_counts = await db.scalar(
+                select(func.count(models.Content.id))
+                .where(models.Content.user_id == user_id)
+                .where(models.Content.id_related == None)
+                .where(
+                    or_(
+                        models.Content.status == "completed",
+                        models.Content.status == "indexing",
+                    )
                 )
             )
-            .count()
-        )
-        return {"detail": "Success", "data": [all_result, get_counts]}
+            set_cached_count(rd, user_id, "content", get_counts, counts_generation)
+        return {
+            "detail": "Success",
+            "data": [all_result, get_counts],
+            "next_cursor": next_cursor(all_result, limit),
+        }
     except Exception as e:
         return {"detail": "Failed", "data": "Unable to fetch content"}
 
@@ -217,28 +192,35 @@ def get_content_table(user_id, table_name, limit, offset, db):
 )
 async def get_content(
     limit: int,
-    offset: int,
     content_type: str,
+    offset: int = 0,
+    cursor: Optional[str] = None,
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     rd: redis.Redis = Depends(get_redis),
 ):
     try:
         if limit > 12:
             logger.error("Limit cannot be more than 12")
             raise HTTPException(status_code=400, detail="Limit cannot be more than 10")
-        result_ = get_content_table(
-            current_user.user_id, content_type, limit, offset, db
+        result_ = await get_content_table(
+            current_user.user_id, content_type, limit, offset, db, rd, cursor
         )
         if result_["detail"] == "Failed":
             logger.error("Unable to fetch content")
             raise HTTPException(status_code=400, detail="Unable to fetch content")
+        cursor_ = result_.get("next_cursor")
         result_ = result_["data"]
         result = add_presigned(
             result_[0], "thumbnail", "thumbnail_link", CLOUDFLARE_METADATA, rd
         )
         result = filter_data(result)
-        result = {"data": result, "detail": "Success", "total": result_[1]}
+        result = {
+            "data": result,
+            "detail": "Success",
+            "total": result_[1],
+            "next_cursor": cursor_,
+        }
         logger.info("Content fetched successfully")
         return result
     except Exception as e:
@@ -248,132 +230,118 @@ async def get_content(
         )
 
 
-def get_content_list_celery(
-    db: Session,
+def content_with_tags():
+    tags = func.aggregate_strings(models.Tags.readable, ",")
+    return (
+        select(models.Content, tags.label("tags"))
+        .outerjoin(
+            models.ContentTags, models.ContentTags.content_id == models.Content.id
+        )
+        .outerjoin(models.Tags, models.Tags.id == models.ContentTags.tag_id)
+        .group_by(models.Content.id)
+    )
+
+
+async def get_content_list_celery(
+    db: AsyncSession,
     content_id: int,
     content_type: str,
     user_id: int,
     limit: int = 5,
     offset: int = 0,
+    rd=None,
+    cursor: Optional[str] = None,
 ):
     try:
-        get_counts = (
-            db.query(models.Content)
-            .filter(models.Content.user_id == user_id)
-            .filter(models.Content.id_related == content_id)
-            .filter(models.Content.content_type == content_type)
-            .filter(
-                or_(
-                    models.Content.status == "processing",
-                    models.Content.status == "completed",
+        count_field = f"related_{content_type}_{content_id}"
+        get_counts, counts_generation = get_cached_count(rd, user_id, count_field)
+        if get_counts is None:
+            get_counts = (
+                await db.scalar(
+                    select(func.count(models.Content.id))
+                    .where(models.Content.user_id == user_id)
+                    .where(models.Content.id_related == content_id)
+                    .where(models.Content.content_type == content_type)
+                    .where(
+                        or_(
+                            models.Content.status == "processing",
+                            models.Content.status == "completed",
+                        )
+                    )
                 )
+                + 1
             )
-            .count()
-            + 1
+            set_cached_count(rd, user_id, count_field, get_counts, counts_generation)
+        get_main = await db.scalar(
+            select(models.Content)
+            .where(models.Content.user_id == user_id)
+            .where(models.Content.id == content_id)
+            .where(models.Content.content_type == content_type)
         )
-        get_main = (
-            db.query(models.Content)
-            .filter(models.Content.user_id == user_id)
-            .filter(models.Content.id == content_id)
-            .filter(models.Content.content_type == content_type)
-            .first()
-        )
-        user_data = db.query(models.Users).filter(models.Users.id == user_id).first()
+        user_data = await db.get(models.Users, user_id)
         if user_data.verified == False:
             return {"detail": "Failed", "data": "User not verified"}
         if get_main is None:
             return {"detail": "Failed", "data": "Unable to fetch content"}
         main_title = get_main.title
-        if offset == 0:
-            get_main = (
-                db.query(models.Content)
-                .filter(models.Content.user_id == user_id)
-                .filter(models.Content.id == content_id)
-                .filter(models.Content.content_type == content_type)
-                .first()
-            )
-            if get_main is None:
-                return {"detail": "Failed", "data": "Unable to fetch content"}
-            get_related = (
-                db.query(models.Content)
-                .filter(models.Content.user_id == user_id)
-                .filter(models.Content.id_related == content_id)
-                .filter(
+        if offset == 0 and cursor is None:
+            related_query = (
+                content_with_tags()
+                .where(
                     or_(
-                        models.Content.status == "processing",
-                        models.Content.status == "completed",
+                        models.Content.id == content_id,
+                        and_(
+                            models.Content.user_id == user_id,
+                            models.Content.id_related == content_id,
+                            or_(
+                                models.Content.status == "processing",
+                                models.Content.status == "completed",
+                            ),
+                        ),
                     )
                 )
-                .order_by(models.Content.created_at.desc())
-                .limit(limit - 1)
-                .offset(offset)
-                .all()
-            )
-            result = [get_main.__dict__]
-            for x in get_related:
-                result.append(x.__dict__)
-            remove_key(result, "_sa_instance_state")
-            all_tags = allTags(id=True)
-            for x in result:
-                tags_query = (
-                    db.query(models.ContentTags)
-                    .filter(models.ContentTags.content_id == int(x["id"]))
-                    .all()
+                .order_by(
+                    (models.Content.id == content_id).desc(),
+                    models.Content.created_at.desc(),
+                    models.Content.id.desc(),
                 )
-                all_content_tags = []
-                for y in tags_query:
-                    all_content_tags.append(y.tag_id)
-                x["tags"] = []
-                for tag in all_content_tags:
-                    x["tags"].append((all_tags[str(tag)]["readable"]))
-                x["tags"] = ",".join(x["tags"])
-            return {
-                "detail": "Success",
-                "data": result,
-                "total": get_counts,
-                "title": main_title,
-            }
+                .limit(limit)
+            )
         else:
-            get_related = (
-                db.query(models.Content)
-                .filter(models.Content.user_id == user_id)
-                .filter(models.Content.id_related == content_id)
-                .filter(models.Content.content_type == content_type)
-                .filter(
+            related_query = (
+                content_with_tags()
+                .where(models.Content.user_id == user_id)
+                .where(models.Content.id_related == content_id)
+                .where(models.Content.content_type == content_type)
+                .where(
                     or_(
                         models.Content.status == "processing",
                         models.Content.status == "completed",
                     )
                 )
-                .order_by(models.Content.created_at.desc())
+                .order_by(models.Content.created_at.desc(), models.Content.id.desc())
                 .limit(limit)
-                .offset(offset - 1)
-                .all()
             )
-            result = []
-            for x in get_related:
-                result.append(x.__dict__)
-            remove_key(result, "_sa_instance_state")
-            all_tags = allTags(id=True)
-            for x in result:
-                tags_query = (
-                    db.query(models.ContentTags)
-                    .filter(models.ContentTags.content_id == int(x["id"]))
-                    .all()
+            if cursor is not None:
+                related_query = related_query.where(
+                    keyset_filter(models.Content.created_at, models.Content.id, cursor)
                 )
-                all_content_tags = []
-                for y in tags_query:
-                    all_content_tags.append(y.tag_id)
-                x["tags"] = []
-                for tag in all_content_tags:
-                    x["tags"].append((all_tags[str(tag)]["readable"]))
-                x["tags"] = ",".join(x["tags"])
-            return {
-                "detail": "Success",
-                "data": result,
-                "total": get_counts,
-                "title": main_title,
-            }
+            else:
+                related_query = related_query.offset(offset - 1)
+        result = []
+        for content, tags in (await db.execute(related_query)).all():
+            row = dict(content.__dict__)
+            row["tags"] = tags or ""
+            result.append(row)
+        remove_key(result, "_sa_instance_state")
+        related = [x for x in result if x["id"] != content_id]
+        return {
+            "detail": "Success",
+            "data": result,
+            "total": get_counts,
+            "title": main_title,
+            "next_cursor": next_cursor(related, limit - len(result) + len(related)),
+        }
     except Exception as e:
         return {"detail": "Failed", "data": "Unable to fetch content"}
 
@@ -385,19 +353,27 @@ def get_content_list_celery(
 )
 async def get_content_list(
     limit: int,
-    offset: int,
     content_id: int,
     content_type: str,
+    offset: int = 0,
+    cursor: Optional[str] = None,
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     rd: redis.Redis = Depends(get_redis),
 ):
     if limit > 5:
         logger.error("Limit cannot be more than 5")
         raise HTTPException(status_code=400, detail="Limit cannot be more than 5")
     try:
-        result = get_content_list_celery(
-            db, content_id, content_type, current_user.user_id, limit, offset
+        result = await get_content_list_celery(
+            db,
+            content_id,
+            content_type,
+            current_user.user_id,
+            limit,
+            offset,
+            rd,
+            cursor,
         )
         if result["detail"] == "Failed":
             logger.error("Unable to fetch content - " + str(result["data"]))
@@ -487,7 +463,7 @@ def download_complete_task(
         if obj_data is None:
             return {"detail": "Failed", "data": "Unable to fetch content"}
         size = obj_data["HTTPHeaders"]["content-length"]
-        user_dashboard.downloads += int(size)
+        increment_dashboard(db, user_id, downloads=int(size))
         db.commit()
         return {"detail": "Success", "data": "Download complete"}
     except Exception as e:
@@ -594,11 +570,6 @@ def delete_content_task(content_id: int, content_type: str, user_id: int, db: Se
             )
             if int(main_tag[0].tag_id) == 1:
                 return {"detail": "Failed", "data": "Main File can't be deleted"}
-            dashboard_user = (
-                db.query(models.Dashboard)
-                .filter(models.Dashboard.user_id == user_id)
-                .first()
-            )
             job_data = (
                 db.query(models.Jobs)
                 .filter(models.Jobs.content_id == content_id)
@@ -622,39 +593,6 @@ def delete_content_task(content_id: int, content_type: str, user_id: int, db: Se
             db.commit()
             attached_content.append(main_file)
             for all_content in attached_content:
-                file_size = "".join(
-                    [x for x in all_content.size if x.isdigit() or x == "."]
-                )
-                if content_type == "video":
-                    dashboard_user.video_processed = (
-                        int(dashboard_user.video_processed) - 1
-                    )
-                    storageJSON = json.loads(dashboard_user.storage_json)
-                    storageJSON["video"] = float(storageJSON["video"]) - bytes_to_mb(
-                        float(file_size)
-                    )
-                    dashboard_user.storage_json = json.dumps(storageJSON)
-                elif content_type == "audio":
-                    dashboard_user.audio_processed = (
-                        int(dashboard_user.audio_processed) - 1
-                    )
-                    storageJSON = json.loads(dashboard_user.storage_json)
-                    storageJSON["audio"] = float(storageJSON["audio"]) - bytes_to_mb(
-                        float(file_size)
-                    )
-                    dashboard_user.storage_json = json.dumps(storageJSON)
-                elif content_type == "image":
-                    dashboard_user.image_processed = (
-                        int(dashboard_user.image_processed) - 1
-                    )
-                    storageJSON = json.loads(dashboard_user.storage_json)
-                    storageJSON["image"] = float(storageJSON["image"]) - bytes_to_mb(
-                        float(file_size)
-                    )
-                    dashboard_user.storage_json = json.dumps(storageJSON)
-                dashboard_user.storage_used = float(
-                    dashboard_user.storage_used
-                ) - float(file_size)
                 if str(all_content.status) == "processing":
                     return {"detail": "Failed", "data": "Running Job Found"}
                 related_tags = (
@@ -664,15 +602,14 @@ def delete_content_task(content_id: int, content_type: str, user_id: int, db: Se
                 )
                 for tag in related_tags:
                     db.delete(tag)
-                if str(all_content.status) == "completed":
-                    delete_r2_file.delay(all_content.link, CLOUDFLARE_CONTENT)
-                    delete_r2_file.delay(all_content.thumbnail, CLOUDFLARE_METADATA)
                 db.delete(all_content)
             for tag in main_tag:
                 db.delete(tag)
             if job_data != None:
                 db.delete(job_data)
             db.delete(main_file)
+            release_r2_objects(db, attached_content)
+            content_removed(db, user_id, attached_content)
             db.commit()
             return {"detail": "Success", "data": "Project Deleted"}
         else:
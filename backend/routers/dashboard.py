@@ -6,8 +6,13 @@ from typing import Annotated
 from fastapi import Depends, HTTPException, APIRouter, Response
 import models
 import time
-from database import engine, SessionLocal
+import json
+from collections import defaultdict
+from celeryworker import celeryapp
+from database import engine, SessionLocal, AsyncSessionLocal
+from sqlalchemy import and_, func, not_, or_, select, update
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from routers.auth import TokenData, get_current_user
 from utils import sql_dict, logger
@@ -22,9 +27,6 @@ router = APIRouter(
 )
 
 
-models.Base.metadata.create_all(bind=engine)
-
-
 def get_db():
     try:
         db = SessionLocal()
@@ -33,20 +35,132 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 db_dependency = Annotated[Session, Depends(get_db)]
 
+STORAGE_COLUMNS = {
+    "video": "storage_video_bytes",
+    "audio": "storage_audio_bytes",
+    "image": "storage_image_bytes",
+}
+
+# Subtitles and stem archives are stored under their parent's content type
+# but never counted as processed media.
+COUNTED_CONTENT = and_(
+    models.Content.status == "completed",
+    models.Content.content_type.in_(list(STORAGE_COLUMNS)),
+    not_(
+        or_(
+            models.Content.title.like("%.srt"),
+            models.Content.title.like("%.zip"),
+        )
+    ),
+)
+
+
+def counts_towards_storage(content: models.Content) -> bool:
+    return (
+        str(content.status) == "completed"
+        and content.content_type in STORAGE_COLUMNS
+        and not str(content.title).endswith((".srt", ".zip"))
+    )
+
+
+def increment_dashboard(db: Session, user_id: int, **deltas):
+    values = {
+        name: getattr(models.Dashboard, name) + int(delta)
+        for name, delta in deltas.items()
+        if delta
+    }
+    if not values:
+        return
+    values["updated_at"] = int(time.time())
+    db.execute(
+        update(models.Dashboard)
+        .where(models.Dashboard.user_id == user_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
 
-def create_balance(db, user_id: int):
+def content_added(db: Session, user_id: int, content_type: str, size: int):
+    increment_dashboard(
+        db,
+        user_id,
+        uploads=size,
+        storage_used=size,
+        **{f"{content_type}_processed": 1, STORAGE_COLUMNS[content_type]: size},
+    )
+
+
+def content_removed(db: Session, user_id: int, contents: list):
+    deltas = defaultdict(int)
+    for content in contents:
+        if not counts_towards_storage(content):
+            continue
+        size = int(content.size or 0)
+        deltas[f"{content.content_type}_processed"] -= 1
+        deltas[STORAGE_COLUMNS[content.content_type]] -= size
+        deltas["storage_used"] -= size
+    increment_dashboard(db, user_id, **deltas)
+
+
+def reconcile_dashboard(db: Session, user_id: int = None):
+    totals_query = (
+        select(
+            models.Content.user_id,
+            models.Content.content_type,
+            func.count(models.Content.id),
+            func.coalesce(func.sum(models.Content.size), 0),
+        )
+        .where(COUNTED_CONTENT)
+        .group_by(models.Content.user_id, models.Content.content_type)
+    )
+    dashboards_query = select(models.Dashboard.user_id)
+    if user_id is not None:
+        totals_query = totals_query.where(models.Content.user_id == user_id)
+        dashboards_query = dashboards_query.where(models.Dashboard.user_id == user_id)
+    totals = defaultdict(dict)
+    for owner, content_type, count, size in db.execute(totals_query):
+        totals[owner][content_type] = (int(count), int(size))
+    rows = []
+    for (owner,) in db.execute(dashboards_query):
+        row = {"user_id": owner, "storage_used": 0, "updated_at": int(time.time())}
+        for content_type, column in STORAGE_COLUMNS.items():
+            count, size = totals[owner].get(content_type, (0, 0))
+            row[f"{content_type}_processed"] = count
+            row[column] = size
+            row["storage_used"] += size
+        rows.append(row)
+    if rows:
+        db.execute(update(models.Dashboard), rows)
+    db.commit()
+    return len(rows)
+
+
+@celeryapp.task(name="routers.dashboard.reconcile_dashboard_celery", acks_late=True)
+def reconcile_dashboard_celery(user_id: int = None):
+    with Session(engine) as db:
+        updated = reconcile_dashboard(db, user_id)
+        logger.info(f"Reconciled {updated} dashboards")
+        return {"detail": "Success", "data": updated}
+
+
+async def create_balance(db: AsyncSession, user_id: int):
     balance = models.Balance(
         user_id=user_id, balance=0.0, lifetime_usage=0.0, created_at=int(time.time())
     )
     db.add(balance)
-    db.commit()
-    db.refresh(balance)
+    await db.commit()
+    await db.refresh(balance)
     return balance
 
 
-def create_dashboard(db, user_id: int, storage_limit: int):
+async def create_dashboard(db: AsyncSession, user_id: int, storage_limit: int):
     dashboard = models.Dashboard(
         user_id=user_id,
         video_processed=0,
@@ -57,33 +171,40 @@ def create_dashboard(db, user_id: int, storage_limit: int):
         storage_used=0,
         storage_limit=storage_limit,
         gpu_usage=0,
-        storage_json="""{'video':0, 'audio':0, 'image':0}""",
         created_at=int(time.time()),
     )
     db.add(dashboard)
-    db.commit()
-    db.refresh(dashboard)
+    await db.commit()
+    await db.refresh(dashboard)
     return dashboard
 
 
-def dashboard_task(id: int, db: Session):
+async def dashboard_task(id: int, db: AsyncSession):
     try:
-        user = db.query(models.Dashboard).filter(models.Dashboard.user_id == id).first()
-        user_details = db.query(models.Users).filter(models.Users.id == id).first()
-        user_balance = (
-            db.query(models.Balance).filter(models.Balance.user_id == id).first()
+        user = await db.scalar(
+            select(models.Dashboard).where(models.Dashboard.user_id == id)
+        )
+        user_details = await db.get(models.Users, id)
+        user_balance = await db.scalar(
+            select(models.Balance).where(models.Balance.user_id == id)
         )
 
         if user_balance is None:
-            user_balance = create_balance(db, id)
+            user_balance = await create_balance(db, id)
 
         if user is None:
             storage_limit = STORAGE_LIMITS.get(
                 user_details.user_tier, STORAGE_LIMITS["free"]
             )
-            user = create_dashboard(db, id, storage_limit)
+            user = await create_dashboard(db, id, storage_limit)
 
         data = sql_dict(user)
+        data["storage_json"] = json.dumps(
+            {
+                content_type: bytes_to_mb(data.get(column) or 0)
+                for content_type, column in STORAGE_COLUMNS.items()
+            }
+        )
         data["name"] = user_details.first_name
         data["balance"] = round(float(user_balance.balance), 2)
         return {
@@ -101,9 +222,10 @@ def dashboard_task(id: int, db: Session):
     dependencies=[Depends(RateLimiter(times=60, seconds=60))],
 )
 async def get_stats(
-    current_user: TokenData = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user: TokenData = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    result = dashboard_task(current_user.user_id, db)
+    result = await dashboard_task(current_user.user_id, db)
     if result["detail"] == "Success":
         logger.info(f"Dashboard stats for {current_user.user_id}")
         result["data"]["downloads"] = nice_unit(niceBytes(result["data"]["downloads"]))
@@ -5,7 +5,7 @@ sys.path.append("..")
 from typing import Optional
 from fastapi import Depends, HTTPException, APIRouter
 import models
-from database import engine, SessionLocal
+from database import SessionLocal
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 from script_utils.util import *
@@ -26,8 +26,6 @@ router = APIRouter(
     prefix="/dev", tags=["dev"], responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 
 def get_db():
     try:
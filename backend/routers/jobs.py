@@ -5,13 +5,16 @@ sys.path.append("..")
 import asyncio
 import base64
 import binascii
+import functools
 import hashlib
+import hmac
 import json
 import time
-from typing import Annotated, Optional
+from typing import Annotated, Any, Literal, Optional
 
 import hruid
 import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
 from fastapi import (
     APIRouter,
@@ -22,55 +25,59 @@ from fastapi import (
     status,
 )
 import math
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, select, func
 from fastapi_limiter.depends import RateLimiter
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-import copy
+from sqlalchemy.ext.asyncio import AsyncSession
 from pathlib import Path
 from humanfriendly import format_timespan
 
 import models
-from database import SessionLocal, engine
+from database import AsyncSessionLocal, SessionLocal, engine
 from routers.auth import TokenData, get_current_user
-from routers.content import add_presigned_single, allTags
+from routers.content import add_presigned_single
+from script_utils.pagination import (
+    get_cached_count,
+    keyset_filter,
+    next_cursor,
+    set_cached_count,
+)
 from script_utils.util import *
+from script_utils import progress_hub, scheduler
+from script_utils.providers import aterminate_instance, runpod_client, vast_client
+from script_utils.warm_pool import (
+    WARM_POOL_DISK,
+    WARM_POOL_JOB_TYPE,
+    claim_idle_machine,
+)
 from utils import (
     CLOUDFLARE_METADATA,
     CLOUDFLARE_CONTENT,
     IMAGE_MODELS,
     MODEL_COMPUTE,
-    GPU_PROVIDER,
-    CUDA,
 )
 from utils import (
+    allTags,
     remove_key,
     sql_dict,
     job_presigned_get,
     job_email,
     send_discord_update,
 )
-import replicate
-from celery.exceptions import TaskRevokedError
 from celery.contrib.abortable import AbortableTask
 from routers.reindex_job import reindex_image_job
+from routers.dashboard import content_added, counts_towards_storage, increment_dashboard
+from script_utils.result_cache import (
+    apply_processing_result,
+    find_processing_result,
+    processing_result_key,
+    record_processing_result,
+)
 from routers.upload import generate_new_filename, index_media_task
 from database import SessionLocal, engine
 import models
 import asyncio
-import numpy as np
-from script_utils.util import duration_to_seconds
-from script_utils.vast import get_listing
-from script_utils.gpu_workers import (
-    get_gpu_listing,
-    VastAI,
-    RunpodIO,
-    VAST_KEY,
-    RUNPOD_KEY,
-)
-import pandas as pd
-import runpod
-from humanfriendly import parse_timespan
 
 
 load_dotenv()
@@ -80,8 +87,6 @@ router = APIRouter(
     prefix="/jobs", tags=["jobs"], responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 
 def get_db():
     try:
@@ -91,6 +96,11 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def get_redis():
     try:
         rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
@@ -130,6 +140,16 @@ class JobStatus(BaseModel):
     job_key: str
 
 
+class JobProgress(BaseModel):
+    job_id: int
+    key: str
+    event: Literal["progress", "heartbeat"] = "progress"
+    model: Optional[str] = None
+    status: Optional[str] = None
+    chunk: Optional[str] = None
+    progress: Optional[int] = None
+
+
 class JobEstimate(BaseModel):
     content_id: int
     job_config: dict
@@ -245,12 +265,132 @@ def create_content_entry(config: dict, db: Session, user_id: int, job_id: int):
         raise HTTPException(status_code=400, detail="Unable to create content entry")
 
 
+REPLICATE_WEBHOOK_URL = os.getenv(
+    "REPLICATE_WEBHOOK_URL", "https://backend.tnsr.ai/jobs/replicate_webhook"
+)
+# Signs the tokens in the webhook URLs Replicate calls back. Without it image
+# jobs fail instead of being submitted with guessable callbacks.
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET")
+# A prediction that hasn't called back by then is checked directly.
+REPLICATE_PREDICTION_TIMEOUT = 400
+REPLICATE_CHAIN_TTL = 86400
+
+
+class ReplicatePrediction(BaseModel):
+    id: str
+    status: str
+    output: Optional[Any] = None
+    error: Optional[Any] = None
+
+
+@functools.lru_cache(maxsize=None)
+def replicate_version(model_tag: str):
+    import replicate
+
+    model_name, tag = model_tag.split(":")
+    return replicate.models.get(model_name).versions.get(tag)
+
+
+def replicate_chain_key(job_id: int):
+    return f"replicate_chain_{job_id}"
+
+
+def replicate_webhook_token(job_id: int, step: int):
+    if not REPLICATE_WEBHOOK_SECRET:
+        raise Exception("REPLICATE_WEBHOOK_SECRET is not set")
+    return hmac.new(
+        REPLICATE_WEBHOOK_SECRET.encode("utf-8"),
+        f"{job_id}:{step}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def image_filter_params(filter_: str, model_config: dict, content_url: str):
+    params = {"seed": 1999, "image": content_url}
+    if "params" in IMAGE_MODELS[filter_].keys():
+        for x in IMAGE_MODELS[filter_]["params"]:
+            params[x] = model_config[IMAGE_MODELS[filter_]["params"][x]]
+    return params
+
+
+def store_prediction_id(rd, job_id: int, step: int, prediction_id: str):
+    # Only while the chain is still at this step: the webhook may already
+    # have moved it on.
+    key = replicate_chain_key(job_id)
+    with rd.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                chain = pipe.get(key)
+                if chain is None or json.loads(chain)["step"] != step:
+                    return False
+                chain = json.loads(chain)
+                chain["prediction_id"] = prediction_id
+                pipe.multi()
+                pipe.set(key, json.dumps(chain), ex=REPLICATE_CHAIN_TTL)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+
+def submit_image_filter(rd, chain: dict, content_url: str):
+    # Replicate calls back when the prediction finishes, so no worker waits on it.
+    import replicate
+
+    job_id = chain["job_config"]["job_id"]
+    step = chain["step"]
+    filter_ = chain["filters"][step]
+    model_config = chain["job_config"]["config_json"]["job_data"]["filters"][filter_]
+    # A fast prediction can call back before create() returns, so the chain
+    # has to be at the new step before the prediction exists.
+    chain["prediction_id"] = None
+    rd.set(replicate_chain_key(job_id), json.dumps(chain), ex=REPLICATE_CHAIN_TTL)
+    prediction = replicate.predictions.create(
+        version=replicate_version(IMAGE_MODELS[filter_]["model"]),
+        input=image_filter_params(filter_, model_config, content_url),
+        webhook=f"{REPLICATE_WEBHOOK_URL}?job_id={job_id}&step={step}"
+        f"&token={replicate_webhook_token(job_id, step)}",
+        webhook_events_filter=["completed"],
+    )
+    chain["prediction_id"] = prediction.id
+    store_prediction_id(rd, job_id, step, prediction.id)
+    image_prediction_done.apply_async(
+        (job_id, step), countdown=REPLICATE_PREDICTION_TIMEOUT
+    )
+
+
+def fail_image_job(db: Session, job_config: dict):
+    db.rollback()
+    content = (
+        db.query(models.Content)
+        .filter(models.Content.id == job_config["content_id"])
+        .filter(models.Content.user_id == job_config["user_id"])
+        .filter(models.Content.content_type == job_config["job_type"])
+        .first()
+    )
+    if content is not None:
+        content.status = "failed"
+        content.updated_at = int(time.time())
+        db.add(content)
+    job = (
+        db.query(models.Jobs).filter(models.Jobs.job_id == job_config["job_id"]).first()
+    )
+    job.job_status = "Failed"
+    job.job_process = "error"
+    # Frees the job's slot in the replicate lane.
+    job.job_key = False
+    job.updated_at = int(time.time())
+    db.add(job)
+    db.commit()
+
+
 @celeryapp.task(
     name="routers.jobs.image_process", acks_late=True, bind=True, base=AbortableTask
 )
 def image_process_task(self, job_config: dict):
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
     with Session(engine) as db:
-        prediction = None
         try:
             main_content = (
                 db.query(models.Content)
@@ -265,14 +405,15 @@ def image_process_task(self, job_config: dict):
             )
             if main_content is None:
                 raise Exception("Content not found")
-            content_url = job_presigned_get(main_content.link, CLOUDFLARE_CONTENT)
-            copy_content_url = copy.copy(content_url)
-            start_time = int(time.time())
-            dashboard = (
-                db.query(models.Dashboard)
-                .filter(models.Dashboard.user_id == job_config["user_id"])
+            job = (
+                db.query(models.Jobs)
+                .filter(models.Jobs.job_id == job_config["job_id"])
                 .first()
             )
+            # Cancelled before a worker picked it up.
+            if job is None or not job.job_key:
+                return {"detail": "Failed", "data": "Job cancelled"}
+            content_url = job_presigned_get(main_content.link, CLOUDFLARE_CONTENT)
             balance = (
                 db.query(models.Balance)
                 .filter(models.Balance.user_id == job_config["user_id"])
@@ -283,49 +424,81 @@ def image_process_task(self, job_config: dict):
                 job_config["config_json"]["job_data"]["filters"],
                 raw=True,
             )
+            filters = [
+                filter_
+                for filter_, model_config in job_config["config_json"]["job_data"][
+                    "filters"
+                ].items()
+                if model_config["active"]
+            ]
+            if len(filters) == 0:
+                raise Exception("No active filters")
             balance.balance -= float(price)
             db.add(balance)
             db.commit()
-            for filter_ in job_config["config_json"]["job_data"]["filters"]:
-                model_config = job_config["config_json"]["job_data"]["filters"][filter_]
-                if model_config["active"]:
-                    params = {"seed": 1999, "image": content_url}
-                    model_tag = IMAGE_MODELS[filter_]["model"]
-                    if "params" in IMAGE_MODELS[filter_].keys():
-                        for x in IMAGE_MODELS[filter_]["params"]:
-                            params[x] = model_config[IMAGE_MODELS[filter_]["params"][x]]
-                    model_name, tag = model_tag.split(":")
-                    model = replicate.models.get(model_name)
-                    version = model.versions.get(tag)
-                    prediction = replicate.predictions.create(
-                        version=version, input=params
-                    )
-                    start_time = int(time.time())
-                    while True:
-                        if self.is_aborted():
-                            prediction.cancel()
-                            return None
-                        time.sleep(5)
-                        prediction.reload()
-                        if prediction.status == "succeeded":
-                            break
-                        if (
-                            prediction.status == "failed"
-                            or prediction.status == "canceled"
-                        ):
-                            raise Exception
-                        if int(time.time()) - start_time > 400:
-                            prediction.cancel()
-                            raise Exception
-                    content_url = prediction.output
-            gpu_usage = abs(int(time.time()) - start_time)
-            dashboard.gpu_usage += gpu_usage
-            db.add(dashboard)
+            chain = {
+                "job_config": job_config,
+                "celery_id": self.request.id,
+                "filters": filters,
+                "step": 0,
+                "started_at": int(time.time()),
+            }
+            submit_image_filter(rd, chain, content_url)
+            return {"detail": "Success", "data": chain["prediction_id"]}
+        except Exception as e:
+            fail_image_job(db, job_config)
+            return {"detail": "Failed", "data": str(e)}
+        finally:
+            rd.close()
+
+
+@celeryapp.task(name="routers.jobs.image_prediction_done", acks_late=True)
+def image_prediction_done(job_id: int, step: int, prediction: dict = None):
+    import replicate
+
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    with Session(engine) as db:
+        chain = rd.get(replicate_chain_key(job_id))
+        if chain is None:
+            rd.close()
+            return {"detail": "Failed", "data": "Job not found"}
+        chain = json.loads(chain)
+        job_config = chain["job_config"]
+        # The webhook and the timeout check race for each step, only one wins.
+        if chain["step"] != step or not rd.set(
+            f"{replicate_chain_key(job_id)}_{step}",
+            1,
+            nx=True,
+            ex=REPLICATE_CHAIN_TTL,
+        ):
+            rd.close()
+            return {"detail": "Failed", "data": "Step already handled"}
+        try:
+            if image_process_task.AsyncResult(chain["celery_id"]).is_aborted():
+                if chain["prediction_id"] is not None:
+                    replicate.predictions.cancel(chain["prediction_id"])
+                rd.delete(replicate_chain_key(job_id))
+                return {"detail": "Failed", "data": "Job cancelled"}
+            if prediction is None:
+                current = replicate.predictions.get(chain["prediction_id"])
+                prediction = {"status": current.status, "output": current.output}
+                if current.status not in ("succeeded", "failed", "canceled"):
+                    replicate.predictions.cancel(chain["prediction_id"])
+            if prediction["status"] != "succeeded":
+                raise Exception(f"Prediction {prediction['status']}")
+            content_url = prediction["output"]
+            if chain["step"] + 1 < len(chain["filters"]):
+                chain["step"] += 1
+                submit_image_filter(rd, chain, content_url)
+                return {"detail": "Success", "data": chain["prediction_id"]}
+            rd.delete(replicate_chain_key(job_id))
+            gpu_usage = abs(int(time.time()) - int(chain["started_at"]))
+            increment_dashboard(db, job_config["user_id"], gpu_usage=gpu_usage)
             db.commit()
-            if copy_content_url != content_url:
-                reindex_image_job(job_config, content_url=content_url)
-            else:
-                raise Exception
+            indexed = reindex_image_job(job_config, content_url=content_url)
+            if indexed["detail"] != "Success":
+                raise Exception(indexed["data"])
+            record_processing_result(db, job_config["job_id"])
             job_email.delay(
                 job_id=job_config["job_id"],
                 user_id=job_config["user_id"],
@@ -336,681 +509,351 @@ def image_process_task(self, job_config: dict):
                 user_id=job_config["user_id"],
                 status="completed",
             )
-        except TaskRevokedError:
-            if prediction != None:
-                prediction.reload()
-                prediction.cancel()
+            return {"detail": "Success", "data": content_url}
         except Exception as e:
-            content = (
-                db.query(models.Content)
-                .filter(models.Content.id == job_config["content_id"])
-                .filter(models.Content.user_id == job_config["user_id"])
-                .filter(models.Content.content_type == job_config["job_type"])
-                .first()
-            )
-            content.status = "failed"
-            content.updated_at = int(time.time())
-            job = (
-                db.query(models.Jobs)
-                .filter(models.Jobs.job_id == content.job_id)
-                .first()
-            )
-            job.job_status = "Failed"
-            job.job_process = "error"
-            db.add(job)
-            db.add(content)
-            db.commit()
+            rd.delete(replicate_chain_key(job_id))
+            fail_image_job(db, job_config)
             return {"detail": "Failed", "data": str(e)}
+        finally:
+            rd.close()
 
 
-@celeryapp.task(name="routers.jobs.video_process", acks_late=True)
-def video_process_task(job_config: dict):
-    with Session(engine) as db:
+@celeryapp.task(name="routers.jobs.cancel_image_prediction", acks_late=True)
+def cancel_image_prediction(job_id: int):
+    import replicate
+
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    try:
+        chain = rd.get(replicate_chain_key(job_id))
+        prediction_id = json.loads(chain)["prediction_id"] if chain else None
+        if prediction_id is None:
+            return {"detail": "Failed", "data": "Job not found"}
+        replicate.predictions.cancel(prediction_id)
+        return {"detail": "Success", "data": job_id}
+    finally:
+        rd.close()
+
+
+GPU_PIPELINES = {
+    "video": ("jaeger-pipeline", 'bash -c "/app/backendml/entrypoint.sh"'),
+    "audio": ("ackermann-pipeline", 'bash -c "/app/entrypoint.sh"'),
+}
+# With packing on, video and audio jobs registered within PACKING_WINDOW
+# seconds of each other share one instance instead of each paying the boot.
+JOB_PACKING = os.getenv("JOB_PACKING", "false").lower() == "true"
+PACKING_WINDOW = int(os.getenv("PACKING_WINDOW", 60))
+PACKING_MAX_JOBS = int(os.getenv("PACKING_MAX_JOBS", 4))
+PACKING_MAX_DISK = 512
+# Registered jobs wait in a fair-share queue and are started as the
+# providers' budgets allow, see script_utils.scheduler.
+JOB_SCHEDULER = os.getenv("JOB_SCHEDULER", "true").lower() == "true"
+
+
+def launch_gpu_machine(
+    rd,
+    job_config: dict,
+    eta,
+    job_eta,
+    disk,
+    pipeline: str,
+    onstart: str,
+    skip_providers=(),
+):
+    from script_utils.gpu_workers import get_gpu_offers
+    from script_utils.launcher import gpu_launch_candidates, hedged_launch
+
+    df = get_gpu_offers(rd)
+    if df is None or len(df) == 0:
+        return None
+    env = {
+        "FETCH_CONFIG": "/jobs/fetch_jobs",
+        "JOBID": job_config["job_id"],
+        "KEY": job_config["key"],
+    }
+    candidates = gpu_launch_candidates(df, env, eta, job_eta, disk, pipeline, onstart)
+    candidates = [x for x in candidates if x[1] not in skip_providers]
+    launched = hedged_launch(rd, candidates)
+    if launched is None:
+        return None
+    key, provider, instance = launched
+    logger.info(f"Launched {key} for job {job_config['job_id']}")
+    return provider, instance
+
+
+def gpu_job_requirements(db: Session, job_config: dict):
+    main_content = (
+        db.query(models.Content)
+        .filter(
+            models.Content.id == job_config["config_json"]["job_data"]["content_id"]
+        )
+        .filter(models.Content.user_id == job_config["user_id"])
+        .filter(models.Content.status == "completed")
+        .filter(models.Content.content_type == job_config["job_type"])
+        .first()
+    )
+    job = (
+        db.query(models.Jobs)
+        .filter(models.Jobs.job_id == job_config["job_id"])
+        .filter(models.Jobs.user_id == job_config["user_id"])
+        .first()
+    )
+    balance = (
+        db.query(models.Balance)
+        .filter(models.Balance.user_id == job_config["user_id"])
+        .first()
+    )
+    if job is None:
+        raise Exception("Job not found")
+    if main_content is None:
+        raise Exception("Content not found")
+    size_mb = math.ceil(main_content.size / (1024 * 1024))
+    if job_config["job_type"] == "video":
+        size_needed_in_gb = size_mb * 2
+        if job_config["config_json"]["job_data"]["filters"]["super_resolution"][
+            "active"
+        ]:
+            size_needed_in_gb *= 2
+    else:
+        size_needed_in_gb = size_mb * 5
+        size_needed_in_gb = max(size_needed_in_gb, 5)
+    size_needed_in_gb = min(size_needed_in_gb, 512)
+    eta, price = get_content_estimate(
+        main_content.__dict__,
+        job_config["config_json"]["job_data"]["filters"],
+        raw=True,
+    )
+    return {
+        "config": job_config,
+        "job": job,
+        "balance": balance,
+        "disk": size_needed_in_gb,
+        "eta": eta,
+        "price": float(price),
+    }
+
+
+def fail_gpu_jobs(db: Session, jobs: list, reason: str = "No machine found"):
+    for job in jobs:
+        job_email.delay(job_id=job.job_id, user_id=job.user_id, status="failed")
+        send_discord_update.delay(
+            job_id=job.job_id, user_id=job.user_id, status="failed"
+        )
+        job.job_key = False
+        job.job_status = "Failed"
+        job.job_process = reason
+        job.updated_at = int(time.time())
+        db.add(job)
+    db.commit()
+
+
+def start_gpu_machine(db: Session, pack: list):
+    """
+    Rent one instance for every job in the pack, or hand the pack to an idle
+    machine from the warm pool. The first job is the lead: a new instance is
+    started with its id and key and fetches the manifests of the whole pack
+    from /jobs/fetch_jobs, a warm one picks them up from /jobs/idle_poll.
+    """
+    lead = pack[0]["config"]
+    pipeline, onstart = GPU_PIPELINES[lead["job_type"]]
+    # Packed jobs run one after another, so the instance needs room and time
+    # for all of them.
+    DISK = sum(x["disk"] for x in pack) + 20
+    eta = sum(x["eta"] for x in pack)
+    job_eta = eta + (eta * 0.5) + 1200
+    machine = None
+    if lead["job_type"] == WARM_POOL_JOB_TYPE and DISK <= WARM_POOL_DISK:
+        machine = claim_idle_machine(db, int(time.time()))
+    if machine is None:
+        # find machine instance
+        rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
         try:
-            main_content = (
-                db.query(models.Content)
-                .filter(
-                    models.Content.id
-                    == job_config["config_json"]["job_data"]["content_id"]
-                )
-                .filter(models.Content.user_id == job_config["user_id"])
-                .filter(models.Content.status == "completed")
-                .filter(models.Content.content_type == job_config["job_type"])
-                .first()
+            launched = launch_gpu_machine(
+                rd,
+                lead,
+                eta,
+                job_eta,
+                DISK,
+                pipeline=pipeline,
+                onstart=onstart,
+                skip_providers=scheduler.saturated_providers(db),
             )
-            job = (
-                db.query(models.Jobs)
-                .filter(models.Jobs.job_id == job_config["job_id"])
-                .filter(models.Jobs.user_id == job_config["user_id"])
-                .first()
-            )
-            balance = (
-                db.query(models.Balance)
-                .filter(models.Balance.user_id == job_config["user_id"])
-                .first()
-            )
-            if job is None:
-                raise Exception("Job not found")
-            if main_content is None:
-                raise Exception("Content not found")
-            size_mb = np.ceil(round(eval(main_content.size), 2) / (1024 * 1024))
-            size_needed_in_gb = size_mb * 2
-            if job_config["config_json"]["job_data"]["filters"]["super_resolution"][
-                "active"
-            ]:
-                size_needed_in_gb *= 2
-            size_needed_in_gb = min(size_needed_in_gb, 512)
-            eta, price = get_content_estimate(
-                main_content.__dict__,
-                job_config["config_json"]["job_data"]["filters"],
-                raw=True,
-            )
-            price = float(price)
-            # find machine instance
-            RAM = 16
-            VRAM = 20
-            CPU = 6
-            df = get_gpu_listing()
-            df[["RAM", "VRAM", "vCPUs", "Price"]] = df[
-                ["RAM", "VRAM", "vCPUs", "Price"]
-            ].apply(pd.to_numeric)
-            DISK = size_needed_in_gb + 20
-            max_price = 0.7
-            df = df[
-                (df["RAM"] >= RAM)
-                & (df["VRAM"] >= VRAM)
-                & (df["vCPUs"] >= CPU)
-                & (df["N"] == 1)
-                & (df["Price"] <= max_price)
-            ].sort_values(by=["Price"], ascending=True)
-            if len(df) == 0:
-                job_email.delay(
-                    job_id=job_config["job_id"],
-                    user_id=job_config["user_id"],
-                    status="failed",
-                )
-                send_discord_update.delay(
-                    job_id=job_config["job_id"],
-                    user_id=job_config["user_id"],
-                    status="failed",
-                )
-                job.job_key = False
-                job.job_status = "Failed"
-                job.job_process = "No machine found"
-                job.updated_at = int(time.time())
-                db.add(job)
-                db.commit()
-                return None
-            supported_cuda = [float(x) for x in CUDA]
-            job_eta = eta + (eta * 0.5) + 1200
-            for index, row in df.iterrows():
-                if row["Cloud"] not in GPU_PROVIDER:
-                    continue
-                if row["Cloud"] == "vast":
-                    max_time = parse_timespan(f"{row['Max_Days']}Days")
-                    if max_time <= eta + 3600:
-                        continue
-                    if float(row["ports"]) < 10:
-                        continue
-                    if float(row["Net_down"]) < 250 and float(row["Net_up"]) < 100:
-                        continue
-                    if round(float(row["CUDA"]), 1) not in supported_cuda:
-                        continue
-                    env = {
-                        "BASEURL": "https://backend.tnsr.ai",
-                        "FETCH_CONFIG": "/jobs/fetch_jobs",
-                        "JOBID": job_config["job_id"],
-                        "KEY": job_config["key"],
-                        "ENCRYPTION_KEY": "aqerYK5L4hxmS3JN3qejb6x9FwZYDJgulk7ZoM8adqQ",
-                        "PRESIGNED_URL": "/jobs/generate_presigned_post",
-                        "REINDEX_URL": "/jobs/reindexfile",
-                        "JOB_REINDEX_URL": "/jobs/job_status",
-                        "CELERY_URL": "/upload/indexfile_status",
-                        "-p 6379:6379": "1",
-                    }
-
-                    va = VastAI(
-                        machine_id=row["ID"],
-                        run_name="jaeger-pipeline",
-                        image=f"amitalokbera/jaeger-pipeline:cuda-{round(float(row['CUDA']),1)}",
-                        disk_size=DISK,
-                        onstart='bash -c "/app/backendml/entrypoint.sh"',
-                        eta=job_eta,
-                        env=env,
-                    )
-                    if va.launch_instance() == False:
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        continue
-                    create_machine_row = models.Machines(
-                        instance_id=str(va.instance_id),
-                        user_id=job_config["user_id"],
-                        machine_status="LOADING",
-                        job_id=job_config["job_id"],
-                        provider=row["Cloud"],
-                        created_at=int(time.time()),
-                    )
-                    db.add(create_machine_row)
-                    db.commit()
-                    db.refresh(create_machine_row)
-                    break
+        finally:
+            rd.close()
+        if launched is None:
+            fail_gpu_jobs(db, [x["job"] for x in pack])
+            return None
+        provider, instance = launched
+        machine = models.Machines(
+            instance_id=str(instance.instance_id), provider=provider
+        )
+    machine.user_id = lead["user_id"]
+    machine.machine_status = "LOADING"
+    machine.job_id = lead["job_id"]
+    machine.created_at = int(time.time())
+    machine.updated_at = int(time.time())
+    machine.expires_at = int(time.time() + job_eta)
+    db.add(machine)
+    db.commit()
+    for x in pack:
+        x["job"].machine_id = machine.machine_id
+        x["balance"].balance = float(x["balance"].balance) - x["price"]
+        db.add(x["job"])
+        db.add(x["balance"])
+    db.commit()
+    return machine
 
-                if row["Cloud"] == "runpod":
-                    env = {
-                        "BASEURL": "https://backend.tnsr.ai",
-                        "FETCH_CONFIG": "/jobs/fetch_jobs",
-                        "JOBID": job_config["job_id"],
-                        "KEY": job_config["key"],
-                        "ENCRYPTION_KEY": "aqerYK5L4hxmS3JN3qejb6x9FwZYDJgulk7ZoM8adqQ",
-                        "PRESIGNED_URL": "/jobs/generate_presigned_post",
-                        "REINDEX_URL": "/jobs/reindexfile",
-                        "JOB_REINDEX_URL": "/jobs/job_status",
-                        "CELERY_URL": "/upload/indexfile_status",
-                    }
-                    for cuda in supported_cuda:
-                        rp = RunpodIO(
-                            gpu_model=row["Model"],
-                            run_name="jaeger-pipeline",
-                            image=f"amitalokbera/jaeger-pipeline:cuda-{cuda}",
-                            disk_size=DISK,
-                            eta=job_eta,
-                            cuda=str(cuda),
-                            env=env,
-                        )
-                        launch_status = rp.launch_instance()
-                        if launch_status == False:
-                            try:
-                                rp.terminate_instance()
-                            except:
-                                pass
-                            continue
-                        if launch_status == True:
-                            break
-                    create_machine_row = models.Machines(
-                        instance_id=str(rp.instance_id),
-                        user_id=job_config["user_id"],
-                        machine_status="LOADING",
-                        job_id=job_config["job_id"],
-                        provider=row["Cloud"],
-                        created_at=int(time.time()),
-                    )
-                    db.add(create_machine_row)
-                    db.commit()
-                    db.refresh(create_machine_row)
-                    break
-            process_job = process_status.delay(
-                int(job_config["job_id"]), int(job_config["user_id"]), int(job_eta)
-            )
-            new_price = float(balance.balance) - float(price)
-            balance.balance = new_price
-            db.add(balance)
-            job.celery_id = process_job.id
-            db.add(job)
-            db.commit()
+
+def fail_gpu_job_config(db: Session, job_config: dict, reason: str = "error"):
+    # A job that never got a machine would otherwise hold a GPU lane slot.
+    db.rollback()
+    job = (
+        db.query(models.Jobs).filter(models.Jobs.job_id == job_config["job_id"]).first()
+    )
+    if job is not None and job.job_key:
+        fail_gpu_jobs(db, [job], reason)
+
+
+def gpu_process_task(job_config: dict):
+    with Session(engine) as db:
+        try:
+            need = gpu_job_requirements(db, job_config)
+            # Cancelled before a worker picked it up.
+            if not need["job"].job_key:
+                return
+            start_gpu_machine(db, [need])
         except Exception as e:
-            job_email.delay(
-                job_id=job_config["job_id"],
-                user_id=job_config["user_id"],
-                status="failed",
-            )
-            send_discord_update.delay(
-                job_id=job_config["job_id"],
-                user_id=job_config["user_id"],
-                status="failed",
-            )
-            pass
+            logger.error(f"Unable to start job {job_config['job_id']} - {str(e)}")
+            fail_gpu_job_config(db, job_config)
+
+
+@celeryapp.task(name="routers.jobs.video_process", acks_late=True)
+def video_process_task(job_config: dict):
+    gpu_process_task(job_config)
 
 
 @celeryapp.task(name="routers.jobs.audio_process")
 def audio_process_task(job_config: dict):
-    with Session(engine) as db:
-        try:
-            main_content = (
-                db.query(models.Content)
-                .filter(
-                    models.Content.id
-                    == job_config["config_json"]["job_data"]["content_id"]
-                )
-                .filter(models.Content.user_id == job_config["user_id"])
-                .filter(models.Content.status == "completed")
-                .filter(models.Content.content_type == job_config["job_type"])
-                .first()
-            )
-            job = (
-                db.query(models.Jobs)
-                .filter(models.Jobs.job_id == job_config["job_id"])
-                .filter(models.Jobs.user_id == job_config["user_id"])
-                .first()
-            )
-            balance = (
-                db.query(models.Balance)
-                .filter(models.Balance.user_id == job_config["user_id"])
-                .first()
-            )
-            if job is None:
-                raise Exception("Job not found")
-            if main_content is None:
-                raise Exception("Content not found")
-            size_mb = np.ceil(round(eval(main_content.size), 2) / (1024 * 1024))
-            size_needed_in_gb = size_mb * 5
-            size_needed_in_gb = max(size_needed_in_gb, 5)
-            size_needed_in_gb = min(size_needed_in_gb, 512)
-            eta, price = get_content_estimate(
-                main_content.__dict__,
-                job_config["config_json"]["job_data"]["filters"],
-                raw=True,
-            )
-            price = float(price)
-            # find machine instance
-            RAM = 16
-            VRAM = 20
-            CPU = 6
-            df = get_gpu_listing()
-            df[["RAM", "VRAM", "vCPUs", "Price"]] = df[
-                ["RAM", "VRAM", "vCPUs", "Price"]
-            ].apply(pd.to_numeric)
-            DISK = size_needed_in_gb + 20
-            max_price = 0.7
-            df = df[
-                (df["RAM"] >= RAM)
-                & (df["VRAM"] >= VRAM)
-                & (df["vCPUs"] >= CPU)
-                & (df["N"] == 1)
-                & (df["Price"] <= max_price)
-            ].sort_values(by=["Price"], ascending=True)
-            if len(df) == 0:
-                job_email.delay(
-                    job_id=job_config["job_id"],
-                    user_id=job_config["user_id"],
-                    status="failed",
-                )
-                send_discord_update.delay(
-                    job_id=job_config["job_id"],
-                    user_id=job_config["user_id"],
-                    status="failed",
-                )
-                job.job_key = False
-                job.job_status = "Failed"
-                job.job_process = "No machine found"
-                job.updated_at = int(time.time())
-                db.add(job)
-                db.commit()
-                return None
-            supported_cuda = [float(x) for x in CUDA]
-            job_eta = eta + (eta * 0.5) + 1200
-            for index, row in df.iterrows():
-                if row["Cloud"] not in GPU_PROVIDER:
-                    continue
-                if row["Cloud"] == "vast":
-                    max_time = parse_timespan(f"{row['Max_Days']}Days")
-                    if max_time <= eta + 3600:
-                        continue
-                    if float(row["ports"]) < 10:
-                        continue
-                    if float(row["Net_down"]) < 250 and float(row["Net_up"]) < 100:
-                        continue
-                    if round(float(row["CUDA"]), 1) not in supported_cuda:
-                        continue
-                    env = {
-                        "BASEURL": "https://backend.tnsr.ai",
-                        "FETCH_CONFIG": "/jobs/fetch_jobs",
-                        "JOBID": job_config["job_id"],
-                        "KEY": job_config["key"],
-                        "ENCRYPTION_KEY": "aqerYK5L4hxmS3JN3qejb6x9FwZYDJgulk7ZoM8adqQ",
-                        "PRESIGNED_URL": "/jobs/generate_presigned_post",
-                        "REINDEX_URL": "/jobs/reindexfile",
-                        "JOB_REINDEX_URL": "/jobs/job_status",
-                        "CELERY_URL": "/upload/indexfile_status",
-                        "-p 6379:6379": "1",
-                    }
-
-                    va = VastAI(
-                        machine_id=row["ID"],
-                        run_name="ackermann-pipeline",
-                        image=f"amitalokbera/ackermann-pipeline:cuda-{round(float(row['CUDA']),1)}",
-                        disk_size=DISK,
-                        onstart='bash -c "/app/entrypoint.sh"',
-                        eta=job_eta,
-                        env=env,
-                    )
-                    if va.launch_instance() == False:
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        continue
-                    create_machine_row = models.Machines(
-                        instance_id=str(va.instance_id),
-                        user_id=job_config["user_id"],
-                        machine_status="LOADING",
-                        job_id=job_config["job_id"],
-                        provider=row["Cloud"],
-                        created_at=int(time.time()),
-                    )
-                    db.add(create_machine_row)
-                    db.commit()
-                    db.refresh(create_machine_row)
-                    break
+    gpu_process_task(job_config)
 
-                if row["Cloud"] == "runpod":
-                    env = {
-                        "BASEURL": "https://backend.tnsr.ai",
-                        "FETCH_CONFIG": "/jobs/fetch_jobs",
-                        "JOBID": job_config["job_id"],
-                        "KEY": job_config["key"],
-                        "ENCRYPTION_KEY": "aqerYK5L4hxmS3JN3qejb6x9FwZYDJgulk7ZoM8adqQ",
-                        "PRESIGNED_URL": "/jobs/generate_presigned_post",
-                        "REINDEX_URL": "/jobs/reindexfile",
-                        "JOB_REINDEX_URL": "/jobs/job_status",
-                        "CELERY_URL": "/upload/indexfile_status",
-                    }
-                    for cuda in supported_cuda:
-                        rp = RunpodIO(
-                            gpu_model=row["Model"],
-                            run_name="ackermann-pipeline",
-                            image=f"amitalokbera/ackermann-pipeline:cuda-{cuda}",
-                            disk_size=DISK,
-                            eta=job_eta,
-                            cuda=str(cuda),
-                            env=env,
-                        )
-                        launch_status = rp.launch_instance()
-                        if launch_status == False:
-                            try:
-                                rp.terminate_instance()
-                            except:
-                                pass
-                            continue
-                        if launch_status == True:
-                            break
-                    create_machine_row = models.Machines(
-                        instance_id=str(rp.instance_id),
-                        user_id=job_config["user_id"],
-                        machine_status="LOADING",
-                        job_id=job_config["job_id"],
-                        provider=row["Cloud"],
-                        created_at=int(time.time()),
-                    )
-                    db.add(create_machine_row)
-                    db.commit()
-                    db.refresh(create_machine_row)
-                    break
-            process_job = process_status.delay(
-                int(job_config["job_id"]), int(job_config["user_id"]), int(job_eta)
-            )
-            balance.balance -= float(price)
-            db.add(balance)
-            job.celery_id = process_job.id
-            db.add(job)
-            db.commit()
-        except Exception as e:
-            job_email.delay(
-                job_id=job_config["job_id"],
-                user_id=job_config["user_id"],
-                status="failed",
-            )
-            send_discord_update.delay(
-                job_id=job_config["job_id"],
-                user_id=job_config["user_id"],
-                status="failed",
-            )
-            pass
 
+def gpu_pack_queue(job_type: str):
+    return f"gpu_pack_{job_type}"
 
-@celeryapp.task(name="routers.jobs.process_status", acks_late=True)
-def process_status(job_id: int, user_id: int, eta: int):
-    with Session(engine) as db:
+
+def gpu_pack_window(job_type: str):
+    return f"gpu_pack_window_{job_type}"
+
+
+def enqueue_packed_job(rd, job_config: dict):
+    # The first job of a window schedules the flush; everything queued until
+    # then goes out with it.
+    pipe = rd.pipeline(transaction=False)
+    pipe.rpush(gpu_pack_queue(job_config["job_type"]), json.dumps(job_config))
+    pipe.set(gpu_pack_window(job_config["job_type"]), 1, nx=True, ex=PACKING_WINDOW)
+    _, opened = pipe.execute()
+    if opened:
+        pack_gpu_jobs.apply_async(
+            args=[job_config["job_type"]], countdown=PACKING_WINDOW
+        )
+
+
+def plan_packs(needs: list):
+    packs = []
+    for need in needs:
+        pack = packs[-1] if packs else None
+        if (
+            pack is None
+            or len(pack) >= PACKING_MAX_JOBS
+            or sum(x["disk"] for x in pack) + need["disk"] > PACKING_MAX_DISK
+        ):
+            packs.append([need])
+            continue
+        pack.append(need)
+    return packs
+
+
+def flush_packed_jobs(db: Session, rd, job_type: str):
+    pipe = rd.pipeline(transaction=True)
+    pipe.lrange(gpu_pack_queue(job_type), 0, -1)
+    pipe.delete(gpu_pack_queue(job_type))
+    pipe.delete(gpu_pack_window(job_type))
+    queued, _, _ = pipe.execute()
+    needs = []
+    for job_config in [json.loads(x) for x in queued]:
         try:
-            job = (
-                db.query(models.Jobs)
-                .filter(models.Jobs.job_id == int(job_id))
-                .filter(models.Jobs.user_id == int(user_id))
-                .first()
-            )
-            if job is None:
-                raise Exception("Job not found")
-            machine = (
-                db.query(models.Machines)
-                .filter(models.Machines.job_id == job.job_id)
-                .first()
-            )
-            if machine is None:
-                raise Exception("Machine not found")
-            job_content = (
-                db.query(models.Content)
-                .filter(models.Content.job_id == job_id)
-                .filter(models.Content.user_id == user_id)
-                .all()
-            )
-            if len(job_content) < 0:
-                raise Exception("Content job not found")
-            count = 0
-            while True:
-                db.refresh(machine)
-                if machine.instance_id is not None:
-                    break
-                count += 1
-                if count >= 10:
-                    return None
-                time.sleep(30)
-            if machine.provider == "vast":
-                va = VastAI(
-                    machine_id=123,
-                    run_name="",
-                    image="",
-                    disk_size=0,
-                    onstart="",
-                    eta=eta,
-                    env={},
-                )
-                va.instance_id = int(machine.instance_id)
-                while True:
-                    time.sleep(60)
-                    status = va.current_status()
-                    if int(time.time()) - int(machine.created_at) > eta:
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "FAILED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Failed"
-                        job.job_process = "Failed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        for x in job_content:
-                            x.status = "failed"
-                            x.updated_at = int(time.time())
-                            db.add(x)
-                        db.commit()
-                        break
-                    if status["detail"] == "Failed":
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "FAILED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Failed"
-                        job.job_process = "Failed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        for x in job_content:
-                            x.status = "failed"
-                            x.updated_at = int(time.time())
-                            db.add(x)
-                        db.commit()
-                        break
-                    if status["data"] == "LOADING" and (
-                        int(time.time()) - int(machine.created_at) >= 600
-                    ):
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "FAILED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Failed"
-                        job.job_process = "Failed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        for x in job_content:
-                            x.status = "failed"
-                            x.updated_at = int(time.time())
-                            db.add(x)
-                        db.commit()
-                        break
-                    if status["data"] == "EXITED":
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "EXITED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Completed"
-                        job.job_process = "completed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        db.commit()
-                        db.refresh(machine)
-                        job_email.delay(
-                            job_id=job_id, user_id=user_id, status="completed"
-                        )
-                        send_discord_update.delay(
-                            job_id=job_id, user_id=user_id, status="completed"
-                        )
-                        break
-                    if status["data"] != str(machine.machine_status):
-                        machine.machine_status = status["data"]
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_status = status["data"].lower().capitalize()
-                        job.job_process = status["data"].lower()
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        db.commit()
-                        db.refresh(machine)
-            if machine.provider == "runpod":
-                rp = RunpodIO(
-                    gpu_model="", run_name="", image="", disk_size=0, eta=eta, env={}
-                )
-                rp.instance_id = int(machine.instance_id)
-                while True:
-                    time.sleep(60)
-                    status = rp.current_status()
-                    if int(time.time()) - int(machine.created_at) > eta:
-                        try:
-                            va.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "FAILED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Failed"
-                        job.job_process = "Failed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        for x in job_content:
-                            x.status = "failed"
-                            x.updated_at = int(time.time())
-                            db.add(x)
-                        db.commit()
-                        break
-                    if status["detail"] == "Failed":
-                        try:
-                            rp.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "FAILED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Failed"
-                        job.job_process = "Failed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        for x in job_content:
-                            x.status = "failed"
-                            x.updated_at = int(time.time())
-                            db.add(x)
-                        db.commit()
-                        break
-                    if status["data"] == "LOADING" and (
-                        int(time.time()) - int(machine.created_at) >= 1200
-                    ):
-                        try:
-                            rp.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "FAILED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.job_status = "Failed"
-                        job.job_process = "Failed"
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        for x in job_content:
-                            x.status = "failed"
-                            x.updated_at = int(time.time())
-                            db.add(x)
-                        db.commit()
-                        break
-                    if status["data"] == "EXITED":
-                        try:
-                            rp.terminate_instance()
-                        except:
-                            pass
-                        machine.machine_status = "EXITED"
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_key = False
-                        job.updated_at = int(time.time())
-                        for x in job_content:
-                            if x.status != "completed":
-                                job.job_status = "Failed"
-                                job.job_process = "failed"
-                                x.status = "failed"
-                            else:
-                                job.job_status = "Completed"
-                                job.job_process = "completed"
-                                x.status = "completed"
-                            db.add(x)
-                        db.add(job)
-                        db.commit()
-                        db.refresh(machine)
-                        job_email.delay(
-                            job_id=job_id, user_id=user_id, status="completed"
-                        )
-                        send_discord_update.delay(
-                            job_id=job_id, user_id=user_id, status="completed"
-                        )
-                        break
-                    if status["data"] != str(machine.machine_status):
-                        machine.machine_status = status["data"]
-                        machine.updated_at = int(time.time())
-                        db.add(machine)
-                        job.job_status = status["data"].lower().capitalize()
-                        job.job_process = status["data"].lower()
-                        job.updated_at = int(time.time())
-                        db.add(job)
-                        db.commit()
-                        db.refresh(machine)
+            need = gpu_job_requirements(db, job_config)
         except Exception as e:
-            job_email.delay(job_id=job_id, user_id=user_id, status="failed")
-            send_discord_update.delay(job_id=job_id, user_id=user_id, status="failed")
-            pass
+            logger.error(f"Unable to pack job {job_config['job_id']} - {str(e)}")
+            fail_gpu_job_config(db, job_config)
+            continue
+        # Cancelled while it was waiting for the window to close.
+        if not need["job"].job_key:
+            continue
+        needs.append(need)
+    packs = plan_packs(needs)
+    for pack in packs:
+        try:
+            start_gpu_machine(db, pack)
+        except Exception as e:
+            logger.error(f"Unable to start packed jobs - {str(e)}")
+            db.rollback()
+            fail_gpu_jobs(db, [x["job"] for x in pack])
+    return packs
+
+
+@celeryapp.task(name="routers.jobs.pack_gpu_jobs", acks_late=True)
+def pack_gpu_jobs(job_type: str):
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    try:
+        with Session(engine) as db:
+            packs = flush_packed_jobs(db, rd, job_type)
+            return {"detail": "Success", "data": [len(x) for x in packs]}
+    except Exception as e:
+        logger.error(f"Error while packing {job_type} jobs - {str(e)}")
+        return {"detail": "Failed", "data": str(e)}
+    finally:
+        rd.close()
+
+
+def dispatch_job(db: Session, rd, job_config: dict):
+    job = (
+        db.query(models.Jobs).filter(models.Jobs.job_id == job_config["job_id"]).first()
+    )
+    # Cancelled while it was queued.
+    if job is None or not job.job_key:
+        return False
+    try:
+        job.job_process = "started"
+        if job_config["job_type"] in GPU_PIPELINES and JOB_PACKING:
+            enqueue_packed_job(rd, job_config)
+        elif job_config["job_type"] == "video":
+            job.celery_id = video_process_task.delay(job_config).id
+        elif job_config["job_type"] == "image":
+            job.celery_id = image_process_task.delay(job_config).id
+        elif job_config["job_type"] == "audio":
+            job.celery_id = audio_process_task.delay(job_config).id
+        db.commit()
+    except Exception:
+        # Leave the session usable for the rest of the scheduling run.
+        db.rollback()
+        raise
+    return True
+
+
+@celeryapp.task(name="routers.jobs.schedule_jobs")
+def schedule_jobs():
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    try:
+        with Session(engine) as db:
+            started = scheduler.schedule(
+                db, rd, lambda job_config: dispatch_job(db, rd, job_config)
+            )
+            return {"detail": "Success", "data": started}
+    except Exception as e:
+        logger.error(f"Error while scheduling jobs - {str(e)}")
+        return {"detail": "Failed", "data": str(e)}
+    finally:
+        rd.close()
 
 
 @router.post(
@@ -1019,6 +862,7 @@ def process_status(job_id: int, user_id: int, eta: int):
 async def register_job(
     job_dict: RegisterJobModel,
     db: Session = Depends(get_db),
+    rd: redis.Redis = Depends(get_redis),
     current_user: TokenData = Depends(get_current_user),
 ):
     try:
@@ -1055,13 +899,26 @@ async def register_job(
             job_dict.config_json["job_data"]["filters"],
             raw=True,
         )
-        if float(balance.balance) < float(price):
+        result_key = processing_result_key(
+            main_content.md5,
+            job_dict.job_type,
+            job_dict.config_json["job_data"]["filters"],
+        )
+        cached_result = find_processing_result(db, result_key)
+        if float(balance.balance) < float(price) and cached_result is None:
             raise Exception("Insufficient balance")
         if running_jobs >= USER_TIER[user_details.user_tier]["max_jobs"]:
             raise HTTPException(
                 status_code=400,
                 detail="You have reached your maximum active jobs. Please wait for them to complete.",
             )
+        lane = scheduler.job_lane(job_dict.job_type)
+        if (
+            JOB_SCHEDULER
+            and cached_result is None
+            and scheduler.queue_length(rd, lane) >= scheduler.SCHEDULER_MAX_QUEUE
+        ):
+            raise Exception("Job queue is full")
         create_job_model = models.Jobs(
             user_id=current_user.user_id,
             job_name=phrase,
@@ -1071,8 +928,9 @@ async def register_job(
             created_at=int(time.time()),
             job_key=True,
             config_json=json.dumps(job_dict.config_json),
-            job_process="started",
+            job_process="queued" if JOB_SCHEDULER else "started",
             key=hashlib.md5(generator.random().encode()).hexdigest(),
+            result_key=result_key,
         )
         db.add(create_job_model)
         db.commit()
@@ -1083,21 +941,40 @@ async def register_job(
         create_job_model.content_id = content_id
         db.add(create_job_model)
         db.commit()
+        # Same file, filters and model versions as a finished job: reuse its
+        # outputs instead of paying for the processing again.
+        if cached_result is not None:
+            contents = apply_processing_result(db, create_job_model, cached_result)
+            if contents:
+                for content in contents:
+                    if counts_towards_storage(content):
+                        content_added(
+                            db,
+                            current_user.user_id,
+                            str(content.content_type),
+                            int(content.size or 0),
+                        )
+                db.commit()
+                job_email.delay(
+                    job_id=create_job_model.job_id,
+                    user_id=current_user.user_id,
+                    status="completed",
+                )
+                return {"detail": "Success", "data": "Job registered successfully"}
+            if float(balance.balance) < float(price):
+                raise Exception("Insufficient balance")
         job_config = sql_dict(create_job_model)
         remove_key(job_config, "_sa_instance_state")
         job_config["config_json"] = json.loads(job_config["config_json"])
-        if job_dict.job_type == "video":
-            celery_process = video_process_task.delay(job_config)
-            create_job_model.celery_id = celery_process.id
-            db.commit()
-        if job_dict.job_type == "image":
-            celery_process = image_process_task.delay(job_config)
-            create_job_model.celery_id = celery_process.id
-            db.commit()
-        if job_dict.job_type == "audio":
-            celery_process = audio_process_task.delay(job_config)
-            create_job_model.celery_id = celery_process.id
-            db.commit()
+        queue = None
+        if JOB_SCHEDULER:
+            scheduler.enqueue(rd, job_config, user_details.user_tier, eta)
+            schedule_jobs.delay()
+            queue = scheduler.queue_position(
+                rd, lane, job_config["job_id"], scheduler.lane_running(db, lane)
+            )
+        else:
+            dispatch_job(db, rd, job_config)
         job_email.delay(
             job_id=job_config["job_id"],
             user_id=current_user.user_id,
@@ -1108,10 +985,18 @@ async def register_job(
             user_id=current_user.user_id,
             status="initiated",
         )
-        return {"detail": "Success", "data": "Job registered successfully"}
+        return {
+            "detail": "Success",
+            "data": "Job registered successfully",
+            "queue": queue,
+        }
     except Exception as e:
         if "Insufficient balance" in str(e):
             raise HTTPException(status_code=400, detail=str(e))
+        if "Job queue is full" in str(e):
+            raise HTTPException(
+                status_code=503, detail="Job queue is full, please try again later"
+            )
         raise HTTPException(status_code=400, detail="Unable to register job")
 
 
@@ -1127,6 +1012,40 @@ def fetch_content_data(content_id: int, db: Session):
         raise HTTPException(status_code=400, detail="Unable to fetch content data")
 
 
+def job_manifest(job: models.Jobs, db: Session):
+    job_config = {"job_id": job.job_id, "key": job.key}
+    content_detail = fetch_content_data(job.content_id, db)
+    main_content = fetch_content_data(content_detail.id_related, db).__dict__
+    job_config["content"] = add_presigned_single(
+        main_content["link"], CLOUDFLARE_CONTENT, None
+    )
+    job_config["title"] = main_content["title"]
+    job_config["job"] = json.loads(job.config_json)
+    return job_config
+
+
+@router.get("/idle_poll")
+async def idle_poll(key: str, db: Session = Depends(get_db)):
+    machine = db.query(models.Machines).filter(models.Machines.key == key).first()
+    if machine is None:
+        raise HTTPException(status_code=400, detail="Machine not found")
+    if machine.machine_status == "IDLE":
+        return {"detail": "Success", "data": {"jobs": []}}
+    if machine.machine_status not in ("LOADING", "RUNNING"):
+        raise HTTPException(status_code=400, detail="Machine stopped")
+    jobs = (
+        db.query(models.Jobs)
+        .filter(models.Jobs.machine_id == machine.machine_id)
+        .filter(models.Jobs.job_key == True)
+        .order_by(models.Jobs.job_id)
+        .all()
+    )
+    manifests = [job_manifest(x, db) for x in jobs]
+    if not manifests:
+        return {"detail": "Success", "data": {"jobs": []}}
+    return {"detail": "Success", "data": {**manifests[0], "jobs": manifests}}
+
+
 @router.get("/fetch_jobs")
 async def fetch_jobs(
     job_id: int,
@@ -1143,35 +1062,44 @@ async def fetch_jobs(
         )
         if job_detail is None:
             raise HTTPException(status_code=400, detail="Job not found")
-        job_config = {}
-        content_detail = fetch_content_data(job_detail.content_id, db)
-        main_content = fetch_content_data(content_detail.id_related, db).__dict__
-        job_config["content"] = add_presigned_single(
-            main_content["link"], CLOUDFLARE_CONTENT, None
-        )
-        job_config["title"] = main_content["title"]
-        job_config["job"] = json.loads(job_detail.config_json)
-        return {"detail": "Success", "data": job_config}
+        jobs = [job_detail]
+        if job_detail.machine_id is not None:
+            jobs = (
+                db.query(models.Jobs)
+                .filter(models.Jobs.machine_id == job_detail.machine_id)
+                .filter(models.Jobs.job_key == True)
+                .order_by(models.Jobs.job_id)
+                .all()
+            ) or jobs
+        manifests = [job_manifest(x, db) for x in jobs]
+        # The top level stays the first job's manifest for single-job images.
+        return {"detail": "Success", "data": {**manifests[0], "jobs": manifests}}
     except Exception as e:
         raise HTTPException(status_code=400, detail="Unable to fetch job details")
 
 
-def get_active_jobs(user_id, db, rd):
+async def fetch_content_data_async(content_id: int, db: AsyncSession):
+    content_detail = await db.get(models.Content, content_id)
+    if content_detail is None:
+        raise HTTPException(status_code=400, detail="Content not found")
+    return content_detail
+
+
+async def get_active_jobs(user_id, db: AsyncSession, rd):
     try:
         all_tags = allTags(id=True)
-        job_details = (
-            db.query(models.Jobs)
-            .filter(models.Jobs.user_id == user_id)
-            .filter(
+        job_details = await db.scalars(
+            select(models.Jobs)
+            .where(models.Jobs.user_id == user_id)
+            .where(
                 or_(
                     models.Jobs.job_status == "Processing",
                     models.Jobs.job_status == "Loading",
                     models.Jobs.job_status == "Running",
                 )
             )
-            .all()
         )
-        job_details = [x.__dict__ for x in job_details]
+        job_details = [x.__dict__ for x in job_details.all()]
         remove_keys = [
             "celery_id",
             "_sa_instance_state",
@@ -1187,7 +1115,9 @@ def get_active_jobs(user_id, db, rd):
                 x.pop(y)
         final_data = []
         for job in job_details:
-            content_detail = fetch_content_data(job["content_id"], db).__dict__
+            content_detail = dict(
+                (await fetch_content_data_async(job["content_id"], db)).__dict__
+            )
             content_detail.pop("_sa_instance_state")
             content_detail = {k: v for k, v in content_detail.items() if v is not None}
             content_detail["thumbnail"] = add_presigned_single(
@@ -1196,20 +1126,16 @@ def get_active_jobs(user_id, db, rd):
             if content_detail["status"].value != "processing":
                 continue
             job["content_detail"] = content_detail
-            all_content_tags = []
-            related_content = (
-                db.query(models.Content)
-                .filter(models.Content.job_id == job["job_id"])
-                .all()
-            )
-            all_content_id = [x.id for x in related_content]
-            tags_query = (
-                db.query(models.ContentTags)
-                .filter(models.ContentTags.content_id.in_(all_content_id))
-                .all()
+            tags_query = await db.scalars(
+                select(models.ContentTags.tag_id).where(
+                    models.ContentTags.content_id.in_(
+                        select(models.Content.id).where(
+                            models.Content.job_id == job["job_id"]
+                        )
+                    )
+                )
             )
-            for y in tags_query:
-                all_content_tags.append(y.tag_id)
+            all_content_tags = tags_query.all()
             job["content_detail"]["tags"] = []
             for tag in all_content_tags:
                 job["content_detail"]["tags"].append((all_tags[str(tag)]["readable"]))
@@ -1220,29 +1146,36 @@ def get_active_jobs(user_id, db, rd):
         raise HTTPException(status_code=400, detail="Unable to fetch jobs")
 
 
-def get_past_jobs(user_id, limit, offset, db, rd):
+async def get_past_jobs(user_id, limit, offset, db: AsyncSession, rd, cursor=None):
     try:
         all_tags = allTags(id=True)
         if limit > 5:
             raise HTTPException(
                 status_code=400, detail="Limit cannot be greater than 5"
             )
-        all_jobs = (
-            db.query(models.Jobs)
-            .filter(models.Jobs.job_status != "Processing")
-            .filter(models.Jobs.user_id == user_id)
-            .order_by(models.Jobs.created_at.desc())
+        jobs_query = (
+            select(models.Jobs)
+            .where(models.Jobs.job_status != "Processing")
+            .where(models.Jobs.user_id == user_id)
+            .order_by(models.Jobs.created_at.desc(), models.Jobs.job_id.desc())
             .limit(limit)
-            .offset(offset)
-            .all()
         )
-        total_count = (
-            db.query(models.Jobs)
-            .filter(models.Jobs.job_status != "Processing")
-            .filter(models.Jobs.user_id == user_id)
-            .count()
-        )
-        job_details = [x.__dict__ for x in all_jobs]
+        if cursor is not None:
+            jobs_query = jobs_query.where(
+                keyset_filter(models.Jobs.created_at, models.Jobs.job_id, cursor)
+            )
+        else:
+            jobs_query = jobs_query.offset(offset)
+        all_jobs = await db.scalars(jobs_query)
+        total_count, counts_generation = get_cached_count(rd, user_id, "jobs_past")
+        if total_count is None:
+            total_count = await db.scalar(
+                select(func.count(models.Jobs.job_id))
+                .where(models.Jobs.job_status != "Processing")
+                .where(models.Jobs.user_id == user_id)
+            )
+            set_cached_count(rd, user_id, "jobs_past", total_count, counts_generation)
+        job_details = [x.__dict__ for x in all_jobs.all()]
         remove_keys = [
             "_sa_instance_state",
             "user_id",
@@ -1256,32 +1189,36 @@ def get_past_jobs(user_id, limit, offset, db, rd):
                 x.pop(y)
         final_data = []
         for job in job_details:
-            content_detail = fetch_content_data(job["content_id"], db).__dict__
+            content_detail = dict(
+                (await fetch_content_data_async(job["content_id"], db)).__dict__
+            )
             content_detail.pop("_sa_instance_state")
             content_detail = {k: v for k, v in content_detail.items() if v is not None}
             content_detail["thumbnail"] = add_presigned_single(
                 content_detail["thumbnail"], CLOUDFLARE_METADATA, rd
             )
             job["content_detail"] = content_detail
-            all_content = (
-                db.query(models.Content)
-                .filter(models.Content.job_id == job["job_id"])
-                .all()
-            )
-            tags_query = (
-                db.query(models.ContentTags)
-                .filter(models.ContentTags.content_id.in_([x.id for x in all_content]))
-                .all()
+            tags_query = await db.scalars(
+                select(models.ContentTags.tag_id).where(
+                    models.ContentTags.content_id.in_(
+                        select(models.Content.id).where(
+                            models.Content.job_id == job["job_id"]
+                        )
+                    )
+                )
             )
-            all_content_tags = []
-            for y in tags_query:
-                all_content_tags.append(y.tag_id)
+            all_content_tags = tags_query.all()
             job["content_detail"]["tags"] = []
             for tag in all_content_tags:
                 job["content_detail"]["tags"].append((all_tags[str(tag)]["readable"]))
             job["content_detail"]["tags"] = ",".join(job["content_detail"]["tags"])
             final_data.append(job)
-        return {"detail": "Success", "data": final_data, "total": total_count}
+        return {
+            "detail": "Success",
+            "data": final_data,
+            "total": total_count,
+            "next_cursor": next_cursor(job_details, limit, id_key="job_id"),
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -1291,48 +1228,40 @@ async def get_jobs(
     job_type: str,
     limit: int = 5,
     offset: int = 0,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: TokenData = Depends(get_current_user),
     rd: redis.Redis = Depends(get_redis),
 ):
     try:
         if job_type == "active":
-            return get_active_jobs(current_user.user_id, db, rd)
+            return await get_active_jobs(current_user.user_id, db, rd)
         elif job_type == "past":
-            return get_past_jobs(current_user.user_id, limit, offset, db, rd)
+            return await get_past_jobs(
+                current_user.user_id, limit, offset, db, rd, cursor
+            )
         else:
             raise Exception
     except Exception as e:
         raise HTTPException(status_code=400, detail="Unable to fetch jobs")
 
 
-def fetch_instance_status(instance_id, provider):
-    if provider == "vast":
-        va = VastAI(
-            machine_id=123,
-            run_name="",
-            image="",
-            disk_size=0,
-            onstart="",
-            eta=0,
-            env={},
-        )
-        va.instance_id = int(instance_id)
-        redis_config = {}
-        if va.redis_config() == True:
-            redis_config["host"] = va.redis_host
-            redis_config["port"] = va.redis_port
-            return redis_config
-        return None
-    if provider == "runpod":
-        rp = RunpodIO(gpu_model="", run_name="", image="", disk_size=0, eta=0, env={})
-        rp.instance_id = int(instance_id)
-        redis_config = {}
-        if rp.redis_config() == True:
-            redis_config["host"] = rp.redis_host
-            redis_config["port"] = rp.redis_port
-            return redis_config
+async def fetch_instance_status(instance_id, provider):
+    try:
+        if provider == "vast":
+            instance = await vast_client().ainstance(int(instance_id))
+            return {
+                "host": instance["public_ipaddr"],
+                "port": int(instance["ports"]["6379/tcp"][0]["HostPort"]),
+            }
+        if provider == "runpod":
+            pod = await runpod_client().apod(instance_id)
+            for x in pod["runtime"]["ports"]:
+                if x["privatePort"] == 6379:
+                    return {"host": x["ip"], "port": x["publicPort"]}
+    except Exception:
         return None
+    return None
 
 
 def calculate_total_progress(current_chunk, total_chunks, current_chunk_progress):
@@ -1344,135 +1273,194 @@ def calculate_total_progress(current_chunk, total_chunks, current_chunk_progress
     return total_progress
 
 
+INSTANCE_REDIS_PASSWORD = os.getenv("INSTANCE_REDIS_PASSWORD", "vB<K1Z5>8=K7")
+WS_AUTH_RECHECK = 60
+
+
+def format_progress(result: dict, tags: dict, model, job_state, chunk, progress):
+    try:
+        progress = int(progress)
+        start_chunk, end_chunk = [int(x) for x in str(chunk).split("/")]
+    except Exception:
+        start_chunk, end_chunk, progress = 1, 1, 100
+    total_progress = int(calculate_total_progress(start_chunk, end_chunk, progress))
+    # Unknown models are shown as they were reported.
+    readable = tags.get(model, {}).get("readable", model)
+    result.update(
+        {
+            "model": readable,
+            "status": job_state,
+            "progress": 100 if readable == "Uploading Content" else total_progress,
+        }
+    )
+    return result
+
+
+async def job_progress_snapshot(job_id: int, state: dict):
+    pushed = await progress_hub.latest_progress(job_id)
+    async with AsyncSessionLocal() as db:
+        job = await db.get(models.Jobs, job_id)
+        if job is None:
+            return {"job_type": "Unknown", "status": "Job not Found", "job_id": job_id}
+        job_status = job.job_status.lower()
+        # The first pushed update means the instance finished loading.
+        if pushed is not None and job_status in ("loading", "processing"):
+            job.job_status = "Running"
+            job.job_process = "running"
+            job.updated_at = int(time.time())
+            await db.commit()
+            job_status = "running"
+        result = {
+            "job_type": job.job_type,
+            "status": job.job_status.lower().capitalize(),
+            "job_id": int(job.job_id),
+        }
+        if job.job_type == "image":
+            result["status"] = job.job_status
+            return result
+        if job_status == "completed":
+            result.update({"model": "", "status": "Completed", "progress": ""})
+            return result
+        if job_status != "running":
+            return result
+        if pushed is None and "instance" not in state:
+            # Packed jobs are only linked to their machine through machine_id.
+            machine_filter = models.Machines.job_id == job_id
+            if job.machine_id is not None:
+                machine_filter = models.Machines.machine_id == job.machine_id
+            machine = await db.scalar(select(models.Machines).where(machine_filter))
+    if "tags" not in state:
+        state["tags"] = allTags()
+    if pushed is not None:
+        if "model" not in pushed or "status" not in pushed:
+            return result
+        return format_progress(
+            result,
+            state["tags"],
+            pushed["model"],
+            pushed["status"],
+            pushed.get("chunk"),
+            pushed.get("progress"),
+        )
+    # Instances that don't push yet are still read from their own Redis.
+    if "instance" not in state:
+        if machine is None:
+            result["status"] = "Job not Found"
+            return result
+        redis_config = await fetch_instance_status(
+            machine.instance_id, machine.provider
+        )
+        if redis_config is None:
+            result["status"] = "Job not Found"
+            return result
+        state["instance"] = aioredis.Redis(
+            host=redis_config["host"],
+            port=redis_config["port"],
+            db=0,
+            password=INSTANCE_REDIS_PASSWORD,
+            socket_timeout=60,
+        )
+        state.setdefault("clients", []).append(state["instance"])
+    try:
+        model, job_state, chunk, progress = await state["instance"].mget(
+            ["model", "status", "chunk", "progress"]
+        )
+        model = model.decode("utf-8")
+        job_state = job_state.decode("utf-8")
+    except Exception:
+        result["status"] = "Job not Found"
+        return result
+    chunk = chunk.decode("utf-8") if chunk is not None else None
+    progress = progress.decode("utf-8") if progress is not None else None
+    return format_progress(result, state["tags"], model, job_state, chunk, progress)
+
+
+def authorize_jobs(token: str, job_ids):
+    # Short-lived session: token checks hit the user cache and the socket
+    # never holds a connection while it waits for progress.
+    with SessionLocal() as db:
+        current_user = get_current_user(db, token)
+        if not job_ids:
+            return current_user, []
+        jobs = (
+            db.query(models.Jobs.job_id)
+            .filter(models.Jobs.job_id.in_(job_ids))
+            .filter(models.Jobs.user_id == current_user.user_id)
+            .all()
+        )
+    return current_user, [int(job.job_id) for job in jobs]
+
+
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    all_tags = allTags()
-    redis_conn = {}
-    job_ids = []
+    requested = asyncio.Queue()
+    watched = set()
     token = None
 
     async def receive_messages():
         nonlocal token
-        nonlocal job_ids
         while True:
             data = await websocket.receive_json()
             if "token" in data and "job_id" in data:
                 if not token:
                     token = data["token"]
-                job_ids.append(int(data["job_id"]))
+                await requested.put(int(data["job_id"]))
 
-    receive_task = asyncio.create_task(receive_messages())
+    async def send_snapshot(snapshot):
+        job_id = snapshot.get("job_id")
+        if str(snapshot["status"]).lower() in ["loading", "processing"]:
+            snapshot["ids"] = sorted(watched)
+        await websocket.send_json(snapshot)
+        if progress_hub.is_terminal(snapshot) and job_id in watched:
+            watched.discard(job_id)
+            await pubsub.unsubscribe(progress_hub.progress_channel(job_id))
 
+    receive_task = asyncio.create_task(receive_messages())
+    pubsub = progress_hub.subscribe()
+    last_auth = 0
     try:
         await asyncio.sleep(5)
         while True:
-            if not job_ids:
+            new_ids = []
+            while not requested.empty():
+                job_id = requested.get_nowait()
+                if job_id not in watched and job_id not in new_ids:
+                    new_ids.append(job_id)
+            if token is None:
                 raise Exception
-            current_user = get_current_user(db, token)
-            if current_user is None:
-                await websocket.close()
-                break
-            jobs = db.query(models.Jobs).filter(models.Jobs.job_id.in_(job_ids)).all()
-            if not jobs:
-                result = {"job_type": "Unknown", "status": "Job not Found"}
-                await websocket.send_json(result)
-                await websocket.close()
-            for job in jobs:
-                db.refresh(job)
-                result = {
-                    "job_type": job.job_type,
-                    "status": job.job_status.lower().capitalize(),
-                    "job_id": int(job.job_id),
-                }
-                if job.job_type == "image":
-                    result["status"] = job.job_status
-                else:
-                    if job.job_status.lower() == "failed":
-                        result["status"] = job.job_status.lower().capitalize()
-                    elif job.job_status.lower() in ["loading", "processing"]:
-                        result = {
-                            "job_type": job.job_type,
-                            "status": job.job_status.lower().capitalize(),
-                            "job_id": int(job.job_id),
-                        }
-                        result["ids"] = job_ids
-                    elif job.job_status.lower() == "running":
-                        conn_key = f"{job.job_id}"
-                        if conn_key in redis_conn:
-                            rd = redis_conn[conn_key]
-                        else:
-                            machine = (
-                                db.query(models.Machines)
-                                .filter(models.Machines.job_id == job.job_id)
-                                .first()
-                            )
-                            if machine is None:
-                                result["status"] = "Job not Found"
-                            else:
-                                redis_config = fetch_instance_status(
-                                    machine.instance_id, machine.provider
-                                )
-                                rd = redis.Redis(
-                                    host=redis_config["host"],
-                                    port=redis_config["port"],
-                                    db=0,
-                                    password="vB<K1Z5>8=K7",
-                                    socket_timeout=60,
-                                )
-                                redis_conn[conn_key] = rd
-
-                        try:
-                            rd.ping()
-                        except:
-                            result["status"] = "Job not Found"
-                        else:
-                            model = rd.get("model").decode("utf-8")
-                            status = rd.get("status").decode("utf-8")
-                            try:
-                                chunk = rd.get("chunk").decode("utf-8")
-                                progress = int(rd.get("progress").decode("utf-8"))
-                            except:
-                                chunk = "1/1"
-                                progress = 100
-                            start_chunk = int(chunk.split("/")[0])
-                            end_chunk = int(chunk.split("/")[1])
-                            total_progress = int(
-                                calculate_total_progress(
-                                    start_chunk, end_chunk, progress
-                                )
-                            )
-                            if all_tags[model]["readable"] == "Uploading Content":
-                                result.update(
-                                    {
-                                        "model": all_tags[model]["readable"],
-                                        "status": status,
-                                        "progress": 100,
-                                    }
-                                )
-                            else:
-                                result.update(
-                                    {
-                                        "model": all_tags[model]["readable"],
-                                        "status": status,
-                                        "progress": total_progress,
-                                    }
-                                )
-                    elif job.job_status.lower() == "completed":
-                        result.update(
-                            {
-                                "model": "",
-                                "status": "Completed",
-                                "progress": "",
-                            }
-                        )
-                        job_ids.remove(job.job_id)
-                await websocket.send_json(result)
-            await asyncio.sleep(5)
+            if new_ids or time.time() - last_auth > WS_AUTH_RECHECK:
+                _, allowed = await asyncio.to_thread(authorize_jobs, token, new_ids)
+                last_auth = time.time()
+                if new_ids and not allowed and not watched:
+                    result = {"job_type": "Unknown", "status": "Job not Found"}
+                    await websocket.send_json(result)
+                    await websocket.close()
+                    break
+                if allowed:
+                    watched.update(allowed)
+                    await pubsub.subscribe(
+                        *[progress_hub.progress_channel(x) for x in allowed]
+                    )
+                    snapshots = await progress_hub.latest_snapshots(allowed)
+                    for snapshot in snapshots.values():
+                        await send_snapshot(snapshot)
+            if not watched:
+                raise Exception
+            for job_id in list(watched):
+                await progress_hub.ensure_poller(job_id, job_progress_snapshot)
+            deadline = time.monotonic() + progress_hub.PROGRESS_INTERVAL
+            while watched and time.monotonic() < deadline:
+                message = await pubsub.get_message(
+                    timeout=max(deadline - time.monotonic(), 0.01)
+                )
+                if message is not None and message["type"] == "message":
+                    await send_snapshot(json.loads(message["data"]))
     except Exception as e:
         await websocket.close()
     finally:
         receive_task.cancel()
+        await pubsub.close()
 
 
 @router.get("/filter_config")
@@ -1613,10 +1601,77 @@ async def file_index(
     return {"detail": "Success", "data": {result.id}}
 
 
+def verify_job_key(db: Session, rd, job_id: int, key: str):
+    # Instances push every few seconds, so the key check is cached in Redis
+    # rather than hitting Postgres on each update.
+    key_hash = progress_hub.hash_job_key(key)
+    cached = rd.get(progress_hub.job_key_cache(job_id))
+    if cached is not None:
+        return cached.decode("utf-8") == key_hash
+    job = (
+        db.query(models.Jobs.job_id)
+        .filter(models.Jobs.job_id == job_id)
+        .filter(models.Jobs.key == key)
+        .filter(models.Jobs.job_key == True)
+        .first()
+    )
+    if job is None:
+        return False
+    rd.set(
+        progress_hub.job_key_cache(job_id),
+        key_hash,
+        ex=progress_hub.JOB_KEY_CACHE_TTL,
+    )
+    return True
+
+
+@router.post("/progress", status_code=status.HTTP_202_ACCEPTED)
+async def job_progress(
+    job_progress: JobProgress,
+    db: Session = Depends(get_db),
+    rd: redis.Redis = Depends(get_redis),
+):
+    if not verify_job_key(db, rd, job_progress.job_id, job_progress.key):
+        raise HTTPException(status_code=401, detail="Invalid job key")
+    fields = {}
+    if job_progress.event == "progress":
+        fields = job_progress.dict(include=set(progress_hub.PROGRESS_FIELDS))
+    progress_hub.record_progress(rd, job_progress.job_id, fields)
+    return {"detail": "Accepted"}
+
+
+@router.post("/replicate_webhook")
+async def replicate_webhook(
+    prediction: ReplicatePrediction, job_id: int, step: int, token: str
+):
+    if not REPLICATE_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhooks are not enabled")
+    if not hmac.compare_digest(token, replicate_webhook_token(job_id, step)):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    image_prediction_done.delay(
+        job_id, step, {"status": prediction.status, "output": prediction.output}
+    )
+    return {"detail": "Success"}
+
+
 def roundup(x):
     return int(math.ceil(x / 100.0)) * 100
 
 
+def packed_gpu_usage(db: Session, job: models.Jobs, machine, now: int):
+    # Jobs on one instance run back to back, so each is charged from the
+    # moment the previous one finished, or the instance was rented.
+    previous = (
+        db.query(func.max(models.Jobs.updated_at))
+        .filter(models.Jobs.machine_id == machine.machine_id)
+        .filter(models.Jobs.job_id != job.job_id)
+        .filter(models.Jobs.job_key == False)
+        .scalar()
+    )
+    started = max(int(machine.created_at), int(previous or 0))
+    return max(now - started, 0)
+
+
 @router.post(
     "/job_status",
     status_code=status.HTTP_201_CREATED,
@@ -1647,11 +1702,19 @@ async def job_status(job_status: JobStatus, db: Session = Depends(get_db)):
             .filter(models.Machines.job_id == job.job_id)
             .first()
         )
+        if job.machine_id is not None:
+            machine = (
+                db.query(models.Machines)
+                .filter(models.Machines.machine_id == job.machine_id)
+                .first()
+            )
         if dashboard is None:
             raise HTTPException(status_code=400, detail="Job not found")
-        gpu_usage = abs(int(machine.updated_at) - int(machine.created_at))
-        dashboard.gpu_usage += gpu_usage
-        db.add(dashboard)
+        if job.machine_id is None:
+            gpu_usage = abs(int(machine.updated_at) - int(machine.created_at))
+        else:
+            gpu_usage = packed_gpu_usage(db, job, machine, int(time.time()))
+        increment_dashboard(db, job.user_id, gpu_usage=gpu_usage)
         status = "completed"
         for x in content_data:
             if str(x.status) == "completed":
@@ -1665,6 +1728,12 @@ async def job_status(job_status: JobStatus, db: Session = Depends(get_db)):
         job.job_key = False
         db.add(job)
         db.commit()
+        if status == "completed":
+            record_processing_result(db, job.job_id)
+        # The reconciler only notifies for jobs still running on a machine, so
+        # jobs that report their own result are notified here.
+        job_email.delay(job_id=job.job_id, user_id=job.user_id, status=status)
+        send_discord_update.delay(job_id=job.job_id, user_id=job.user_id, status=status)
         return HTTPException(status_code=201, detail="Job updated")
     except Exception as e:
         logger.error(f"Error while job indexing - {job_status}")
@@ -1676,10 +1745,9 @@ def get_content_estimate(content: dict, job_config: dict, raw: bool = False):
     if content["content_type"] == "video":
         filters = dict(job_config)
         resolution = content["resolution"]
-        fps = np.ceil(float(content["fps"]))
-        duration = content["duration"]
+        fps = math.ceil(content["fps"])
         width, height = map(int, resolution.split("x"))
-        duration_seconds = duration_to_seconds(duration)
+        duration_seconds = content["duration"]
         total_pixels = width * height * fps * duration_seconds
         total_time = 0
         for filter_name, filter_config in filters.items():
@@ -1694,7 +1762,7 @@ def get_content_estimate(content: dict, job_config: dict, raw: bool = False):
                     pixels_per_second = MODEL_COMPUTE["video"][filter_name]
                 filter_time = total_pixels / pixels_per_second
                 total_time += filter_time
-        total_time = roundup(np.ceil(total_time) + 300 + 600)
+        total_time = roundup(math.ceil(total_time) + 300 + 600)
         per_second_cost = 0.0003
         estimate = total_time * per_second_cost
         estimate = format(max(round(estimate, 2), 0.05), ".2f")
@@ -1724,7 +1792,7 @@ def get_content_estimate(content: dict, job_config: dict, raw: bool = False):
                 else:
                     compute_time = MODEL_COMPUTE["image"][filter_name] * scale + 30
                 total_time += compute_time
-        total_time = roundup(np.ceil(total_time) + 5 + 30)
+        total_time = roundup(math.ceil(total_time) + 5 + 30)
         per_second_cost = 0.000725
         estimate = total_time * per_second_cost
         estimate = format(max(round(estimate, 2), 0.05), ".2f")
@@ -1737,15 +1805,14 @@ def get_content_estimate(content: dict, job_config: dict, raw: bool = False):
         }
     if content["content_type"] == "audio":
         filters = dict(job_config)
-        duration = content["duration"]
-        duration_seconds = duration_to_seconds(duration)
+        duration_seconds = content["duration"]
         total_time = 0
         for filter_name, filter_config in filters.items():
             if filter_config["active"]:
                 compute_per_seconds = MODEL_COMPUTE["audio"][filter_name]
-                filter_time = int(np.ceil(duration_seconds / compute_per_seconds))
+                filter_time = int(math.ceil(duration_seconds / compute_per_seconds))
                 total_time += filter_time
-        total_time = roundup(np.ceil(total_time) + 30 + 600)
+        total_time = roundup(math.ceil(total_time) + 30 + 600)
         per_second_cost = 0.0003
         estimate = total_time * per_second_cost
         estimate = format(max(round(estimate, 2), 0.05), ".2f")
@@ -1769,7 +1836,7 @@ async def get_estimate(
     rd: redis.Redis = Depends(get_redis),
     current_user: TokenData = Depends(get_current_user),
 ):
-    key = f"{current_user.user_id}_{job_config.content_id}"
+    key = f"estimate_{current_user.user_id}_{job_config.content_id}"
     try:
         if rd.exists(key):
             content = json.loads(rd.get(key).decode("utf-8"))
@@ -1783,12 +1850,21 @@ async def get_estimate(
             if content is None:
                 raise HTTPException(status_code=400, detail="Content Not Found")
             content = content.__dict__
-            rd.set(key, json.dumps(content, default=str))
+            rd.set(key, json.dumps(content, default=str), ex=CONTENT_EXPIRE)
         return get_content_estimate(content, job_config.job_config)
     except Exception as e:
         raise HTTPException(400)
 
 
+def job_charged(rd, job, machine):
+    # Jobs are charged when their machine starts or their first Replicate
+    # prediction is submitted, not when they are registered, so queued jobs
+    # and jobs waiting in a pack window have nothing to refund.
+    if job.job_type == "image":
+        return bool(rd.exists(replicate_chain_key(job.job_id)))
+    return job.machine_id is not None or machine is not None
+
+
 @router.get(
     "/cancel_job",
     status_code=status.HTTP_200_OK,
@@ -1807,12 +1883,30 @@ async def cancel_job(
             .filter(models.Jobs.user_id == current_user.user_id)
             .first()
         )
+        if job is None or not job.job_key:
+            raise HTTPException(status_code=400, detail="Job is not running")
         machine = (
             db.query(models.Machines)
             .filter(models.Machines.job_id == job_id)
             .filter(models.Jobs.user_id == current_user.user_id)
             .first()
         )
+        charged = job_charged(rd, job, machine)
+        if job.machine_id is not None:
+            machine = (
+                db.query(models.Machines)
+                .filter(models.Machines.machine_id == job.machine_id)
+                .first()
+            )
+            # Other packed jobs still need the instance.
+            if (
+                db.query(models.Jobs)
+                .filter(models.Jobs.machine_id == job.machine_id)
+                .filter(models.Jobs.job_id != job_id)
+                .filter(models.Jobs.job_key == True)
+                .count()
+            ):
+                machine = None
         all_content = (
             db.query(models.Content)
             .filter(models.Content.job_id == job_id)
@@ -1836,19 +1930,17 @@ async def cancel_job(
             .filter(models.Balance.user_id == current_user.user_id)
             .first()
         )
-        balance.balance += float(price)
-        db.add(balance)
+        if charged:
+            balance.balance += float(price)
+            db.add(balance)
+        if job.job_type in scheduler.JOB_LANES:
+            scheduler.remove(rd, job.job_type, job_id)
         job.job_status = "Cancelled"
         job.job_key = False
         job.job_process = "cancelled"
         db.add(job)
         if machine is not None:
-            if machine.provider == "vast":
-                url = f"https://console.vast.ai/api/v0/instances/{machine.instance_id}/?api_key={VAST_KEY}"
-                r = requests.delete(url)
-            if machine.provider == "runpod":
-                runpod.api_key = RUNPOD_KEY
-                runpod.terminate_pod(machine.instance_id)
+            await aterminate_instance(machine.provider, machine.instance_id)
             machine.machine_status = "CANCELLED"
             machine.updated_at = int(time.time())
             db.add(machine)
@@ -1860,6 +1952,7 @@ async def cancel_job(
             if job.job_type == "image":
                 task = image_process_task.AsyncResult(job.celery_id)
                 task.abort()
+                cancel_image_prediction.delay(job.job_id)
             else:
                 celeryapp.control.revoke(job.celery_id, terminate=True)
         db.commit()
@@ -1867,5 +1960,7 @@ async def cancel_job(
         send_discord_update.delay(
             job_id=job_id, user_id=current_user.user_id, status="cancelled"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(400, "Error while cancelling the job")
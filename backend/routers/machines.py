@@ -2,18 +2,35 @@ import sys
 
 sys.path.append("..")
 
+import time
+import uuid
+from collections import defaultdict
 from typing import Optional
 from fastapi import Depends, HTTPException, APIRouter
+import redis
 import models
 from database import engine, SessionLocal
+from sqlalchemy import or_, select, update
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 from script_utils.util import *
+from script_utils import pagination, progress_hub
+from script_utils.result_cache import record_processing_result
+from script_utils.warm_pool import (
+    WARM_POOL_DISK,
+    WARM_POOL_IDLE_TTL,
+    WARM_POOL_JOB_TYPE,
+    WARM_POOL_PIPELINE,
+    WARM_POOL_RATE_WINDOW,
+    WARM_POOL_SIZE,
+    pool_targets,
+)
 from dotenv import load_dotenv
 from typing import Optional, Annotated
 from celeryworker import celeryapp
 from cryptography.fernet import Fernet
 from routers.auth import authenticate_user, get_current_user, TokenData
+from utils import REDIS_HOST, REDIS_PORT, logger, job_email, send_discord_update
 
 load_dotenv()
 
@@ -22,9 +39,355 @@ router = APIRouter(
     prefix="/machines", tags=["machines"], responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
+ACTIVE_MACHINE_STATUSES = ("LOADING", "RUNNING")
+LOADING_TIMEOUT = {"vast": 600, "runpod": 1200}
+ORPHAN_CANDIDATES_KEY = "machine_orphan_candidates"
 
 
 @celeryapp.task
 def delete_instance_celery(job_id: int, machine_id: int, key: str) -> None:
     pass
+
+
+def machine_transition(machine, instance_status: dict, heartbeat_lost: bool, now: int):
+    if str(machine.machine_status) == "IDLE":
+        # Warm machines only leave the pool by being claimed or timing out.
+        if machine.expires_at is not None and now > int(machine.expires_at):
+            return "CANCELLED"
+        if instance_status["detail"] == "Failed" or instance_status["data"] == "EXITED":
+            return "FAILED"
+        return None
+    if machine.expires_at is not None and now > int(machine.expires_at):
+        return "FAILED"
+    if heartbeat_lost or instance_status["detail"] == "Failed":
+        return "FAILED"
+    if instance_status["data"] == "LOADING" and (
+        now - int(machine.created_at) >= LOADING_TIMEOUT.get(machine.provider, 600)
+    ):
+        return "FAILED"
+    if instance_status["data"] == "EXITED":
+        return "EXITED"
+    if instance_status["data"] != str(machine.machine_status):
+        return instance_status["data"]
+    return None
+
+
+def machine_jobs(db: Session, machines):
+    """
+    Map each machine to the unfinished (job_id, user_id) pairs it is running:
+    its lead job plus any jobs packed onto it.
+    """
+    members = {x.machine_id: set() for x in machines}
+    leads = {x.job_id: x.machine_id for x in machines}
+    if not members:
+        return {}
+    unfinished = db.execute(
+        select(models.Jobs.machine_id, models.Jobs.job_id, models.Jobs.user_id)
+        .where(
+            or_(
+                models.Jobs.machine_id.in_(members.keys()),
+                models.Jobs.job_id.in_(leads.keys()),
+            )
+        )
+        .where(models.Jobs.job_key == True)
+    )
+    for machine_id, job_id, user_id in unfinished:
+        members[leads.get(job_id, machine_id)].add((job_id, user_id))
+    return {machine_id: sorted(jobs) for machine_id, jobs in members.items()}
+
+
+def apply_transitions(db: Session, transitions: dict, now: int, members: dict, rd=None):
+    finished = {}
+    users = set()
+    for machine_status, machines in transitions.items():
+        machine_ids = [x.machine_id for x in machines]
+        job_ids = [job_id for x in machines for job_id, _ in members[x.machine_id]]
+        users.update(user_id for x in machines for _, user_id in members[x.machine_id])
+        db.execute(
+            update(models.Machines)
+            .where(models.Machines.machine_id.in_(machine_ids))
+            .values(machine_status=machine_status, updated_at=now),
+            execution_options={"synchronize_session": False},
+        )
+        if machine_status in ACTIVE_MACHINE_STATUSES:
+            db.execute(
+                update(models.Jobs)
+                .where(models.Jobs.job_id.in_(job_ids))
+                .values(
+                    job_status=machine_status.lower().capitalize(),
+                    job_process=machine_status.lower(),
+                    updated_at=now,
+                ),
+                execution_options={"synchronize_session": False},
+            )
+            continue
+        # Whatever content an exited instance didn't finish has failed too.
+        content_filter = models.Content.job_id.in_(job_ids)
+        if machine_status == "EXITED":
+            content_filter = content_filter & (models.Content.status != "completed")
+        failed_jobs = set(job_ids)
+        if machine_status == "EXITED":
+            failed_jobs = set(
+                db.scalars(select(models.Content.job_id).where(content_filter))
+            )
+        db.execute(
+            update(models.Content)
+            .where(content_filter)
+            .values(status="failed", updated_at=now),
+            execution_options={"synchronize_session": False},
+        )
+        for job_status, ids in [
+            ("failed", failed_jobs),
+            ("completed", set(job_ids) - failed_jobs),
+        ]:
+            if not ids:
+                continue
+            db.execute(
+                update(models.Jobs)
+                .where(models.Jobs.job_id.in_(ids))
+                .values(
+                    job_key=False,
+                    job_status=job_status.capitalize(),
+                    job_process=job_status,
+                    updated_at=now,
+                ),
+                execution_options={"synchronize_session": False},
+            )
+            finished.update({job_id: job_status for job_id in ids})
+    db.commit()
+    # Bulk updates skip the session's count tracking, so the listing totals
+    # of every user whose jobs or content changed are dropped here.
+    pagination.invalidate_counts(users, rd)
+    return finished
+
+
+def reap_orphans(rd, listings: dict, known: set):
+    from script_utils.gpu_workers import (
+        PIPELINE_RUN_NAME,
+        instance_run_name,
+        terminate_instance,
+    )
+
+    candidates = set()
+    for provider, instances in listings.items():
+        if instances is None:
+            continue
+        for instance_id, instance in instances.items():
+            if (provider, instance_id) in known:
+                continue
+            if instance_run_name(provider, instance) != PIPELINE_RUN_NAME:
+                continue
+            candidates.add(f"{provider}:{instance_id}")
+    # An instance is only reaped once it has been seen without an active
+    # machine row on two runs in a row, so launches that haven't committed
+    # their row yet are left alone.
+    previous = {x.decode("utf-8") for x in rd.smembers(ORPHAN_CANDIDATES_KEY)}
+    reaped = candidates & previous
+    for candidate in reaped:
+        provider, instance_id = candidate.split(":", 1)
+        terminate_instance(provider, instance_id)
+        logger.info(f"Terminated orphaned {provider} instance {instance_id}")
+    pipe = rd.pipeline(transaction=False)
+    pipe.delete(ORPHAN_CANDIDATES_KEY)
+    if candidates - reaped:
+        pipe.sadd(ORPHAN_CANDIDATES_KEY, *(candidates - reaped))
+    pipe.execute()
+    return reaped
+
+
+def reconcile_machines(db: Session, rd, listings: dict, now: int = None):
+    from script_utils.gpu_workers import runpod_status, terminate_instance, vast_status
+
+    now = now or int(time.time())
+    classify = {"vast": vast_status, "runpod": runpod_status}
+    machines = (
+        db.query(models.Machines)
+        .filter(models.Machines.machine_status.in_(ACTIVE_MACHINE_STATUSES + ("IDLE",)))
+        .all()
+    )
+    members = machine_jobs(db, machines)
+    last_seen = progress_hub.last_heartbeats(
+        rd, {job_id for jobs in members.values() for job_id, _ in jobs}
+    )
+    cutoff = now - progress_hub.HEARTBEAT_TIMEOUT
+    known = {(x.provider, str(x.instance_id)) for x in machines}
+    transitions = defaultdict(list)
+    for machine in machines:
+        instances = listings.get(machine.provider)
+        if machine.provider not in classify or instances is None:
+            # Provider is unreachable, so leave its machines for the next run.
+            continue
+        instance_status = classify[machine.provider](
+            instances.get(str(machine.instance_id))
+        )
+        # A packed instance only pushes for the job it is working on.
+        seen = [
+            last_seen[job_id]
+            for job_id, _ in members[machine.machine_id]
+            if job_id in last_seen
+        ]
+        heartbeat_lost = bool(seen) and max(seen) < cutoff
+        machine_status = machine_transition(
+            machine, instance_status, heartbeat_lost, now
+        )
+        if machine_status is not None:
+            transitions[machine_status].append(machine)
+    stopped = []
+    for machine_status in ("FAILED", "EXITED", "CANCELLED"):
+        for machine in transitions.get(machine_status, []):
+            terminate_instance(machine.provider, machine.instance_id)
+            stopped.extend(members[machine.machine_id])
+    finished = apply_transitions(db, transitions, now, members, rd)
+    for job_id, job_status in finished.items():
+        if job_status == "completed":
+            record_processing_result(db, job_id)
+    progress_hub.clear_heartbeats(rd, finished.keys())
+    for job_id, user_id in stopped:
+        job_status = finished.get(job_id, "failed")
+        job_email.delay(job_id=job_id, user_id=user_id, status=job_status)
+        send_discord_update.delay(job_id=job_id, user_id=user_id, status=job_status)
+    reaped = reap_orphans(rd, listings, known)
+    return {
+        "machines": len(machines),
+        "updated": sum(len(x) for x in transitions.values()),
+        "finished": len(finished),
+        "orphans": len(reaped),
+    }
+
+
+@celeryapp.task(name="routers.machines.reconcile_machines_celery")
+def reconcile_machines_celery():
+    from script_utils.gpu_workers import list_runpod_pods, list_vast_instances
+
+    listings = {"vast": list_vast_instances(), "runpod": list_runpod_pods()}
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    try:
+        with Session(engine) as db:
+            result = reconcile_machines(db, rd, listings)
+            logger.info(f"Reconciled machines - {result}")
+            return {"detail": "Success", "data": result}
+    except Exception as e:
+        logger.error(f"Error while reconciling machines - {str(e)}")
+        return {"detail": "Failed", "data": str(e)}
+    finally:
+        rd.close()
+
+
+@celeryapp.task(name="routers.machines.refresh_gpu_offers_celery")
+def refresh_gpu_offers_celery():
+    from script_utils.gpu_workers import refresh_gpu_offers
+
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    try:
+        listing = refresh_gpu_offers(rd)
+        if listing is None:
+            return {"detail": "Failed", "data": "Unable to fetch GPU offers"}
+        return {"detail": "Success", "data": len(listing)}
+    finally:
+        rd.close()
+
+
+def extend_warm_machines(db: Session, targets: dict, now: int):
+    # The newest idle machines, up to the current target, are kept for
+    # another TTL. The rest run out and are terminated by the reconciler.
+    idle = (
+        db.query(models.Machines)
+        .filter(models.Machines.machine_status == "IDLE")
+        .filter(models.Machines.expires_at > now)
+        .order_by(models.Machines.created_at.desc())
+        .all()
+    )
+    kept = defaultdict(int)
+    for machine in idle:
+        if kept[machine.cuda] >= targets.get(machine.cuda, 0):
+            continue
+        kept[machine.cuda] += 1
+        machine.expires_at = now + WARM_POOL_IDLE_TTL
+        machine.updated_at = now
+    db.commit()
+    return kept
+
+
+def launch_warm_machine(rd, df, cuda: str, used: set):
+    from script_utils.launcher import gpu_launch_candidates, hedged_launch
+
+    pipeline, onstart = WARM_POOL_PIPELINE
+    key = uuid.uuid4().hex
+    env = {"IDLE_POLL": "/jobs/idle_poll", "MACHINE_KEY": key}
+    candidates = gpu_launch_candidates(
+        df,
+        env,
+        WARM_POOL_IDLE_TTL,
+        WARM_POOL_IDLE_TTL,
+        WARM_POOL_DISK,
+        pipeline,
+        onstart,
+        cuda_versions=[cuda],
+    )
+    launched = hedged_launch(rd, [x for x in candidates if x[0] not in used])
+    if launched is None:
+        return None
+    offer, provider, instance = launched
+    # A Vast offer is a single machine, so it can't be rented twice.
+    if provider == "vast":
+        used.add(offer)
+    return provider, instance, key
+
+
+def maintain_warm_pool(db: Session, rd, now: int = None):
+    from script_utils.gpu_workers import get_gpu_offers
+
+    now = now or int(time.time())
+    if not WARM_POOL_SIZE:
+        return {}
+    arrivals = (
+        db.query(models.Jobs)
+        .filter(models.Jobs.job_type == WARM_POOL_JOB_TYPE)
+        .filter(models.Jobs.created_at >= now - WARM_POOL_RATE_WINDOW)
+        .count()
+    )
+    targets = pool_targets(arrivals)
+    kept = extend_warm_machines(db, targets, now)
+    launched = defaultdict(int)
+    used = set()
+    df = None
+    for cuda, target in targets.items():
+        for _ in range(target - kept[cuda]):
+            if df is None:
+                df = get_gpu_offers(rd)
+            if df is None or len(df) == 0:
+                break
+            warm = launch_warm_machine(rd, df, cuda, used)
+            if warm is None:
+                break
+            provider, instance, key = warm
+            db.add(
+                models.Machines(
+                    instance_id=str(instance.instance_id),
+                    machine_status="IDLE",
+                    provider=provider,
+                    created_at=now,
+                    updated_at=now,
+                    expires_at=now + WARM_POOL_IDLE_TTL,
+                    cuda=cuda,
+                    key=key,
+                )
+            )
+            db.commit()
+            launched[cuda] += 1
+    return {"arrivals": arrivals, "targets": targets, "launched": dict(launched)}
+
+
+@celeryapp.task(name="routers.machines.maintain_warm_pool_celery")
+def maintain_warm_pool_celery():
+    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    try:
+        with Session(engine) as db:
+            result = maintain_warm_pool(db, rd)
+            logger.info(f"Warm pool - {result}")
+            return {"detail": "Success", "data": result}
+    except Exception as e:
+        logger.error(f"Error while maintaining warm pool - {str(e)}")
+        return {"detail": "Failed", "data": str(e)}
+    finally:
+        rd.close()
@@ -15,8 +15,10 @@ from routers.auth import get_current_user, TokenData
 import models
 from script_utils.util import *
 from dotenv import load_dotenv
-from utils import TNSR_DOMAIN, CLOUDFLARE_CONTENT, CLOUDFLARE_METADATA, USER_TIER
+from utils import TNSR_DOMAIN, USER_TIER
 from celeryworker import celeryapp
+from routers.dashboard import content_removed
+from script_utils.result_cache import release_r2_objects
 from fastapi_limiter.depends import RateLimiter
 
 load_dotenv()
@@ -26,8 +28,6 @@ router = APIRouter(
     prefix="/options", tags=["options"], responses={404: {"description": "Not allowed"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 
 def get_db():
     try:
@@ -60,11 +60,6 @@ def delete_project_celery(
             .first()
         )
         if main_file:
-            dashboard_user = (
-                db.query(models.Dashboard)
-                .filter(models.Dashboard.user_id == user_id)
-                .first()
-            )
             attached_content = (
                 db.query(models.Content)
                 .filter(models.Content.id_related == content_id)
@@ -94,42 +89,6 @@ def delete_project_celery(
                     if machine is not None:
                         machine.job_id = None
                     db.add(machine)
-                try:
-                    file_size = "".join(
-                        [x for x in all_content.size if x.isdigit() or x == "."]
-                    )
-                except:
-                    file_size = 0
-                if content_type == "video":
-                    dashboard_user.video_processed = (
-                        int(dashboard_user.video_processed) - 1
-                    )
-                    storageJSON = json.loads(dashboard_user.storage_json)
-                    storageJSON["video"] = float(storageJSON["video"]) - bytes_to_mb(
-                        float(file_size)
-                    )
-                    dashboard_user.storage_json = json.dumps(storageJSON)
-                elif content_type == "audio":
-                    dashboard_user.audio_processed = (
-                        int(dashboard_user.audio_processed) - 1
-                    )
-                    storageJSON = json.loads(dashboard_user.storage_json)
-                    storageJSON["audio"] = float(storageJSON["audio"]) - bytes_to_mb(
-                        float(file_size)
-                    )
-                    dashboard_user.storage_json = json.dumps(storageJSON)
-                elif content_type == "image":
-                    dashboard_user.image_processed = (
-                        int(dashboard_user.image_processed) - 1
-                    )
-                    storageJSON = json.loads(dashboard_user.storage_json)
-                    storageJSON["image"] = float(storageJSON["image"]) - bytes_to_mb(
-                        float(file_size)
-                    )
-                    dashboard_user.storage_json = json.dumps(storageJSON)
-                dashboard_user.storage_used = float(
-                    dashboard_user.storage_used
-                ) - float(file_size)
                 related_tags = (
                     db.query(models.ContentTags)
                     .filter(models.ContentTags.content_id == all_content.id)
@@ -137,12 +96,11 @@ def delete_project_celery(
                 )
                 for tag in related_tags:
                     db.delete(tag)
-                if str(all_content.status) == "completed":
-                    delete_r2_file.delay(all_content.link, CLOUDFLARE_CONTENT)
-                    delete_r2_file.delay(all_content.thumbnail, CLOUDFLARE_METADATA)
                 if job_data is not None:
                     db.delete(job_data)
                 db.delete(all_content)
+            release_r2_objects(db, attached_content)
+            content_removed(db, user_id, attached_content)
             db.commit()
             return {"detail": "Success", "data": "Project Deleted"}
         else:
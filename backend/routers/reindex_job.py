@@ -1,5 +1,4 @@
 import base64
-import json
 import sys
 
 sys.path.append("..")
@@ -12,26 +11,26 @@ import pathlib
 import requests
 from uuid import uuid4
 import shutil
-import ast 
 from script_utils.util import *
 from utils import r2_client
 from utils import CLOUDFLARE_CONTENT, CLOUDFLARE_ACCESS_KEY, CLOUDFLARE_SECRET_KEY, CLOUDFLARE_METADATA, CLOUDFLARE_ACCOUNT_ENDPOINT
 import boto3, botocore
 from sqlalchemy.orm import Session
 from database import SessionLocal, engine
-from script_utils.util import lower_resolution_image, create_thumbnail_image, thumbnail_upload
+from routers.dashboard import content_added
 
 
 def reindex_image_job(job_config, content_url):
+    from script_utils.media import (
+        create_thumbnail_image,
+        lower_resolution_image,
+        thumbnail_upload,
+    )
+
     with Session(engine) as db:
         user = db.query(models.Users).filter(models.Users.id == job_config["user_id"]).first()
         if user is None:
             return {"detail": "Failed", "data": "User not found"}
-        user_dashboard = (
-            db.query(models.Dashboard)
-            .filter(models.Dashboard.user_id == job_config["user_id"])
-            .first()
-        )
         content_data = (
                 db.query(models.Content)
                 .filter(
@@ -102,21 +101,13 @@ def reindex_image_job(job_config, content_url):
         content_data.status = "completed"
         content_data.updated_at = int(time.time())
         # Update User Dashboard Stats
-        user_dashboard.image_processed += 1
-        user_dashboard.uploads += int(content_data.size)
-        user_dashboard.storage_used += int(content_data.size)
-        storage_json = ast.literal_eval(user_dashboard.storage_json)
-        storage_json["image"] = float(bytes_to_mb(content_data.size)) + float(
-            storage_json["image"]
-        )
-        user_dashboard.storage_json = json.dumps(storage_json)
+        content_added(db, job_config["user_id"], "image", int(content_data.size))
         # Update Job Data
         job_data.job_status = "Completed"
         job_data.job_process = "completed"
         job_data.job_key = False
         job_data.updated_at = int(time.time())
 
-        db.add(user_dashboard)
         db.add(content_data)
         db.add(job_data)
         db.commit()
@@ -8,14 +8,13 @@ from typing import Optional, Annotated
 from fastapi import Depends, HTTPException, APIRouter, Response, status, Request
 import models
 import os
-from database import engine, SessionLocal
+from database import SessionLocal
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
-from utils import *
 from routers.auth import authenticate_user, get_current_user, TokenData
+from script_utils.password_pool import hash_password
 import models
 from fastapi_limiter.depends import RateLimiter
-from script_utils.util import *
 from dotenv import load_dotenv
 from utils import logger
 
@@ -28,8 +27,6 @@ router = APIRouter(
     responses={404: {"description": "Not allowed"}},
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 
 def get_db():
     try:
@@ -55,10 +52,10 @@ class NotificationDict(BaseModel):
     discord_notification: bool
 
 
-def change_password_task(passworddict: dict, user_id: int, db: Session) -> None:
+async def change_password_task(passworddict: dict, user_id: int, db: Session) -> None:
     try:
         user = db.query(models.Users).filter(models.Users.id == user_id).first()
-        user_status = authenticate_user(
+        user_status = await authenticate_user(
             user.email, passworddict["current_password"], db
         )
         if user_status is False:
@@ -72,10 +69,11 @@ def change_password_task(passworddict: dict, user_id: int, db: Session) -> None:
                 "detail": "Failed",
                 "data": "Password cannot be same as old password",
             }
-        user = db.query(models.Users).filter(models.Users.id == user_id).first()
-        user.hashed_password = get_hashed_password(passworddict["new_password"])
+        user.hashed_password = await hash_password(passworddict["new_password"])
         db.commit()
         return {"detail": "Success", "data": "Password changed successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         return {"detail": "Failed", "data": "Unable to change password"}
 
@@ -89,9 +87,13 @@ async def change_password(
     db: Session = Depends(get_db),
 ):
     try:
-        task = change_password_task(passworddict.dict(), int(current_user.user_id), db)
+        task = await change_password_task(
+            passworddict.dict(), int(current_user.user_id), db
+        )
         logger.info(f"Password changed for {current_user.user_id}")
         return task
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Password change failed for {current_user.user_id}")
         return {"detail": "Failed", "data": "Unable to change password"}
@@ -1,5 +1,4 @@
 import base64
-import json
 import sys
 
 sys.path.append("..")
@@ -20,11 +19,11 @@ import models
 from script_utils.util import *
 from dotenv import load_dotenv
 from fastapi_limiter.depends import RateLimiter
-import ast
 import shutil
 import binascii
 from utils import logger
-from routers.content import allTags
+from utils import allTags
+from routers.dashboard import content_added
 from utils import r2_resource, r2_client, logger, delete_r2_file
 from utils import USER_TIER, STORAGE_LIMITS
 from celery.result import AsyncResult
@@ -37,8 +36,6 @@ router = APIRouter(
     prefix="/upload", tags=["upload"], responses={404: {"description": "Not allowed"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 os.makedirs("thumbnail", exist_ok=True)
 
 
@@ -186,6 +183,14 @@ async def generate_url(
 def video_indexing(
     response, thumbnail_path, db, indexdata, user_tier, reindex: bool = False
 ):
+    from script_utils.media import (
+        create_thumbnail,
+        is_video_valid,
+        lower_resolution,
+        thumbnail_upload,
+        video_fetch_data,
+    )
+
     try:
         video_data = is_video_valid(response)
         if video_data == False:
@@ -219,10 +224,10 @@ def video_indexing(
         if reindex == True:
             file_ext = pathlib.Path(indexdata["config"]["filename"]).suffix
             videoData.title = videoData.title + file_ext
-        videoData.duration = convert_seconds(int(float(vidData["duration"])))
+        videoData.duration = float(vidData["duration"])
         videoData.content_type = "video"
         videoData.size = int(vidData["filesize"])
-        videoData.fps = vidData["frame_rate"]
+        videoData.fps = float(vidData["frame_rate"])
         videoData.resolution = f"{vidData['width']}x{vidData['height']}"
         videoData.thumbnail = thumbnail_path
         videoData.md5 = indexdata["md5"]
@@ -243,6 +248,12 @@ def video_indexing(
 def image_indexing(
     response, thumbnail_path, db, indexdata, user_tier, reindex: bool = False
 ):
+    from script_utils.media import (
+        create_thumbnail_image,
+        lower_resolution_image,
+        thumbnail_upload,
+    )
+
     try:
         img_size, width, height = lower_resolution_image(response, thumbnail_path)
         allowed_config = USER_TIER[user_tier]["image"]
@@ -282,6 +293,8 @@ def image_indexing(
 def audio_indexing(
     response, thumbnail_path, db, indexdata, user_tier, reindex: bool = False
 ):
+    from script_utils.media import audio_image, thumbnail_upload
+
     try:
         audio_data = audio_image(
             response, indexdata["config"]["filename"].split(".")[-1], thumbnail_path
@@ -306,12 +319,10 @@ def audio_indexing(
             .filter(models.Content.id == indexdata["config"]["id"])
             .first()
         )
-        audioData.duration = convert_seconds(
-            int(float(audio_data["format"]["duration"]))
-        )
+        audioData.duration = float(audio_data["format"]["duration"])
         audioData.content_type = "audio"
         audioData.size = int(audio_data["format"]["size"])
-        audioData.hz = audio_data["streams"][0]["sample_rate"]
+        audioData.hz = float(audio_data["streams"][0]["sample_rate"])
         audioData.thumbnail = thumbnail_path
         audioData.md5 = indexdata["md5"]
         if (
@@ -397,20 +408,7 @@ def index_media_task(indexdata: dict, user_id: int, reindex: bool = False):
                     db.commit()
                     return result
                 videoData = result["data"]
-                user_stats = (
-                    db.query(models.Dashboard)
-                    .filter(models.Dashboard.user_id == user_id)
-                    .first()
-                )
-                user_stats.video_processed += 1
-                user_stats.uploads += int(videoData.size)
-                user_stats.storage_used += int(videoData.size)
-                storage_json = ast.literal_eval(user_stats.storage_json)
-                storage_json["video"] = float(bytes_to_mb(videoData.size)) + float(
-                    storage_json["video"]
-                )
-                user_stats.storage_json = json.dumps(storage_json)
-                db.add(user_stats)
+                content_added(db, user_id, "video", int(videoData.size))
                 db.add(videoData)
                 db.commit()
                 shutil.rmtree(f"thumbnail/{user_id}")
@@ -439,20 +437,7 @@ def index_media_task(indexdata: dict, user_id: int, reindex: bool = False):
                     db.commit()
                     return result
                 imageData = result["data"]
-                user_stats = (
-                    db.query(models.Dashboard)
-                    .filter(models.Dashboard.user_id == user_id)
-                    .first()
-                )
-                user_stats.image_processed += 1
-                user_stats.uploads += int(imageData.size)
-                user_stats.storage_used += int(imageData.size)
-                storage_json = ast.literal_eval(user_stats.storage_json)
-                storage_json["image"] = float(bytes_to_mb(imageData.size)) + float(
-                    storage_json["image"]
-                )
-                user_stats.storage_json = json.dumps(storage_json)
-                db.add(user_stats)
+                content_added(db, user_id, "image", int(imageData.size))
                 db.add(imageData)
                 db.commit()
                 shutil.rmtree(f"thumbnail/{user_id}")
@@ -481,20 +466,7 @@ def index_media_task(indexdata: dict, user_id: int, reindex: bool = False):
                     db.commit()
                     return result
                 audioData = result["data"]
-                user_stats = (
-                    db.query(models.Dashboard)
-                    .filter(models.Dashboard.user_id == user_id)
-                    .first()
-                )
-                user_stats.audio_processed += 1
-                user_stats.uploads += int(audioData.size)
-                user_stats.storage_used += int(audioData.size)
-                storage_json = ast.literal_eval(user_stats.storage_json)
-                storage_json["audio"] = float(bytes_to_mb(audioData.size)) + float(
-                    storage_json["audio"]
-                )
-                user_stats.storage_json = json.dumps(storage_json)
-                db.add(user_stats)
+                content_added(db, user_id, "audio", int(audioData.size))
                 db.add(audioData)
                 db.commit()
                 shutil.rmtree(f"thumbnail/{user_id}")
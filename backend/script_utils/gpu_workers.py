@@ -2,11 +2,11 @@ import sys
 sys.path.append("..")
 
 from script_utils.vast import get_listing
+from script_utils.providers import ProviderUnavailable, runpod_client, vast_client
 import pandas as pd 
 import subprocess
 import runpod
 import numpy as np
-import requests
 import json
 import time
 import os
@@ -18,47 +18,90 @@ VAST_KEY = os.getenv("VAST_KEY")
 runpod.api_key = RUNPOD_KEY
 
 
-def get_gpu_listing():
+# Every GPU job needs at least this much, so offers below it are never stored.
+GPU_REQUIREMENTS = {"RAM": 16, "VRAM": 20, "vCPUs": 6, "N": 1, "Price": 0.7}
+GPU_OFFERS_KEY = "gpu_offers"
+GPU_OFFERS_TTL = int(os.getenv("GPU_OFFERS_TTL", 600))
+OFFER_COLUMNS = ["ID", "CUDA", "N", "Model", "VRAM", "vCPUs", "RAM", "Disk", "Price",
+                 "Net_up", "Net_down", "Max_Days", "ports", "Cloud"]
+
+
+def vast_offers(requirements = GPU_REQUIREMENTS):
+    listing = get_listing({
+        "num_gpus": {"eq": requirements["N"]},
+        "gpu_ram": {"gte": requirements["VRAM"] * 1000},
+        "cpu_ram": {"gte": requirements["RAM"] * 1000},
+        "cpu_cores_effective": {"gte": requirements["vCPUs"]},
+        "dph_total": {"lte": requirements["Price"]},
+    })
+    listing["Cloud"] = "vast"
+    return listing
+
+
+def runpod_offers():
+    cmd = "runpodctl get cloud -s -c"
+    ls = subprocess.run([cmd], shell=True, capture_output=True, text=True)
+    rows = [[y.strip() for y in x.split('\t')] for x in ls.stdout.strip().split('\n')]
+    listing = pd.DataFrame(rows[1:], columns=rows[0])
+    # Long GPU names wrap onto a second row that only has the name filled in.
+    group = (listing["MEM GB"] != "").cumsum()
+    names = listing.groupby(group)["GPU TYPE"].agg(" ".join).str.replace("1x", "", regex=False).str.strip()
+    listing = listing[listing["MEM GB"] != ""].assign(**{"GPU TYPE": names.values})
+    listing = listing[listing["ONDEMAND $/HR"].str.lower() != "reserved"]
+    vram = {x["id"]: x["memoryInGb"] for x in runpod_client().gpus()}
+    return pd.DataFrame({
+        "ID": 0,
+        "N": 1,
+        "Model": listing["GPU TYPE"],
+        "VRAM": listing["GPU TYPE"].map(vram),
+        "RAM": listing["MEM GB"],
+        "vCPUs": listing["VCPU"],
+        "Disk": np.inf,
+        "Price": listing["ONDEMAND $/HR"],
+        "Cloud": "runpod",
+    })
+
+
+def get_gpu_listing(requirements = GPU_REQUIREMENTS):
     try:
-        listing = get_listing()
-        listing["Cloud"] = ["vast"] * len(listing)
-        cmd = "runpodctl get cloud -s -c"
-        ls = subprocess.run([cmd], shell=True, capture_output=True, text=True)
-        runpod_listing = pd.DataFrame([[y.strip() for y in x.split('\t')] for x in ls.stdout.split('\n')])
-        runpod_listing.columns = runpod_listing.iloc[0]
-        runpod_listing.drop([0, len(runpod_listing)-1], inplace=True)
-        runpod_listing = runpod_listing.reset_index(drop=True)
-        drop_col = []
-        for index, row in runpod_listing.iterrows():
-            if row["MEM GB"] == "":
-                runpod_listing.loc[index - 1,'GPU TYPE'] = runpod_listing.loc[index - 1]['GPU TYPE'] + " " +  row['GPU TYPE']
-                drop_col.append(index)
-            runpod_listing.loc[index,'GPU TYPE'] = row['GPU TYPE'].replace('1x', '').strip()
-        runpod_listing.drop(drop_col, inplace=True)
-        gpu_details = {}
-        for x in runpod.get_gpus():
-            gpu_details[x['id']] = x
-
-        for index, row in runpod_listing.iterrows():
-            if row["ONDEMAND $/HR"].lower() != "reserved":
-                machine_listing = {
-                    "ID": 0,
-                    "N": 1,
-                    "Model": row["GPU TYPE"],
-                    "VRAM": gpu_details[row["GPU TYPE"]]['memoryInGb'],
-                    "RAM": row["MEM GB"],
-                    "vCPUs": row["VCPU"],
-                    "Disk": np.inf,
-                    "Price": float(row["ONDEMAND $/HR"]),
-                    "Cloud": "runpod"
-                }
-                listing = listing._append(machine_listing, ignore_index = True)
-        listing = listing.sort_values(by=["Price"], ascending=True)
+        listing = pd.concat([vast_offers(requirements), runpod_offers()], ignore_index=True)
+        listing = listing.reindex(columns=OFFER_COLUMNS)
+        numeric = ["RAM", "VRAM", "vCPUs", "N", "Price"]
+        listing[numeric] = listing[numeric].apply(pd.to_numeric, errors="coerce")
+        listing = listing[
+            (listing["RAM"] >= requirements["RAM"])
+            & (listing["VRAM"] >= requirements["VRAM"])
+            & (listing["vCPUs"] >= requirements["vCPUs"])
+            & (listing["N"] == requirements["N"])
+            & (listing["Price"] <= requirements["Price"])
+        ]
+        listing = listing.sort_values(by=["Price"], ascending=True).reset_index(drop=True)
         listing["ID"] = listing["ID"].astype(int)
         return listing
     except:
-        return None 
-    
+        return None
+
+
+# Offers are refreshed in the background and kept in Redis as one compact
+# JSON document, so launching a job doesn't wait on either provider.
+def refresh_gpu_offers(rd):
+    listing = get_gpu_listing()
+    if listing is None:
+        return None
+    listing = listing.replace([np.inf, -np.inf], None)
+    snapshot = {"updated_at": int(time.time()), **listing.to_dict(orient="split", index=False)}
+    rd.set(GPU_OFFERS_KEY, json.dumps(snapshot, separators=(",", ":")), ex=GPU_OFFERS_TTL)
+    return listing
+
+
+def get_gpu_offers(rd):
+    snapshot = rd.get(GPU_OFFERS_KEY)
+    if snapshot is None:
+        return refresh_gpu_offers(rd)
+    snapshot = json.loads(snapshot)
+    return pd.DataFrame(snapshot["data"], columns=snapshot["columns"])
+
+
 def smart_split(s, char):
     in_quotes = False
     parts = []
@@ -108,6 +151,61 @@ def parse_env(envs):
           prev = None
     return result
     
+PIPELINE_RUN_NAME = "jaeger-pipeline"
+
+
+def vast_status(instance):
+    if instance is None:
+        return {"detail": "Success","data": "EXITED"}
+    if instance["status_msg"] != None and "error" in instance["status_msg"].lower():
+        return {"detail": "Failed"}
+    if instance.get("ports") != None:
+        return {"detail": "Success","data": "RUNNING"}
+    return {"detail": "Success","data": "LOADING"}
+
+
+def runpod_status(pod):
+    if pod == None:
+        return {"detail": "Success","data": "EXITED"}
+    if pod['runtime'] == None:
+        return {"detail": "Success","data": "LOADING"}
+    return {"detail": "Success","data": "RUNNING"}
+
+
+# One call per provider for every instance on the account, keyed by
+# instance id. None means the provider couldn't be reached this time.
+def list_vast_instances():
+    try:
+        return vast_client().instances()
+    except Exception:
+        return None
+
+
+def list_runpod_pods():
+    try:
+        return runpod_client().pods()
+    except Exception:
+        return None
+
+
+def instance_run_name(provider, instance):
+    if provider == "vast":
+        return instance.get("label")
+    return instance.get("name")
+
+
+def terminate_instance(provider, instance_id):
+    if provider == "vast":
+        va = VastAI(machine_id=0, run_name="", image="", disk_size=0, onstart="", eta=0, env={})
+        va.instance_id = instance_id
+        return va.terminate_instance()
+    if provider == "runpod":
+        rp = RunpodIO(gpu_model="", run_name="", image="", disk_size=0, eta=0, env={})
+        rp.instance_id = instance_id
+        return rp.terminate_instance()
+    return False
+
+
 class VastAI():
     def __init__(self, 
                  machine_id, 
@@ -132,7 +230,6 @@ class VastAI():
         self.redis_port = None
 
     def launch_instance(self):
-        self.url = f"https://console.vast.ai/api/v0/asks/{self.machine_id}/?api_key={self.api_key}"
         self.payload = {
             "client_id": "me",
             "image": self.image,
@@ -153,50 +250,35 @@ class VastAI():
             "template_hash_id": None,
         }
 
-        self.r = requests.put(self.url, json = self.payload)
-        if self.r.status_code == 200:
-            self.instance_id = self.r.json()["new_contract"]
-            return True
-        return False
+        try:
+            self.instance_id = vast_client().create_instance(self.machine_id, self.payload)
+        except ProviderUnavailable:
+            return False
+        return self.instance_id is not None
 
     def current_status(self):
-        self.url = f"https://console.vast.ai/api/v0/instances/{self.instance_id}/?owner=me&api_key={self.api_key}"
-        self.r = requests.get(self.url)
-        if self.r.status_code != 200:
+        try:
+            self.data = vast_client().instance(self.instance_id)
+        except Exception:
             return {"detail": "Failed"}
-        self.data = self.r.json()
-        if self.data["instances"] is None:
-            return {"detail": "Success","data": "EXITED"}
-        if self.data["instances"]["status_msg"] != None and "error" in self.data["instances"]["status_msg"].lower():
+        status = vast_status(self.data)
+        if status["detail"] == "Failed":
             self.terminate_instance()
-            return {"detail": "Failed"}
-        try:
-            if self.data["instances"]["ports"] != None:
-                return {"detail": "Success","data": "RUNNING"}
-        except:
-            return {"detail": "Success","data": "LOADING"}
+        return status
     
     def redis_config(self):
-        self.url = f"https://console.vast.ai/api/v0/instances/{self.instance_id}/?owner=me&api_key={self.api_key}"
-        self.r = requests.get(self.url)
-        if self.r.status_code != 200:
-            return False
-        self.instance_config = self.r.json()
         try:
-            self.redis_host = self.instance_config["instances"]["public_ipaddr"]
-            self.redis_port = int(self.instance_config["instances"]["ports"]["6379/tcp"][0]["HostPort"])
+            self.instance_config = vast_client().instance(self.instance_id)
+            self.redis_host = self.instance_config["public_ipaddr"]
+            self.redis_port = int(self.instance_config["ports"]["6379/tcp"][0]["HostPort"])
             return True 
         except:
             return False 
         
     def terminate_instance(self):
         try:
-            self.url = f"https://console.vast.ai/api/v0/instances/{self.instance_id}/?api_key={self.api_key}"
-            self.r = requests.delete(self.url)
-            if self.r.status_code != 200:
-                return False
-            return True
-        except:
+            return vast_client().destroy_instance(self.instance_id)
+        except ProviderUnavailable:
             return False 
            
 
@@ -227,7 +309,7 @@ class RunpodIO():
 
     def launch_instance(self):
         try:
-            self.pod = runpod.create_pod(
+            self.pod = runpod_client().create_pod(
                 name = self.run_name,
                 image_name = self.image,
                 gpu_type_id = self.gpu_model,
@@ -243,18 +325,16 @@ class RunpodIO():
             return False
         
     def current_status(self):
-        self.data = runpod.get_pod(self.instance_id)
-        if self.data == None:
-            return {"detail": "Success","data": "EXITED"}
-        if self.data['runtime'] == None:
-            return {"detail": "Success","data": "LOADING"}
-        if self.data['runtime'] != None:
-            return {"detail": "Success","data": "RUNNING"}
+        try:
+            self.data = runpod_client().pod(self.instance_id)
+        except Exception:
+            return {"detail": "Failed"}
+        return runpod_status(self.data)
         
 
     def redis_config(self):
         try:
-            for x in runpod.get_pod(self.instance_id)['runtime']['ports']:
+            for x in runpod_client().pod(self.instance_id)['runtime']['ports']:
                 if x["privatePort"] == 6379:
                     self.redis_port = x["publicPort"]
                     self.redis_host = x["ip"]
@@ -265,9 +345,8 @@ class RunpodIO():
     
     def terminate_instance(self):
         try:
-            runpod.terminate_pod(self.instance_id)
-            return True
-        except:
+            return runpod_client().terminate_pod(self.instance_id)
+        except Exception:
             return False 
         
 
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from humanfriendly import parse_timespan
+
+from utils import CUDA, GPU_PROVIDER, logger
+
+LAUNCH_HEDGE = int(os.getenv("LAUNCH_HEDGE", 3))
+PROVIDER_LAUNCH_LIMITS = {
+    "vast": int(os.getenv("VAST_LAUNCH_LIMIT", 4)),
+    "runpod": int(os.getenv("RUNPOD_LAUNCH_LIMIT", 2)),
+}
+FAILED_OFFERS_KEY = "gpu_failed_offers"
+FAILED_OFFER_TTL = int(os.getenv("FAILED_OFFER_TTL", 900))
+PIPELINE_ENV = {
+    "BASEURL": "https://backend.tnsr.ai",
+    "ENCRYPTION_KEY": "aqerYK5L4hxmS3JN3qejb6x9FwZYDJgulk7ZoM8adqQ",
+    "PRESIGNED_URL": "/jobs/generate_presigned_post",
+    "REINDEX_URL": "/jobs/reindexfile",
+    "JOB_REINDEX_URL": "/jobs/job_status",
+    "CELERY_URL": "/upload/indexfile_status",
+}
+
+# The pool is created on first use so that forked Celery workers each start
+# their own threads. The per-provider semaphores cap how many launch calls a
+# worker process has in flight against one provider at a time.
+_executor = None
+_limits = {
+    provider: threading.BoundedSemaphore(limit)
+    for provider, limit in PROVIDER_LAUNCH_LIMITS.items()
+}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=sum(PROVIDER_LAUNCH_LIMITS.values()),
+            thread_name_prefix="gpu-launch",
+        )
+    return _executor
+
+
+def offer_key(provider: str, offer_id):
+    return f"{provider}:{offer_id}"
+
+
+def gpu_launch_candidates(
+    df, env: dict, eta, job_eta, disk, pipeline: str, onstart: str, cuda_versions=CUDA
+):
+    """
+    Turn a ranked offer listing into hedged_launch candidates for one of the
+    pipeline images. `env` is added to the pipeline's environment.
+    """
+    from script_utils.gpu_workers import RunpodIO, VastAI
+
+    supported_cuda = [float(x) for x in cuda_versions]
+    env = {**PIPELINE_ENV, **env}
+    candidates = []
+    for row in df.to_dict(orient="records"):
+        if row["Cloud"] not in GPU_PROVIDER:
+            continue
+        if row["Cloud"] == "vast":
+            max_time = parse_timespan(f"{row['Max_Days']}Days")
+            if max_time <= eta + 3600:
+                continue
+            if float(row["ports"]) < 10:
+                continue
+            if float(row["Net_down"]) < 250 and float(row["Net_up"]) < 100:
+                continue
+            if round(float(row["CUDA"]), 1) not in supported_cuda:
+                continue
+            va = VastAI(
+                machine_id=row["ID"],
+                run_name=pipeline,
+                image=f"amitalokbera/{pipeline}:cuda-{round(float(row['CUDA']),1)}",
+                disk_size=disk,
+                onstart=onstart,
+                eta=job_eta,
+                env={**env, "-p 6379:6379": "1"},
+            )
+            candidates.append((offer_key("vast", row["ID"]), "vast", [va]))
+        if row["Cloud"] == "runpod":
+            attempts = [
+                RunpodIO(
+                    gpu_model=row["Model"],
+                    run_name=pipeline,
+                    image=f"amitalokbera/{pipeline}:cuda-{cuda}",
+                    disk_size=disk,
+                    eta=job_eta,
+                    cuda=str(cuda),
+                    env=env,
+                )
+                for cuda in supported_cuda
+            ]
+            candidates.append((offer_key("runpod", row["Model"]), "runpod", attempts))
+    return candidates
+
+
+def failed_offers(rd):
+    cutoff = time.time() - FAILED_OFFER_TTL
+    pipe = rd.pipeline(transaction=False)
+    pipe.zremrangebyscore(FAILED_OFFERS_KEY, "-inf", cutoff)
+    pipe.zrange(FAILED_OFFERS_KEY, 0, -1)
+    _, keys = pipe.execute()
+    return {x.decode("utf-8") for x in keys}
+
+
+def mark_failed(rd, keys):
+    if not keys:
+        return
+    now = time.time()
+    rd.zadd(FAILED_OFFERS_KEY, {key: now for key in keys})
+
+
+def terminate_quietly(instance):
+    try:
+        instance.terminate_instance()
+    except Exception:
+        pass
+
+
+def launch_candidate(provider: str, attempts: list):
+    # A candidate can have several attempts, e.g. one per CUDA version on
+    # RunPod, which are still tried in order.
+    with _limits[provider]:
+        for instance in attempts:
+            try:
+                if instance.launch_instance():
+                    return instance
+            except Exception as e:
+                logger.error(f"{provider} launch failed - {str(e)}")
+            terminate_quietly(instance)
+    return None
+
+
+def discard_launch(future):
+    try:
+        instance = future.result()
+    except Exception:
+        return
+    if instance is not None:
+        logger.info(f"Terminating hedged launch {instance.instance_id}")
+        terminate_quietly(instance)
+
+
+def hedged_launch(rd, candidates: list, hedge: int = LAUNCH_HEDGE):
+    """
+    Launch the first `hedge` candidates at once and keep whichever comes up
+    first. Each candidate is (offer key, provider, attempts), best offer first.
+    A failed candidate is replaced by the next one in line, and offers that
+    fail are skipped by later jobs for FAILED_OFFER_TTL seconds.
+    Returns (offer key, provider, instance) or None.
+    """
+    skip = failed_offers(rd)
+    queue = iter([x for x in candidates if x[0] not in skip])
+    executor = get_executor()
+    running = {}
+
+    def submit_next():
+        candidate = next(queue, None)
+        if candidate is not None:
+            future = executor.submit(launch_candidate, candidate[1], candidate[2])
+            running[future] = candidate
+
+    for _ in range(max(hedge, 1)):
+        submit_next()
+    failed = []
+    winner = None
+    while running and winner is None:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            key, provider, _ = running.pop(future)
+            try:
+                instance = future.result()
+            except Exception:
+                instance = None
+            if instance is None:
+                failed.append(key)
+            elif winner is None:
+                winner = (key, provider, instance)
+            else:
+                terminate_quietly(instance)
+        if winner is None:
+            for _ in range(len(done)):
+                submit_next()
+    # Launches still in flight are terminated as soon as they come back.
+    for future in running:
+        future.add_done_callback(discard_launch)
+    mark_failed(rd, failed)
+    return winner
@@ -0,0 +1,140 @@
+import base64
+import json
+import os
+
+import redis
+from sqlalchemy import and_, event, inspect, or_
+from sqlalchemy.orm import Session
+
+import models
+from utils import REDIS_HOST, REDIS_PORT, count_redis_round_trip, logger
+
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", 600))
+
+# Listing totals are cached per user in one hash, one field per listing. Any
+# flush that adds, deletes or changes the status of a row in a counted table
+# drops the user's hash once the transaction commits.
+COUNTED_MODELS = {
+    models.Content: "status",
+    models.Jobs: "job_status",
+    models.Invoices: "status",
+}
+
+_counts_redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+
+
+def encode_cursor(created_at, row_id) -> str:
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("utf-8").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return int(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_filter(created_column, id_column, cursor: str):
+    created_at, row_id = decode_cursor(cursor)
+    return or_(
+        created_column < created_at,
+        and_(created_column == created_at, id_column < row_id),
+    )
+
+
+def next_cursor(rows, limit: int, id_key: str = "id"):
+    if len(rows) < limit or len(rows) == 0:
+        return None
+    return encode_cursor(rows[-1]["created_at"], rows[-1][id_key])
+
+
+def counts_key(user_id: int):
+    return f"listing_counts_{user_id}"
+
+
+def counts_generation_key(user_id: int):
+    return f"listing_counts_generation_{user_id}"
+
+
+def get_cached_count(rd, user_id: int, field: str):
+    """
+    Returns (count, generation). The count is None on a miss, and the
+    generation has to be passed back to set_cached_count with the count
+    read from the database.
+    """
+    if rd is None:
+        return None, None
+    try:
+        pipe = rd.pipeline(transaction=False)
+        pipe.hget(counts_key(user_id), field)
+        pipe.get(counts_generation_key(user_id))
+        value, generation = pipe.execute()
+        count_redis_round_trip()
+    except Exception as e:
+        logger.error(f"Count cache read failed - {str(e)}")
+        return None, None
+    return (None if value is None else int(value)), generation
+
+
+def set_cached_count(rd, user_id: int, field: str, count: int, generation):
+    # Only stored if no invalidation ran since the count was read, otherwise
+    # a count from before an insert or delete would outlive it.
+    if rd is None:
+        return
+    key = counts_generation_key(user_id)
+    try:
+        with rd.pipeline() as pipe:
+            pipe.watch(key)
+            if pipe.get(key) != generation:
+                return
+            pipe.multi()
+            pipe.hset(counts_key(user_id), field, int(count))
+            pipe.expire(counts_key(user_id), COUNT_CACHE_TTL)
+            pipe.execute()
+        count_redis_round_trip()
+    except redis.WatchError:
+        pass
+    except Exception as e:
+        logger.error(f"Count cache write failed - {str(e)}")
+
+
+def invalidate_counts(user_ids, rd=None):
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if not user_ids:
+        return
+    try:
+        pipe = (rd or _counts_redis).pipeline(transaction=False)
+        pipe.delete(*[counts_key(user_id) for user_id in user_ids])
+        for user_id in user_ids:
+            pipe.incr(counts_generation_key(user_id))
+            pipe.expire(counts_generation_key(user_id), COUNT_CACHE_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Count cache invalidation failed - {str(e)}")
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_count_changes(session, flush_context):
+    changed = session.info.setdefault("count_users", set())
+    for obj in session.new.union(session.deleted):
+        if type(obj) in COUNTED_MODELS:
+            changed.add(obj.user_id)
+    for obj in session.dirty:
+        status_attr = COUNTED_MODELS.get(type(obj))
+        if status_attr is None:
+            continue
+        if inspect(obj).attrs[status_attr].history.has_changes():
+            changed.add(obj.user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_count_changes(session):
+    invalidate_counts(session.info.pop("count_users", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_count_changes(session):
+    session.info.pop("count_users", None)
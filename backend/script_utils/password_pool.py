@@ -0,0 +1,70 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# Worker processes are spawned, not forked, so this module must stay free of
+# project imports: the children only need passlib.
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", 2))
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", 32))
+
+password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_pool = None
+_pending = 0
+
+
+def _hash(peppered_password: str) -> str:
+    return password_context.hash(peppered_password)
+
+
+def _verify(peppered_password: str, hashed_pass: str) -> bool:
+    return password_context.verify(peppered_password, hashed_pass)
+
+
+def get_password_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_password_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _run(fn, *args):
+    global _pool, _pending
+    if _pending >= PASSWORD_POOL_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please try again",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_password_pool(), fn, *args)
+    except BrokenProcessPool:
+        _pool = None
+        raise
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password + os.getenv("JWT_AUTH_TOKEN"))
+
+
+async def check_password(password: str, hashed_pass: str) -> bool:
+    return await _run(_verify, password + os.getenv("JWT_AUTH_TOKEN"), hashed_pass)
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import redis.asyncio as aioredis
+
+from utils import REDIS_HOST, REDIS_PORT, logger
+
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 5))
+PROGRESS_SNAPSHOT_TTL = int(os.getenv("PROGRESS_SNAPSHOT_TTL", 3600))
+POLLER_LOCK_TTL = int(PROGRESS_INTERVAL * 3)
+PROGRESS_STREAM_MAXLEN = int(os.getenv("PROGRESS_STREAM_MAXLEN", 200))
+PROGRESS_STREAM_TTL = int(os.getenv("PROGRESS_STREAM_TTL", 86400))
+HEARTBEAT_TIMEOUT = int(os.getenv("HEARTBEAT_TIMEOUT", 30))
+JOB_KEY_CACHE_TTL = int(os.getenv("JOB_KEY_CACHE_TTL", 300))
+HEARTBEATS_KEY = "job_heartbeats"
+PROGRESS_FIELDS = ("model", "status", "chunk", "progress")
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+# One poller per job across all API workers builds the progress snapshot and
+# publishes it to the job's channel. Sockets only subscribe, so the database
+# and provider load scales with running jobs rather than open tabs. The
+# latest snapshot is kept under its own key for sockets that join late.
+_pollers = {}
+_redis = None
+
+
+def get_hub_redis():
+    global _redis
+    if _redis is None:
+        _redis = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    return _redis
+
+
+def progress_channel(job_id: int):
+    return f"job_progress_{job_id}"
+
+
+def snapshot_key(job_id: int):
+    return f"job_progress_snapshot_{job_id}"
+
+
+def poller_lock_key(job_id: int):
+    return f"job_progress_poller_{job_id}"
+
+
+def progress_stream(job_id: int):
+    return f"job_progress_stream_{job_id}"
+
+
+def job_key_cache(job_id: int):
+    return f"job_key_{job_id}"
+
+
+def hash_job_key(key: str):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+# GPU instances push progress and heartbeats to the API instead of exposing
+# a Redis server of their own. Progress goes to a capped stream per job and
+# every push refreshes the job's score in one sorted set of heartbeats.
+def record_progress(rd, job_id: int, fields: dict):
+    entry = {
+        name: str(fields[name])
+        for name in PROGRESS_FIELDS
+        if fields.get(name) is not None
+    }
+    pipe = rd.pipeline(transaction=False)
+    if entry:
+        pipe.xadd(
+            progress_stream(job_id),
+            entry,
+            maxlen=PROGRESS_STREAM_MAXLEN,
+            approximate=True,
+        )
+        pipe.expire(progress_stream(job_id), PROGRESS_STREAM_TTL)
+    pipe.zadd(HEARTBEATS_KEY, {str(job_id): time.time()})
+    pipe.execute()
+
+
+def last_heartbeats(rd, job_ids):
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+    last_seen = rd.zmscore(HEARTBEATS_KEY, [str(job_id) for job_id in job_ids])
+    return {
+        job_id: float(seen)
+        for job_id, seen in zip(job_ids, last_seen)
+        if seen is not None
+    }
+
+
+def lost_heartbeats(rd, job_ids):
+    # Instances that never pushed are still on the pull path.
+    cutoff = time.time() - HEARTBEAT_TIMEOUT
+    return {
+        job_id for job_id, seen in last_heartbeats(rd, job_ids).items() if seen < cutoff
+    }
+
+
+def clear_heartbeats(rd, job_ids):
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    pipe = rd.pipeline(transaction=False)
+    pipe.zrem(HEARTBEATS_KEY, *[str(job_id) for job_id in job_ids])
+    pipe.delete(*[job_key_cache(job_id) for job_id in job_ids])
+    pipe.execute()
+
+
+async def latest_progress(job_id: int, rd=None):
+    # Pushes may only carry the fields that changed, so each field takes its
+    # newest value from the stream. The id is that of the newest entry.
+    rd = rd or get_hub_redis()
+    entries = await rd.xrevrange(progress_stream(job_id), count=PROGRESS_STREAM_MAXLEN)
+    if not entries:
+        return None
+    progress = {"id": entries[0][0].decode("utf-8")}
+    for _, fields in entries:
+        for k, v in fields.items():
+            progress.setdefault(k.decode("utf-8"), v.decode("utf-8"))
+        if all(name in progress for name in PROGRESS_FIELDS):
+            break
+    return progress
+
+
+async def wait_for_progress(job_id: int, last_id: str, rd=None):
+    rd = rd or get_hub_redis()
+    entries = await rd.xread(
+        {progress_stream(job_id): last_id},
+        count=PROGRESS_STREAM_MAXLEN,
+        block=int(PROGRESS_INTERVAL * 1000),
+    )
+    if not entries:
+        return last_id
+    return entries[0][1][-1][0].decode("utf-8")
+
+
+def is_terminal(snapshot: dict):
+    return str(snapshot.get("status", "")).lower() in TERMINAL_STATUSES
+
+
+async def publish_snapshot(job_id: int, snapshot: dict, rd=None):
+    rd = rd or get_hub_redis()
+    payload = json.dumps(snapshot)
+    async with rd.pipeline(transaction=False) as pipe:
+        pipe.set(snapshot_key(job_id), payload, ex=PROGRESS_SNAPSHOT_TTL)
+        pipe.publish(progress_channel(job_id), payload)
+        await pipe.execute()
+
+
+async def latest_snapshots(job_ids, rd=None):
+    rd = rd or get_hub_redis()
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+    values = await rd.mget([snapshot_key(job_id) for job_id in job_ids])
+    return {
+        job_id: json.loads(value)
+        for job_id, value in zip(job_ids, values)
+        if value is not None
+    }
+
+
+async def _refresh_lock(rd, job_id: int, owner: str):
+    if await rd.get(poller_lock_key(job_id)) != owner.encode("utf-8"):
+        return False
+    await rd.expire(poller_lock_key(job_id), POLLER_LOCK_TTL)
+    return True
+
+
+async def _poll(job_id: int, build_snapshot, owner: str):
+    rd = get_hub_redis()
+    state = {}
+    last_id = "0-0"
+    try:
+        latest = await latest_progress(job_id, rd)
+        if latest is not None:
+            last_id = latest["id"]
+        while True:
+            try:
+                snapshot = await build_snapshot(job_id, state)
+            except Exception as e:
+                logger.error(f"Progress poll failed for job {job_id} - {str(e)}")
+            else:
+                await publish_snapshot(job_id, snapshot, rd)
+                if is_terminal(snapshot):
+                    break
+            # Wakes up as soon as the instance pushes, otherwise once per interval.
+            last_id = await wait_for_progress(job_id, last_id, rd)
+            listeners = await rd.pubsub_numsub(progress_channel(job_id))
+            if not listeners or int(listeners[0][1]) == 0:
+                break
+            if not await _refresh_lock(rd, job_id, owner):
+                break
+    finally:
+        _pollers.pop(job_id, None)
+        for client in state.get("clients", []):
+            await client.close()
+        if await rd.get(poller_lock_key(job_id)) == owner.encode("utf-8"):
+            await rd.delete(poller_lock_key(job_id))
+
+
+async def ensure_poller(job_id: int, build_snapshot):
+    task = _pollers.get(job_id)
+    if task is not None and not task.done():
+        return
+    owner = uuid.uuid4().hex
+    acquired = await get_hub_redis().set(
+        poller_lock_key(job_id), owner, nx=True, ex=POLLER_LOCK_TTL
+    )
+    if not acquired:
+        return
+    _pollers[job_id] = asyncio.create_task(_poll(job_id, build_snapshot, owner))
+
+
+def subscribe():
+    return get_hub_redis().pubsub(ignore_subscribe_messages=True)
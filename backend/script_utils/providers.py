@@ -0,0 +1,320 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import logger
+
+VAST_API = "https://console.vast.ai/api/v0"
+VAST_KEY = os.getenv("VAST_KEY")
+RUNPOD_KEY = os.getenv("RUNPOD_KEY")
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", 5))
+PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", 30))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", 3))
+PROVIDER_BACKOFF = float(os.getenv("PROVIDER_BACKOFF", 0.5))
+PROVIDER_BACKOFF_CAP = 8
+PROVIDER_POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", 10))
+BREAKER_THRESHOLD = int(os.getenv("PROVIDER_BREAKER_THRESHOLD", 5))
+BREAKER_RESET = int(os.getenv("PROVIDER_BREAKER_RESET", 60))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "DELETE"}
+
+
+class ProviderUnavailable(Exception):
+    pass
+
+
+class RetryableResponse(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after `threshold` failed calls in a row. Once
+    `reset_after` seconds have passed a single trial call is let through,
+    and its outcome closes or reopens the breaker.
+    """
+
+    def __init__(
+        self, name: str, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_after or self.trial:
+                return False
+            self.trial = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(f"{self.name} API circuit opened")
+                self.opened_at = time.monotonic()
+
+
+def backoff(attempt: int):
+    # Full jitter keeps workers that failed together from retrying together.
+    return random.uniform(0, min(PROVIDER_BACKOFF_CAP, PROVIDER_BACKOFF * 2**attempt))
+
+
+def should_retry(error: Exception, idempotent: bool):
+    # A timed out create may still have rented an instance, so only calls
+    # that are safe to repeat are retried after the request went out.
+    if isinstance(
+        error, (requests.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+    ):
+        return True
+    return idempotent
+
+
+class VastClient:
+    """
+    Vast.ai API client with one keep-alive connection pool per process for
+    sync callers and one for the event loop, strict timeouts, retries with
+    jittered backoff and a circuit breaker shared by both.
+    """
+
+    def __init__(self, api_key=VAST_KEY, breaker: CircuitBreaker = None):
+        self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker("vast")
+        self._session = None
+        self._async_client = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=PROVIDER_POOL_SIZE, max_retries=0
+            )
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                base_url=VAST_API,
+                timeout=httpx.Timeout(
+                    PROVIDER_READ_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=PROVIDER_POOL_SIZE,
+                    max_keepalive_connections=PROVIDER_POOL_SIZE,
+                ),
+            )
+        return self._async_client
+
+    def request(
+        self, method: str, path: str, params: dict = None, guarded=True, **kwargs
+    ):
+        if guarded and not self.breaker.allow():
+            raise ProviderUnavailable("Vast API circuit is open")
+        params = {**(params or {}), "api_key": self.api_key}
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(PROVIDER_RETRIES + 1):
+            try:
+                r = self.session.request(
+                    method,
+                    f"{VAST_API}{path}",
+                    params=params,
+                    timeout=(PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT),
+                    **kwargs,
+                )
+                if r.status_code in RETRY_STATUSES:
+                    raise RetryableResponse(f"{method} {path} - {r.status_code}")
+                self.breaker.record_success()
+                return r
+            except (requests.RequestException, RetryableResponse) as e:
+                error = e
+                retry = isinstance(e, RetryableResponse) or should_retry(e, idempotent)
+                if not retry or attempt == PROVIDER_RETRIES:
+                    break
+                time.sleep(backoff(attempt))
+        self.breaker.record_failure()
+        raise ProviderUnavailable(str(error))
+
+    async def arequest(
+        self, method: str, path: str, params: dict = None, guarded=True, **kwargs
+    ):
+        if guarded and not self.breaker.allow():
+            raise ProviderUnavailable("Vast API circuit is open")
+        params = {**(params or {}), "api_key": self.api_key}
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(PROVIDER_RETRIES + 1):
+            try:
+                r = await self.async_client.request(
+                    method, path, params=params, **kwargs
+                )
+                if r.status_code in RETRY_STATUSES:
+                    raise RetryableResponse(f"{method} {path} - {r.status_code}")
+                self.breaker.record_success()
+                return r
+            except (httpx.HTTPError, RetryableResponse) as e:
+                error = e
+                retry = isinstance(e, RetryableResponse) or should_retry(e, idempotent)
+                if not retry or attempt == PROVIDER_RETRIES:
+                    break
+                await asyncio.sleep(backoff(attempt))
+        self.breaker.record_failure()
+        raise ProviderUnavailable(str(error))
+
+    def search_offers(self, query: dict):
+        r = self.request("GET", "/bundles", params={"q": json.dumps(query)})
+        r.raise_for_status()
+        return r.json()["offers"]
+
+    def instances(self):
+        # Every instance on the account in one call, keyed by id.
+        r = self.request("GET", "/instances/", params={"owner": "me"})
+        r.raise_for_status()
+        return {str(x["id"]): x for x in r.json()["instances"] or []}
+
+    async def ainstances(self):
+        r = await self.arequest("GET", "/instances/", params={"owner": "me"})
+        r.raise_for_status()
+        return {str(x["id"]): x for x in r.json()["instances"] or []}
+
+    def instance(self, instance_id):
+        r = self.request("GET", f"/instances/{instance_id}/", params={"owner": "me"})
+        r.raise_for_status()
+        return r.json()["instances"]
+
+    async def ainstance(self, instance_id):
+        r = await self.arequest(
+            "GET", f"/instances/{instance_id}/", params={"owner": "me"}
+        )
+        r.raise_for_status()
+        return r.json()["instances"]
+
+    def create_instance(self, ask_id, payload: dict):
+        r = self.request("PUT", f"/asks/{ask_id}/", json=payload)
+        if r.status_code != 200:
+            return None
+        return r.json()["new_contract"]
+
+    # Terminating is never held back by the breaker: an instance left running
+    # keeps billing.
+    def destroy_instance(self, instance_id):
+        r = self.request("DELETE", f"/instances/{instance_id}/", guarded=False)
+        return r.status_code == 200
+
+    async def adestroy_instance(self, instance_id):
+        r = await self.arequest("DELETE", f"/instances/{instance_id}/", guarded=False)
+        return r.status_code == 200
+
+
+class RunpodClient:
+    """
+    The runpod SDK makes its own HTTP calls, so its calls get the same
+    retries and circuit breaker, and async callers run them on a thread.
+    Only transport errors, including 5xx pages the SDK can't parse, count
+    against the breaker. Errors the API itself returns, like a sold out GPU,
+    are raised as they are.
+    """
+
+    def __init__(self, api_key=RUNPOD_KEY, breaker: CircuitBreaker = None):
+        self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker("runpod")
+
+    def call(
+        self, function: str, *args, idempotent: bool = True, guarded=True, **kwargs
+    ):
+        import runpod
+
+        if guarded and not self.breaker.allow():
+            raise ProviderUnavailable("RunPod API circuit is open")
+        runpod.api_key = self.api_key
+        for attempt in range(PROVIDER_RETRIES + 1):
+            try:
+                result = getattr(runpod, function)(*args, **kwargs)
+                self.breaker.record_success()
+                return result
+            except requests.RequestException as e:
+                error = e
+                if not should_retry(e, idempotent) or attempt == PROVIDER_RETRIES:
+                    break
+                time.sleep(backoff(attempt))
+            except Exception:
+                # The API answered, so the provider is up.
+                self.breaker.record_success()
+                raise
+        self.breaker.record_failure()
+        raise ProviderUnavailable(str(error))
+
+    def pods(self):
+        return {str(x["id"]): x for x in self.call("get_pods")}
+
+    async def apods(self):
+        return await asyncio.to_thread(self.pods)
+
+    def pod(self, pod_id):
+        return self.call("get_pod", pod_id)
+
+    async def apod(self, pod_id):
+        return await asyncio.to_thread(self.pod, pod_id)
+
+    def gpus(self):
+        return self.call("get_gpus")
+
+    def create_pod(self, **kwargs):
+        return self.call("create_pod", idempotent=False, **kwargs)
+
+    def terminate_pod(self, pod_id):
+        self.call("terminate_pod", pod_id, guarded=False)
+        return True
+
+    async def aterminate_pod(self, pod_id):
+        return await asyncio.to_thread(self.terminate_pod, pod_id)
+
+
+_clients = {}
+
+
+def vast_client():
+    if "vast" not in _clients:
+        _clients["vast"] = VastClient()
+    return _clients["vast"]
+
+
+def runpod_client():
+    if "runpod" not in _clients:
+        _clients["runpod"] = RunpodClient()
+    return _clients["runpod"]
+
+
+async def aterminate_instance(provider: str, instance_id):
+    try:
+        if provider == "vast":
+            return await vast_client().adestroy_instance(instance_id)
+        if provider == "runpod":
+            return await runpod_client().aterminate_pod(instance_id)
+    except Exception as e:
+        logger.error(f"Unable to terminate {provider} instance {instance_id} - {e}")
+    return False
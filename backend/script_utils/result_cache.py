@@ -0,0 +1,169 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+from utils import (
+    CLOUDFLARE_CONTENT,
+    CLOUDFLARE_METADATA,
+    IMAGE_MODELS,
+    PIPELINE_VERSION,
+    delete_r2_file,
+    logger,
+)
+
+# Processing the same file with the same filters and model versions gives
+# the same output, so finished jobs are catalogued by a hash of those inputs.
+# A later job with the same hash gets new Content rows pointing at the
+# catalogued R2 objects. Objects shared like this are only deleted from R2
+# once no Content row references them anymore.
+OUTPUT_FIELDS = (
+    "title",
+    "link",
+    "size",
+    "thumbnail",
+    "md5",
+    "duration",
+    "resolution",
+    "fps",
+    "hz",
+)
+
+
+def processing_result_key(content_md5: str, job_type: str, filters: dict):
+    if not content_md5:
+        return None
+    active = {name: config for name, config in filters.items() if config["active"]}
+    versions = {
+        name: IMAGE_MODELS[name]["model"] if job_type == "image" else PIPELINE_VERSION
+        for name in active
+    }
+    payload = json.dumps(
+        {
+            "md5": content_md5,
+            "job_type": job_type,
+            "filters": active,
+            "versions": versions,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def output_kind(title: str):
+    suffix = Path(str(title)).suffix.lower()
+    if suffix in (".srt", ".zip"):
+        return suffix
+    return "main"
+
+
+def record_processing_result(db: Session, job_id: int):
+    job = db.query(models.Jobs).filter(models.Jobs.job_id == job_id).first()
+    if job is None or job.result_key is None:
+        return None
+    outputs = db.query(models.Content).filter(models.Content.job_id == job_id).all()
+    if len(outputs) == 0 or any(str(x.status) != "completed" for x in outputs):
+        return None
+    if any(x.link is None for x in outputs):
+        return None
+    result = models.ProcessingResult(
+        result_key=job.result_key,
+        job_id=job_id,
+        outputs=json.dumps(
+            [{field: getattr(x, field) for field in OUTPUT_FIELDS} for x in outputs]
+        ),
+        created_at=int(time.time()),
+    )
+    db.add(result)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another job with the same inputs finished first.
+        db.rollback()
+        return None
+    return result
+
+
+def find_processing_result(db: Session, result_key: str):
+    if result_key is None:
+        return None
+    result = (
+        db.query(models.ProcessingResult)
+        .filter(models.ProcessingResult.result_key == result_key)
+        .first()
+    )
+    if result is None:
+        return None
+    outputs = json.loads(result.outputs)
+    links = {x["link"] for x in outputs}
+    alive = (
+        db.query(func.count(func.distinct(models.Content.link)))
+        .filter(models.Content.link.in_(links))
+        .filter(models.Content.status == "completed")
+        .scalar()
+    )
+    if alive < len(links):
+        db.delete(result)
+        db.commit()
+        return None
+    return result
+
+
+def apply_processing_result(db: Session, job, result):
+    outputs = {output_kind(x["title"]): x for x in json.loads(result.outputs)}
+    contents = (
+        db.query(models.Content).filter(models.Content.job_id == job.job_id).all()
+    )
+    if {output_kind(x.title) for x in contents} != set(outputs):
+        return False
+    now = int(time.time())
+    for content in contents:
+        output = outputs[output_kind(content.title)]
+        if output_kind(content.title) == "main":
+            content.title = content.title + Path(output["title"]).suffix
+        for field in OUTPUT_FIELDS[1:]:
+            setattr(content, field, output[field])
+        content.status = "completed"
+        content.updated_at = now
+        db.add(content)
+    job.job_status = "Completed"
+    job.job_process = "completed"
+    job.job_key = False
+    job.updated_at = now
+    db.add(job)
+    result.hits = models.ProcessingResult.hits + 1
+    result.updated_at = now
+    db.add(result)
+    return contents
+
+
+def release_r2_objects(db: Session, contents: list):
+    # Call before the rows are deleted, objects still referenced by any
+    # other row are kept.
+    contents = [x for x in contents if str(x.status) == "completed"]
+    if len(contents) == 0:
+        return
+    ids = [x.id for x in contents]
+    for column, bucket in [
+        (models.Content.link, CLOUDFLARE_CONTENT),
+        (models.Content.thumbnail, CLOUDFLARE_METADATA),
+    ]:
+        keys = {getattr(x, column.key) for x in contents} - {None}
+        if len(keys) == 0:
+            continue
+        shared = {
+            key
+            for (key,) in db.query(column)
+            .filter(column.in_(keys))
+            .filter(models.Content.id.notin_(ids))
+            .distinct()
+        }
+        for key in keys - shared:
+            delete_r2_file.delay(key, bucket)
+        if shared:
+            logger.info(f"Kept {len(shared)} shared objects in {bucket}")
@@ -0,0 +1,218 @@
+import json
+import os
+import time
+import uuid
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+from utils import GPU_PROVIDER, USER_TIER, logger
+
+# How many jobs each provider may run at once, e.g. "vast:10,runpod:5".
+SCHEDULER_BUDGETS = {
+    provider.strip(): int(budget)
+    for provider, budget in (
+        x.split(":")
+        for x in os.getenv("SCHEDULER_BUDGETS", "vast:10,runpod:5,replicate:20").split(
+            ","
+        )
+        if x.strip()
+    )
+}
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", 500))
+SCHEDULER_LOCK_TTL = 30
+# Image jobs run on Replicate, video and audio jobs share the GPU providers.
+JOB_LANES = {"image": "replicate", "video": "gpu", "audio": "gpu"}
+LANE_PROVIDERS = {"replicate": ["replicate"], "gpu": GPU_PROVIDER}
+ACTIVE_MACHINE_STATUSES = ("LOADING", "RUNNING")
+
+
+def queue_key(lane: str):
+    return f"job_queue_{lane}"
+
+
+def payload_key(lane: str):
+    return f"job_queue_payload_{lane}"
+
+
+def cost_key(lane: str):
+    return f"job_queue_cost_{lane}"
+
+
+def finish_key(lane: str):
+    return f"job_queue_finish_{lane}"
+
+
+def clock_key(lane: str):
+    return f"job_queue_clock_{lane}"
+
+
+def lock_key(lane: str):
+    return f"job_queue_lock_{lane}"
+
+
+def job_lane(job_type: str):
+    return JOB_LANES[job_type]
+
+
+def lane_budget(lane: str):
+    return sum(SCHEDULER_BUDGETS.get(x, 0) for x in LANE_PROVIDERS[lane])
+
+
+def tier_weight(tier: str):
+    return USER_TIER.get(tier, {}).get("queue_weight", 1)
+
+
+def queue_length(rd, lane: str):
+    return rd.zcard(queue_key(lane))
+
+
+def enqueue(rd, job_config: dict, tier: str, cost: float):
+    """
+    Weighted fair queuing: a job's finish tag is where its user's previous
+    job finished, or the lane's virtual clock if that is later, plus its
+    cost scaled down by the user's tier weight. Jobs leave the queue in
+    finish-tag order, so a burst from one user only pushes back that user's
+    own jobs.
+    """
+    lane = job_lane(job_config["job_type"])
+    user_id = str(job_config["user_id"])
+    clock = float(rd.get(clock_key(lane)) or 0)
+    last_finish = float(rd.hget(finish_key(lane), user_id) or 0)
+    finish = max(clock, last_finish) + max(float(cost), 1) / tier_weight(tier)
+    pipe = rd.pipeline(transaction=True)
+    pipe.zadd(queue_key(lane), {job_config["job_id"]: finish})
+    pipe.hset(payload_key(lane), job_config["job_id"], json.dumps(job_config))
+    pipe.hset(cost_key(lane), job_config["job_id"], float(cost))
+    pipe.hset(finish_key(lane), user_id, finish)
+    pipe.execute()
+    return finish
+
+
+def remove(rd, job_type: str, job_id: int):
+    lane = job_lane(job_type)
+    pipe = rd.pipeline(transaction=True)
+    pipe.zrem(queue_key(lane), job_id)
+    pipe.hdel(payload_key(lane), job_id)
+    pipe.hdel(cost_key(lane), job_id)
+    removed, _, _ = pipe.execute()
+    return bool(removed)
+
+
+def dequeue(rd, lane: str, count: int):
+    """
+    Pop the `count` jobs with the lowest finish tags as (job_config, finish
+    tag, cost), so that a job that can't be dispatched can be put back.
+    """
+    if count <= 0:
+        return []
+    entries = rd.zpopmin(queue_key(lane), count)
+    if not entries:
+        return []
+    job_ids = [x[0] for x in entries]
+    pipe = rd.pipeline(transaction=True)
+    pipe.hmget(payload_key(lane), job_ids)
+    pipe.hmget(cost_key(lane), job_ids)
+    pipe.hdel(payload_key(lane), *job_ids)
+    pipe.hdel(cost_key(lane), *job_ids)
+    pipe.set(clock_key(lane), entries[-1][1])
+    payloads, costs, _, _, _ = pipe.execute()
+    return [
+        (json.loads(payload), finish, float(cost or 0))
+        for (_, finish), payload, cost in zip(entries, payloads, costs)
+        if payload is not None
+    ]
+
+
+def requeue(rd, lane: str, job_config: dict, finish: float, cost: float):
+    # Back in its old place, ahead of anything queued since.
+    pipe = rd.pipeline(transaction=True)
+    pipe.zadd(queue_key(lane), {job_config["job_id"]: finish})
+    pipe.hset(payload_key(lane), job_config["job_id"], json.dumps(job_config))
+    pipe.hset(cost_key(lane), job_config["job_id"], cost)
+    pipe.execute()
+
+
+def lane_running(db: Session, lane: str):
+    queued = models.Jobs.job_process == "queued"
+    if lane == "replicate":
+        return db.scalar(
+            select(func.count(models.Jobs.job_id))
+            .where(models.Jobs.job_type == "image")
+            .where(models.Jobs.job_key == True)
+            .where(~queued)
+        )
+    # GPU jobs hold a slot from dispatch until their machine stops. Packed
+    # jobs share one machine, and so one slot.
+    machines = db.scalar(
+        select(func.count(models.Machines.machine_id))
+        .where(models.Machines.machine_status.in_(ACTIVE_MACHINE_STATUSES))
+        .where(models.Machines.provider.in_(LANE_PROVIDERS[lane]))
+    )
+    launching = db.scalar(
+        select(func.count(models.Jobs.job_id))
+        .where(models.Jobs.job_type.in_(["video", "audio"]))
+        .where(models.Jobs.job_key == True)
+        .where(models.Jobs.machine_id == None)
+        .where(~queued)
+    )
+    return machines + launching
+
+
+def saturated_providers(db: Session):
+    running = db.execute(
+        select(models.Machines.provider, func.count(models.Machines.machine_id))
+        .where(models.Machines.machine_status.in_(ACTIVE_MACHINE_STATUSES))
+        .group_by(models.Machines.provider)
+    ).all()
+    return {
+        provider
+        for provider, count in running
+        if provider in SCHEDULER_BUDGETS and count >= SCHEDULER_BUDGETS[provider]
+    }
+
+
+def queue_position(rd, lane: str, job_id: int, running: int, now: int = None):
+    """
+    Position in the lane and a rough start time: the jobs ahead that can't
+    start right away have to finish first, spread over the lane's budget.
+    """
+    now = now or int(time.time())
+    rank = rd.zrank(queue_key(lane), job_id)
+    if rank is None:
+        return {"position": 0, "eta": 0, "start_at": now}
+    budget = max(lane_budget(lane), 1)
+    free = max(budget - running, 0)
+    ahead = rd.zrange(queue_key(lane), free, rank - 1) if rank > free else []
+    costs = rd.hmget(cost_key(lane), ahead) if ahead else []
+    wait = int(sum(float(x or 0) for x in costs) / budget)
+    return {"position": rank + 1, "eta": wait, "start_at": now + wait}
+
+
+def schedule(db: Session, rd, dispatch):
+    """
+    Start as many queued jobs per lane as its budget has room for. One
+    scheduler runs per lane at a time.
+    """
+    started = {}
+    for lane in LANE_PROVIDERS:
+        owner = uuid.uuid4().hex
+        if not rd.set(lock_key(lane), owner, nx=True, ex=SCHEDULER_LOCK_TTL):
+            continue
+        try:
+            room = lane_budget(lane) - lane_running(db, lane)
+            started[lane] = 0
+            for job_config, finish, cost in dequeue(rd, lane, room):
+                try:
+                    if dispatch(job_config):
+                        started[lane] += 1
+                except Exception as e:
+                    logger.error(
+                        f"Unable to dispatch job {job_config['job_id']} - {str(e)}"
+                    )
+                    requeue(rd, lane, job_config, finish, cost)
+        finally:
+            if rd.get(lock_key(lane)) == owner.encode("utf-8"):
+                rd.delete(lock_key(lane))
+    return started
@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import os
+import threading
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+# Presigned GET URLs for R2 are plain SigV4 query-string signatures, so they
+# can be produced locally without building a boto3 client per call. The
+# output matches botocore's generate_presigned_url for path-style addressing.
+SIGNER_REGION = os.getenv("CLOUDFLARE_REGION", "us-east-1")
+SIGNER_ALGORITHM = "AWS4-HMAC-SHA256"
+
+
+class PresignedUrlSigner:
+    def __init__(self, access_key, secret_key, endpoint, region=SIGNER_REGION):
+        parts = urlsplit(endpoint)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip("/")
+        self.region = region
+        self._day = None
+        self._signing_key = None
+        self._lock = threading.Lock()
+
+    def signing_key(self, datestamp: str):
+        with self._lock:
+            if self._day != datestamp:
+                key = ("AWS4" + self.secret_key).encode("utf-8")
+                for msg in (datestamp, self.region, "s3", "aws4_request"):
+                    key = hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+                self._day = datestamp
+                self._signing_key = key
+            return self._signing_key
+
+    def presign_get_many(self, keys, bucket, expires: int, now: datetime = None):
+        if now is None:
+            now = datetime.utcnow()
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = now.strftime("%Y%m%d")
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+        credential = quote(f"{self.access_key}/{scope}", safe="")
+        query = (
+            f"X-Amz-Algorithm={SIGNER_ALGORITHM}&X-Amz-Credential={credential}"
+            f"&X-Amz-Date={amz_date}&X-Amz-Expires={int(expires)}"
+            "&X-Amz-SignedHeaders=host"
+        )
+        string_prefix = f"{SIGNER_ALGORITHM}\n{amz_date}\n{scope}\n"
+        signing_key = self.signing_key(datestamp)
+        bucket_path = f"{self.base_path}/{quote(bucket, safe='')}/"
+        urls = []
+        for key in keys:
+            if key is None:
+                urls.append(None)
+                continue
+            path = bucket_path + quote(key, safe="/~")
+            canonical_request = (
+                f"GET\n{path}\n{query}\nhost:{self.host}\n\nhost\nUNSIGNED-PAYLOAD"
+            )
+            string_to_sign = (
+                string_prefix
+                + hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+            )
+            signature = hmac.new(
+                signing_key, string_to_sign.encode("utf-8"), hashlib.sha256
+            ).hexdigest()
+            urls.append(
+                f"{self.scheme}://{self.host}{path}?{query}&X-Amz-Signature={signature}"
+            )
+        return urls
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_signer():
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = PresignedUrlSigner(
+                    os.getenv("CLOUDFLARE_ACCESS_KEY"),
+                    os.getenv("CLOUDFLARE_SECRET_KEY"),
+                    os.getenv("CLOUDFLARE_ACCOUNT_ENDPOINT"),
+                )
+    return _signer
+
+
+def presign_get_many(keys, bucket, expires: int):
+    return get_signer().presign_get_many(keys, bucket, expires)
+
+
+def presign_get(key, bucket, expires: int):
+    return presign_get_many([key], bucket, expires)[0]
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from sqlalchemy.orm import Session
+
+import models
+from utils import REDIS_HOST, REDIS_PORT, USER_CACHE_LOOKUPS, logger
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_LOCAL_TTL = int(os.getenv("USER_CACHE_LOCAL_TTL", 60))
+USER_CACHE_REDIS_TTL = int(os.getenv("USER_CACHE_REDIS_TTL", 3600))
+USER_CACHE_CHANNEL = "user_versions_invalidate"
+
+# Snapshot of the columns get_current_user needs: refreshVersion, accessVersion,
+# verified, user_tier. Kept in every API process and shared through Redis so a
+# token check does not need a Postgres round trip.
+_local_cache = OrderedDict()
+_local_lock = threading.Lock()
+# Bumped by every eviction. A reader that started before an eviction doesn't
+# fill the local cache, as its snapshot may predate the change.
+_local_generation = 0
+_listener = None
+_listener_lock = threading.Lock()
+_redis_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=0)
+
+
+def get_cache_redis():
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+def user_versions_key(user_id: int):
+    return f"user_versions_{user_id}"
+
+
+def user_snapshot(user: models.Users):
+    return {
+        "refreshVersion": int(user.refreshVersion),
+        "accessVersion": int(user.accessVersion),
+        "verified": bool(user.verified),
+        "user_tier": str(user.user_tier),
+    }
+
+
+def _local_get(user_id: int):
+    with _local_lock:
+        entry = _local_cache.get(user_id)
+        if entry is None:
+            return None
+        expires, snapshot = entry
+        if expires < time.monotonic():
+            del _local_cache[user_id]
+            return None
+        _local_cache.move_to_end(user_id)
+        return snapshot
+
+
+def _local_get_generation():
+    with _local_lock:
+        return _local_generation
+
+
+def _local_set(user_id: int, snapshot: dict, generation: int):
+    with _local_lock:
+        if generation != _local_generation:
+            return
+        _local_cache[user_id] = (time.monotonic() + USER_CACHE_LOCAL_TTL, snapshot)
+        _local_cache.move_to_end(user_id)
+        while len(_local_cache) > USER_CACHE_SIZE:
+            _local_cache.popitem(last=False)
+
+
+def _local_evict(user_id: int):
+    global _local_generation
+    with _local_lock:
+        _local_generation += 1
+        _local_cache.pop(user_id, None)
+
+
+def _handle_invalidation(message):
+    global _local_generation
+    try:
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        if data == "*":
+            with _local_lock:
+                _local_generation += 1
+                _local_cache.clear()
+        else:
+            _local_evict(int(data))
+    except Exception as e:
+        logger.error(f"Invalid user cache invalidation message - {str(e)}")
+
+
+def start_invalidation_listener():
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return
+    with _listener_lock:
+        if _listener is not None and _listener.is_alive():
+            return
+        try:
+            pubsub = get_cache_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{USER_CACHE_CHANNEL: _handle_invalidation})
+            _listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            # Without the listener the local TTL still bounds staleness.
+            logger.error(f"Failed to start user cache listener - {str(e)}")
+
+
+def get_user_versions(user_id: int, db: Session):
+    start_invalidation_listener()
+    snapshot = _local_get(user_id)
+    if snapshot is not None:
+        USER_CACHE_LOOKUPS.labels(result="local").inc()
+        return snapshot
+    generation = _local_get_generation()
+    rd = get_cache_redis()
+    try:
+        cached = rd.get(user_versions_key(user_id))
+    except Exception as e:
+        logger.error(f"User cache read failed - {str(e)}")
+        cached = None
+    if cached is not None:
+        snapshot = json.loads(cached)
+        _local_set(user_id, snapshot, generation)
+        USER_CACHE_LOOKUPS.labels(result="redis").inc()
+        return snapshot
+    USER_CACHE_LOOKUPS.labels(result="miss").inc()
+    user = db.query(models.Users).filter(models.Users.id == user_id).first()
+    if not user:
+        return None
+    snapshot = user_snapshot(user)
+    try:
+        # nx so a slow reader never overwrites a snapshot written by
+        # publish_user_versions after a version bump.
+        rd.set(
+            user_versions_key(user_id),
+            json.dumps(snapshot),
+            ex=USER_CACHE_REDIS_TTL,
+            nx=True,
+        )
+    except Exception as e:
+        logger.error(f"User cache write failed - {str(e)}")
+    _local_set(user_id, snapshot, generation)
+    return snapshot
+
+
+def publish_user_versions(user: models.Users):
+    user_id = int(user.id)
+    _local_evict(user_id)
+    try:
+        rd = get_cache_redis()
+        pipe = rd.pipeline(transaction=False)
+        pipe.set(
+            user_versions_key(user_id),
+            json.dumps(user_snapshot(user)),
+            ex=USER_CACHE_REDIS_TTL,
+        )
+        pipe.publish(USER_CACHE_CHANNEL, str(user_id))
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to publish user versions {user_id} - {str(e)}")
@@ -1,54 +1,23 @@
-import re
-import json
-import sys
-import argparse
-import os
-import time
 import typing
 import pandas as pd 
-import hashlib
-from urllib.parse import quote_plus 
-from datetime import date, datetime
 from dotenv import load_dotenv
 
-import requests
-import getpass
-import subprocess
-from subprocess import PIPE
+from script_utils.providers import vast_client
 
 load_dotenv()
-server_url_default = "https://console.vast.ai"
-VAST_KEY = os.getenv("VAST_KEY")
 
-def apiurl(subpath: str, query_args: typing.Dict = None, api_key = VAST_KEY, server_url_default = server_url_default) -> str:
-    result = None
-    query_args["api_key"] = api_key
+def get_listing(filters: typing.Dict = None):
+    # Extra filters are applied by Vast, so only matching offers are sent back.
+    query = {"verified": {"eq": True}, "external": {"eq": False}, "rentable": {"eq": True}}
+    query.update(filters or {})
 
-    if query_args:
-        query_json = "&".join(
-            "{x}={y}".format(x=x, y=quote_plus(y if isinstance(y, str) else json.dumps(y))) for x, y in
-            query_args.items())
-        result = server_url_default + "/api/v0" + subpath + "?" + query_json
-    else:
-        result = server_url_default + "/api/v0" + subpath
-    return result
-
-def get_listing():
-    try:
-        query = {"verified": {"eq": True}, "external": {"eq": False}, "rentable": {"eq": True}}
-    except ValueError as e:
-        return 1
-    
-    url = apiurl("/bundles", {"q": query})
-    r = requests.get(url)
-    r.raise_for_status()
-    rows = r.json()["offers"]
+    rows = vast_client().search_offers(query)
     displayable_fields = (
     ("id", "ID", "{}", None, True),
     ("cuda_max_good", "CUDA", "{:0.1f}", None, True),
     ("num_gpus", "N", "{}x", None, False),
     ("gpu_name", "Model", "{}", None, True),
-    ("gpu_ram", "VRAM","{:0.1f}", lambda x: int(round(x/1024, 0)), True),
+    ("gpu_ram", "VRAM","{:0.1f}", lambda x: (x / 1024).round(0).astype(int), True),
     ("pcie_bw", "PCIE", "{:0.1f}", None, True),
     ("cpu_cores_effective", "vCPUs", "{:0.1f}", None, True),
     ("cpu_ram", "RAM", "{:0.1f}", lambda x: x / 1000, False),
@@ -65,11 +34,11 @@ def get_listing():
     ("verification", "status", "{}", None, True),
     ("direct_port_count", "ports", "{}", None, True),
     ("geolocation", "country", "{}", None, True))
-    df  = pd.DataFrame(rows)
+    df  = pd.DataFrame(rows, columns=[x[0] for x in displayable_fields])
     df_ = pd.DataFrame()
     for field_name, display_name, format_string, postprocess, display in displayable_fields:
         df_[display_name] = df[field_name]
         if postprocess:
-            df_[display_name] = df_[display_name].apply(postprocess)
+            df_[display_name] = postprocess(df_[display_name])
     return df_
     
\ No newline at end of file
@@ -0,0 +1,56 @@
+import math
+import os
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+
+# Per CUDA version, the most jaeger-pipeline instances kept booted and
+# waiting for video jobs, e.g. "12.1:2,12.2:1". Empty turns the pool off.
+WARM_POOL_SIZE = {
+    cuda.strip(): int(size)
+    for cuda, size in (
+        x.split(":") for x in os.getenv("WARM_POOL_SIZE", "").split(",") if x.strip()
+    )
+}
+WARM_POOL_JOB_TYPE = "video"
+WARM_POOL_PIPELINE = ("jaeger-pipeline", 'bash -c "/app/backendml/entrypoint.sh"')
+WARM_POOL_IDLE_TTL = int(os.getenv("WARM_POOL_IDLE_TTL", 900))
+WARM_POOL_DISK = int(os.getenv("WARM_POOL_DISK", 100))
+WARM_POOL_BOOT_TIME = int(os.getenv("WARM_POOL_BOOT_TIME", 900))
+WARM_POOL_RATE_WINDOW = int(os.getenv("WARM_POOL_RATE_WINDOW", 1800))
+# Idle machines this close to their TTL are left for the reconciler.
+WARM_POOL_CLAIM_MARGIN = 120
+
+
+def pool_targets(arrivals: int):
+    """
+    Size the pool for the jobs expected to arrive while a cold instance
+    boots, split across CUDA versions by their configured share and capped
+    at the configured size.
+    """
+    total = sum(WARM_POOL_SIZE.values())
+    if not total:
+        return {}
+    expected = arrivals * WARM_POOL_BOOT_TIME / WARM_POOL_RATE_WINDOW
+    return {
+        cuda: min(size, math.ceil(expected * size / total))
+        for cuda, size in WARM_POOL_SIZE.items()
+    }
+
+
+def claim_idle_machine(db: Session, now: int):
+    # SKIP LOCKED lets concurrent launches each take a different machine
+    # instead of queueing on the same row. The lock is held until the caller
+    # commits the claim.
+    if not WARM_POOL_SIZE:
+        return None
+    return db.scalars(
+        select(models.Machines)
+        .where(models.Machines.machine_status == "IDLE")
+        .where(models.Machines.expires_at > now + WARM_POOL_CLAIM_MARGIN)
+        .order_by(models.Machines.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
@@ -0,0 +1,98 @@
+# Usage: python startup_profiler.py [--runs 5] [--top 15] [--path ../other-checkout]
+# Imports the API app in fresh interpreters, the way each gunicorn worker
+# does, and reports import time, resident memory and the heaviest modules.
+# Point --path at another checkout (e.g. a git worktree of an older commit)
+# to compare before and after.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+with open("/proc/self/statm") as f:
+    rss_pages = int(f.read().split()[1])
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": rss_pages * resource.getpagesize() / 1048576,
+    "modules": len(sys.modules),
+    "heavy": heavy,
+}}))
+"""
+
+# Packages that only the Celery media and GPU tasks need.
+HEAVY_MODULES = [
+    "cv2",
+    "librosa",
+    "matplotlib",
+    "numpy",
+    "pandas",
+    "PIL",
+    "ffmpeg",
+    "runpod",
+    "pyhtml2pdf",
+]
+
+
+def run_probe(path: str, module: str):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=path,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_times(path: str, module: str, top: int):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=path,
+        capture_output=True,
+        text=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[12:].split("|")]
+        if not cumulative.isdigit():
+            continue
+        # Cumulative times already include nested imports, so top-level
+        # package names are enough to see where the time goes.
+        if "." not in name and name != module:
+            packages[name] = max(packages.get(name, 0), int(cumulative))
+    return sorted(packages.items(), key=lambda x: x[1], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    samples = [run_probe(args.path, args.module) for _ in range(args.runs)]
+    seconds = [x["seconds"] for x in samples]
+    rss = [x["rss_mb"] for x in samples]
+    print(f"import {args.module} from {args.path} ({args.runs} runs)")
+    print(
+        f"  import time  median {statistics.median(seconds):.2f}s  "
+        f"min {min(seconds):.2f}s  max {max(seconds):.2f}s"
+    )
+    print(f"  RSS          median {statistics.median(rss):.1f} MB")
+    print(f"  modules      {samples[0]['modules']}")
+    print(f"  heavy loaded {', '.join(samples[0]['heavy']) or 'none'}")
+    print("  slowest top-level imports (cumulative):")
+    for name, micros in import_times(args.path, args.module, args.top):
+        print(f"    {name:<28} {micros / 1000:8.1f} ms")
@@ -1,9 +1,11 @@
 from main import app
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
+from fakeredis import FakeStrictRedis
 from fastapi import status
 from utils import *
 from routers.auth import ForgotPassword
+from script_utils import password_pool
 import time
 from pydantic import BaseModel
 import pytest
@@ -121,7 +123,7 @@ def test_login_user_success(client, create_test_db):
     ) as mock_create_access_token, patch(
         "routers.auth.create_refresh_token"
     ) as mock_create_refresh_token:
-        mock_authenticate_user.return_value = True
+        mock_authenticate_user.return_value = MagicMock(id=1)
         mock_create_access_token.return_value = "access_token_example"
         mock_create_refresh_token.return_value = "refresh_token_example"
         login_data = {
@@ -147,6 +149,19 @@ def test_login_user_invalid_credentials(client, create_test_db):
         assert response.json()["detail"] == "Invalid email or password"
 
 
+def test_login_user_hash_pool_saturated(client, create_test_db):
+    with patch(
+        "script_utils.password_pool._pending",
+        password_pool.PASSWORD_POOL_MAX_QUEUE,
+    ):
+        login_data = {
+            "username": "john.doe@example.com",
+            "password": "securepassword123",
+        }
+        response = client.post("/auth/login", data=login_data)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
 def test_login_user_internal_error(client, create_test_db):
     with patch("routers.auth.login_user_task") as mock_login_user_task:
         mock_login_user_task.return_value = {
@@ -348,3 +363,66 @@ def test_verify_email_failed(client, test_user):
         response = client.get("/auth/verifyemail?user_id=1&email_token=12345")
         assert response.status_code == status.HTTP_406_NOT_ACCEPTABLE
         assert response.json()["detail"] == "Email not verified"
+
+
+def test_user_versions_cache(test_user, test_db_session):
+    from script_utils import user_cache
+
+    fake_redis = FakeStrictRedis()
+    with patch(
+        "script_utils.user_cache.get_cache_redis", return_value=fake_redis
+    ), patch("script_utils.user_cache.start_invalidation_listener"):
+        snapshot = user_cache.get_user_versions(test_user.id, test_db_session)
+        assert snapshot["accessVersion"] == 1
+        assert fake_redis.exists(user_cache.user_versions_key(test_user.id))
+        db = MagicMock()
+        assert user_cache.get_user_versions(test_user.id, db) == snapshot
+        db.query.assert_not_called()
+        test_user.accessVersion = 2
+        test_db_session.commit()
+        user_cache.publish_user_versions(test_user)
+        snapshot = user_cache.get_user_versions(test_user.id, db)
+        assert snapshot["accessVersion"] == 2
+        db.query.assert_not_called()
+
+        # An eviction that lands while a read is in flight keeps that read's
+        # snapshot out of the local cache.
+        user_cache._local_evict(test_user.id)
+        read = fake_redis.get
+        reads = []
+
+        def racing_get(key):
+            reads.append(key)
+            cached = read(key)
+            user_cache._local_evict(test_user.id)
+            return cached
+
+        fake_redis.get = racing_get
+        user_cache.get_user_versions(test_user.id, db)
+        user_cache.get_user_versions(test_user.id, db)
+        assert len(reads) == 2
+
+
+def test_decode_token_formats():
+    payload = {"id": 7, "refreshVersion": 2, "accessVersion": 3, "user_tier": "free"}
+    claims = decode_token(create_access_token(payload), JWT_SECRET)
+    assert claims["id"] == 7
+    assert claims["refreshVersion"] == 2
+    assert claims["accessVersion"] == 3
+    assert claims["user_tier"] == "free"
+    legacy = jwt.encode(
+        {
+            "exp": datetime.utcnow() + timedelta(minutes=5),
+            "sub": str({"id": 7, "refreshVersion": 2, "accessVersion": 3}),
+        },
+        JWT_SECRET,
+        JWT_ALGORITHM,
+    )
+    claims = decode_token(legacy, JWT_SECRET)
+    assert claims["id"] == 7
+    assert claims["accessVersion"] == 3
+    # Served from the cache, but changing one caller's claims doesn't leak.
+    claims["id"] = 8
+    with patch("utils.jwt.decode") as mock_decode:
+        assert decode_token(legacy, JWT_SECRET)["id"] == 7
+        mock_decode.assert_not_called()
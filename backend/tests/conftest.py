@@ -22,6 +22,7 @@ from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from fakeredis import FakeStrictRedis
 import models
 
@@ -33,6 +34,11 @@ engine = create_engine(
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingAsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 
 @pytest.fixture(scope="function")
 def test_db_session():
@@ -52,6 +58,11 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
 # Dependency override for the Redis server
 def override_get_redis():
     return FakeStrictRedis()
@@ -80,6 +91,7 @@ app.dependency_overrides[auth.get_redis] = override_get_redis
 
 # Dashboard
 app.dependency_overrides[dashboard.get_db] = override_get_db
+app.dependency_overrides[dashboard.get_async_db] = override_get_async_db
 app.dependency_overrides[dashboard.get_current_user] = override_get_current_user
 
 # Upload
@@ -88,6 +100,7 @@ app.dependency_overrides[upload.get_current_user] = override_get_current_user
 
 # Content
 app.dependency_overrides[content.get_db] = override_get_db
+app.dependency_overrides[content.get_async_db] = override_get_async_db
 app.dependency_overrides[content.get_current_user] = override_get_current_user
 app.dependency_overrides[content.get_redis] = override_get_redis
 
@@ -97,7 +110,13 @@ app.dependency_overrides[settings.get_current_user] = override_get_current_user
 
 # Billing
 app.dependency_overrides[billing.get_db] = override_get_db
+app.dependency_overrides[billing.get_async_db] = override_get_async_db
 app.dependency_overrides[billing.get_current_user] = override_get_current_user
+app.dependency_overrides[billing.get_redis] = override_get_redis
+
+# Jobs
+app.dependency_overrides[jobs.get_async_db] = override_get_async_db
+app.dependency_overrides[jobs.get_redis] = override_get_redis
 
 
 @pytest.fixture(scope="module")
@@ -179,3 +179,367 @@ def test_rename_content_fail(client, create_test_db):
         }
         response = client.put("/content/rename-content/1/video/newtitle")
         assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_get_content_list_query_count(create_test_db, test_db_session):
+    import asyncio
+    import time
+    import models
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from routers.content import get_content_list_celery
+
+    db = test_db_session
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="content_list@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=int(time.time()),
+    )
+    db.add(user)
+    db.commit()
+    tags = [models.Tags(tag=f"tag{i}", readable=f"Tag {i}") for i in range(2)]
+    db.add_all(tags)
+    db.commit()
+    main = models.Content(
+        user_id=user.id,
+        title="main",
+        content_type="video",
+        status="completed",
+        created_at=int(time.time()),
+    )
+    db.add(main)
+    db.commit()
+    related = [
+        models.Content(
+            user_id=user.id,
+            title=f"related{i}",
+            content_type="video",
+            status="completed",
+            id_related=main.id,
+            created_at=int(time.time()) + i,
+        )
+        for i in range(6)
+    ]
+    db.add_all(related)
+    db.commit()
+    db.add_all(
+        [
+            models.ContentTags(content_id=x.id, tag_id=tag.id)
+            for x in [main] + related
+            for tag in tags
+        ]
+    )
+    db.commit()
+
+    async def count_queries(limit, offset):
+        engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+        statements = []
+        event.listen(
+            engine.sync_engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        try:
+            async with async_sessionmaker(engine)() as session:
+                result = await get_content_list_celery(
+                    session, main.id, "video", user.id, limit, offset
+                )
+        finally:
+            await engine.dispose()
+        return result, len(statements)
+
+    small, small_count = asyncio.run(count_queries(2, 0))
+    large, large_count = asyncio.run(count_queries(5, 0))
+    paged, paged_count = asyncio.run(count_queries(5, 5))
+    assert small["detail"] == "Success"
+    assert len(small["data"]) == 2
+    assert len(large["data"]) == 5
+    assert len(paged["data"]) == 2
+    assert large["data"][0]["id"] == main.id
+    assert large["total"] == 7
+    assert sorted(large["data"][1]["tags"].split(",")) == ["Tag 0", "Tag 1"]
+    assert small_count == large_count == paged_count
+
+
+def test_presign_get_many_matches_boto3():
+    from datetime import datetime
+    from urllib.parse import parse_qs, urlsplit
+    from script_utils.signer import PresignedUrlSigner
+
+    endpoint = "https://account.r2.cloudflarestorage.com"
+    r2 = boto3.client(
+        "s3",
+        aws_access_key_id="access",
+        aws_secret_access_key="secret",
+        endpoint_url=endpoint,
+        region_name="us-east-1",
+        config=botocore.config.Config(
+            s3={"addressing_style": "path"}, signature_version="s3v4"
+        ),
+    )
+    keys = ["1/video (1).mp4", "1/thumbnails/~é+.jpg"]
+    expected = [
+        r2.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": "content", "Key": key},
+            ExpiresIn=3600,
+        )
+        for key in keys
+    ]
+    signed_at = parse_qs(urlsplit(expected[0]).query)["X-Amz-Date"][0]
+    signer = PresignedUrlSigner("access", "secret", endpoint, region="us-east-1")
+    urls = signer.presign_get_many(
+        keys + [None],
+        "content",
+        3600,
+        now=datetime.strptime(signed_at, "%Y%m%dT%H%M%SZ"),
+    )
+    assert urls == expected + [None]
+
+
+def test_add_presigned_batches_redis():
+    from fakeredis import FakeStrictRedis
+    from routers.content import add_presigned
+    import utils
+
+    rd = FakeStrictRedis()
+    rows = [{"thumbnail": f"1/{i}.jpg"} for i in range(12)] + [{"thumbnail": None}]
+    round_trips = [0]
+    token = utils._redis_round_trips.set(round_trips)
+    try:
+        with patch("utils.presign_get_many") as mock_presign:
+            mock_presign.side_effect = lambda keys, bucket, expires: [
+                f"https://r2/{key}" for key in keys
+            ]
+            add_presigned(rows, "thumbnail", "thumbnail_link", "metadata", rd)
+            assert mock_presign.call_count == 1
+            assert round_trips[0] == 2
+            assert rd.ttl("1/0.jpg") > 0
+            add_presigned(rows, "thumbnail", "thumbnail_link", "metadata", rd)
+            assert mock_presign.call_count == 1
+            assert round_trips[0] == 3
+    finally:
+        utils._redis_round_trips.reset(token)
+    assert rows[3]["thumbnail_link"] == "https://r2/1/3.jpg"
+    assert rows[-1]["thumbnail_link"] is None
+
+
+def test_add_presigned_signs_without_redis():
+    import redis
+    from routers.content import add_presigned
+
+    class BrokenRedis:
+        def mget(self, keys):
+            raise redis.ConnectionError("down")
+
+        def pipeline(self, transaction=True):
+            raise redis.ConnectionError("down")
+
+    rows = [{"thumbnail": "1/a.jpg"}, {"thumbnail": None}]
+    with patch("utils.presign_get_many") as mock_presign:
+        mock_presign.side_effect = lambda keys, bucket, expires: [
+            f"https://r2/{key}" for key in keys
+        ]
+        add_presigned(rows, "thumbnail", "thumbnail_link", "metadata", BrokenRedis())
+    assert rows[0]["thumbnail_link"] == "https://r2/1/a.jpg"
+    assert rows[1]["thumbnail_link"] is None
+
+
+def test_get_content_table_cursor_and_cached_count(create_test_db, test_db_session):
+    import asyncio
+    import time
+    import models
+    from fakeredis import FakeStrictRedis
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from routers.content import get_content_table
+
+    db = test_db_session
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="content_cursor@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=int(time.time()),
+    )
+    db.add(user)
+    db.commit()
+    created_at = int(time.time())
+    db.add_all(
+        [
+            models.Content(
+                user_id=user.id,
+                title=f"audio{i}",
+                content_type="audio",
+                status="completed",
+                created_at=created_at + i // 2,
+            )
+            for i in range(5)
+        ]
+    )
+    db.commit()
+    rd = FakeStrictRedis()
+
+    async def fetch(cursor=None):
+        engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+        try:
+            async with async_sessionmaker(engine)() as session:
+                return await get_content_table(
+                    user.id, "audio", 2, 0, session, rd, cursor
+                )
+        finally:
+            await engine.dispose()
+
+    pages = [asyncio.run(fetch())]
+    while pages[-1]["next_cursor"] is not None:
+        pages.append(asyncio.run(fetch(pages[-1]["next_cursor"])))
+    titles = [x["title"] for page in pages for x in page["data"][0]]
+    assert titles == ["audio4", "audio3", "audio2", "audio1", "audio0"]
+    assert pages[0]["data"][1] == 5
+    assert rd.hget(f"listing_counts_{user.id}", "content") == b"5"
+
+    with patch("script_utils.pagination._counts_redis", rd):
+        db.add(
+            models.Content(
+                user_id=user.id,
+                title="audio5",
+                content_type="audio",
+                status="completed",
+                created_at=created_at + 10,
+            )
+        )
+        db.commit()
+    assert not rd.exists(f"listing_counts_{user.id}")
+    assert asyncio.run(fetch())["data"][1] == 6
+
+    # A count read before an invalidation isn't written back after it.
+    from script_utils import pagination
+
+    pagination.invalidate_counts([user.id], rd)
+    count, generation = pagination.get_cached_count(rd, user.id, "content")
+    assert count is None
+    pagination.invalidate_counts([user.id], rd)
+    pagination.set_cached_count(rd, user.id, "content", 6, generation)
+    assert not rd.exists(f"listing_counts_{user.id}")
+    count, generation = pagination.get_cached_count(rd, user.id, "content")
+    pagination.set_cached_count(rd, user.id, "content", 6, generation)
+    assert pagination.get_cached_count(rd, user.id, "content")[0] == 6
+
+
+def test_filter_data_formats_numeric_columns():
+    from routers.content import filter_data
+
+    data = filter_data(
+        [
+            {
+                "user_id": 1,
+                "thumbnail": "1/thumbnail.jpg",
+                "id_related": None,
+                "size": 123456789,
+                "duration": 3725.4,
+                "fps": 29.97,
+                "hz": 44100.0,
+            }
+        ]
+    )
+    assert data == [
+        {"size": "117.74 MB", "duration": "01:02:05", "fps": 29.97, "hz": "44100"}
+    ]
+
+
+def test_processing_result_shared_and_released(create_test_db, test_db_session):
+    import time
+    import models
+    from script_utils import result_cache
+
+    db = test_db_session
+    now = int(time.time())
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="processing_result@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    filters = {"super_resolution": {"active": True, "model": "2x"}}
+    result_key = result_cache.processing_result_key("md5==", "video", filters)
+    assert result_key == result_cache.processing_result_key(
+        "md5==", "video", {**filters, "video_denoising": {"active": False}}
+    )
+    assert result_key != result_cache.processing_result_key("other==", "video", filters)
+    jobs = []
+    for name in ["first", "second"]:
+        job = models.Jobs(
+            user_id=user.id,
+            job_name=name,
+            job_type="video",
+            job_status="Processing",
+            job_key=True,
+            key=name,
+            result_key=result_key,
+            created_at=now,
+        )
+        db.add(job)
+        db.commit()
+        jobs.append(job)
+        db.add_all(
+            [
+                models.Content(
+                    user_id=user.id,
+                    job_id=job.job_id,
+                    title="clip",
+                    content_type="video",
+                    status="processing",
+                    created_at=now,
+                ),
+                models.Content(
+                    user_id=user.id,
+                    job_id=job.job_id,
+                    title="clip.srt",
+                    content_type="video",
+                    status="processing",
+                    created_at=now,
+                ),
+            ]
+        )
+    db.commit()
+    assert result_cache.record_processing_result(db, jobs[0].job_id) is None
+    for content, link in zip(
+        db.query(models.Content).filter(models.Content.job_id == jobs[0].job_id),
+        ["1/clip_out.mp4", "1/clip_out.srt"],
+    ):
+        content.title = "clip.mp4" if link.endswith(".mp4") else "clip.srt"
+        content.link = link
+        content.thumbnail = "thumbnail/1/clip_out.jpg"
+        content.size = 2048
+        content.status = "completed"
+    db.commit()
+    assert result_cache.record_processing_result(db, jobs[0].job_id) is not None
+
+    cached = result_cache.find_processing_result(db, result_key)
+    contents = result_cache.apply_processing_result(db, jobs[1], cached)
+    db.commit()
+    assert sorted(x.title for x in contents) == ["clip.mp4", "clip.srt"]
+    assert {x.link for x in contents} == {"1/clip_out.mp4", "1/clip_out.srt"}
+    assert jobs[1].job_status == "Completed"
+    db.refresh(cached)
+    assert cached.hits == 1
+
+    first = db.query(models.Content).filter(models.Content.job_id == jobs[0].job_id)
+    with patch("script_utils.result_cache.delete_r2_file") as mock_delete:
+        result_cache.release_r2_objects(db, first.all())
+        assert mock_delete.delay.call_count == 0
+        first.delete()
+        db.commit()
+        result_cache.release_r2_objects(db, contents)
+        assert sorted(x.args[0] for x in mock_delete.delay.call_args_list) == [
+            "1/clip_out.mp4",
+            "1/clip_out.srt",
+            "thumbnail/1/clip_out.jpg",
+        ]
@@ -59,3 +59,89 @@ def test_get_status_failed(client, create_test_db):
         response = client.get("/dashboard/get_stats")
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         assert response.json() == {"detail": "Error"}
+
+
+def test_dashboard_counters_and_reconcile(create_test_db, test_db_session):
+    import time
+    import models
+    from routers.dashboard import (
+        content_added,
+        content_removed,
+        increment_dashboard,
+        reconcile_dashboard,
+    )
+
+    db = test_db_session
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="dashboard_counters@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=int(time.time()),
+    )
+    db.add(user)
+    db.commit()
+    db.add(
+        models.Dashboard(
+            user_id=user.id,
+            video_processed=0,
+            audio_processed=0,
+            image_processed=0,
+            downloads=0,
+            uploads=0,
+            storage_used=0,
+            storage_limit=5368709120,
+            gpu_usage=0,
+            created_at=int(time.time()),
+        )
+    )
+    contents = [
+        models.Content(
+            user_id=user.id,
+            title=title,
+            content_type=content_type,
+            status="completed",
+            size=size,
+            created_at=int(time.time()),
+        )
+        for title, content_type, size in [
+            ("clip.mp4", "video", 3000),
+            ("clip.srt", "video", 10),
+            ("song.mp3", "audio", 500),
+            ("photo.png", "image", 200),
+        ]
+    ]
+    db.add_all(contents)
+    db.commit()
+
+    for content in contents:
+        if not content.title.endswith(".srt"):
+            content_added(db, user.id, content.content_type, content.size)
+    increment_dashboard(db, user.id, gpu_usage=30, downloads=3000)
+    db.commit()
+    dashboard = db.get(models.Dashboard, user.id)
+    db.refresh(dashboard)
+    assert dashboard.video_processed == 1
+    assert dashboard.storage_video_bytes == 3000
+    assert dashboard.storage_used == 3700
+    assert dashboard.uploads == 3700
+    assert dashboard.gpu_usage == 30
+
+    db.delete(contents[2])
+    content_removed(db, user.id, [contents[1], contents[2]])
+    db.commit()
+    db.refresh(dashboard)
+    assert dashboard.audio_processed == 0
+    assert dashboard.storage_audio_bytes == 0
+    assert dashboard.storage_used == 3200
+
+    increment_dashboard(db, user.id, image_processed=5, storage_image_bytes=999)
+    db.commit()
+    assert reconcile_dashboard(db, user.id) == 1
+    db.refresh(dashboard)
+    assert dashboard.image_processed == 1
+    assert dashboard.storage_image_bytes == 200
+    assert dashboard.storage_used == 3200
+    assert dashboard.uploads == 3700
+    assert dashboard.downloads == 3000
@@ -0,0 +1,222 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+import fakeredis
+from fakeredis import aioredis as fake_aioredis
+from script_utils import progress_hub
+
+
+def test_progress_hub_polls_once_per_job(monkeypatch):
+    monkeypatch.setattr(progress_hub, "_redis", fake_aioredis.FakeRedis())
+    monkeypatch.setattr(progress_hub, "PROGRESS_INTERVAL", 0.05)
+    calls = []
+
+    async def build_snapshot(job_id, state):
+        calls.append(job_id)
+        status = "Running" if len(calls) < 3 else "Completed"
+        return {"job_type": "video", "status": status, "job_id": job_id}
+
+    async def run():
+        sockets = [progress_hub.subscribe() for _ in range(20)]
+        for pubsub in sockets:
+            await pubsub.subscribe(progress_hub.progress_channel(7))
+        for _ in sockets:
+            await progress_hub.ensure_poller(7, build_snapshot)
+        poller = progress_hub._pollers.pop(7)
+        # Another API worker can't start a second poller while the lock is held.
+        await progress_hub.ensure_poller(7, build_snapshot)
+        assert 7 not in progress_hub._pollers
+        await asyncio.wait_for(poller, timeout=5)
+        received = []
+        for pubsub in sockets:
+            messages = []
+            for _ in range(5):
+                message = await pubsub.get_message(timeout=0.01)
+                if message is not None:
+                    messages.append(message)
+            received.append(messages)
+            await pubsub.close()
+        latest = await progress_hub.latest_snapshots([7])
+        return received, latest
+
+    received, latest = asyncio.run(run())
+    assert calls == [7, 7, 7]
+    assert all(len(messages) == 3 for messages in received)
+    assert latest[7]["status"] == "Completed"
+
+
+def test_progress_stream_and_heartbeats(monkeypatch):
+    server = fakeredis.FakeServer()
+    rd = fakeredis.FakeStrictRedis(server=server)
+    monkeypatch.setattr(progress_hub, "_redis", fake_aioredis.FakeRedis(server=server))
+    assert progress_hub.lost_heartbeats(rd, [9]) == set()
+
+    progress_hub.record_progress(
+        rd, 9, {"model": "upscale", "status": "Running", "chunk": "1/4", "progress": 50}
+    )
+    progress_hub.record_progress(rd, 9, {})
+    assert rd.xlen(progress_hub.progress_stream(9)) == 1
+
+    async def run():
+        latest = await progress_hub.latest_progress(9)
+        # A push wakes a waiting reader straight away.
+        waiting = asyncio.create_task(progress_hub.wait_for_progress(9, latest["id"]))
+        await asyncio.sleep(0.01)
+        progress_hub.record_progress(rd, 9, {"chunk": "2/4", "progress": 10})
+        return latest, await asyncio.wait_for(waiting, timeout=5)
+
+    latest, last_id = asyncio.run(run())
+    assert latest["model"] == "upscale"
+    assert latest["chunk"] == "1/4"
+    assert last_id != latest["id"]
+    # The partial push keeps the model and status from the one before.
+    merged = asyncio.run(
+        progress_hub.latest_progress(9, fake_aioredis.FakeRedis(server=server))
+    )
+    assert merged["id"] == last_id
+    assert merged["model"] == "upscale"
+    assert merged["status"] == "Running"
+    assert merged["chunk"] == "2/4"
+    assert merged["progress"] == "10"
+    from routers import jobs as jobs_router
+
+    # A model the tags don't know about is shown as it was reported.
+    shown = jobs_router.format_progress({}, {}, "new_model", "Running", "2/4", 10)
+    assert shown["model"] == "new_model"
+    assert progress_hub.lost_heartbeats(rd, [9]) == set()
+
+    now = progress_hub.time.time()
+    monkeypatch.setattr(
+        progress_hub.time,
+        "time",
+        lambda: now + progress_hub.HEARTBEAT_TIMEOUT + 1,
+    )
+    assert progress_hub.lost_heartbeats(rd, [9, 10]) == {9}
+    progress_hub.clear_heartbeats(rd, [9])
+    assert progress_hub.lost_heartbeats(rd, [9]) == set()
+
+
+def test_replicate_webhook_chains_next_filter(monkeypatch):
+    import replicate
+    from routers import jobs
+
+    rd = fakeredis.FakeStrictRedis()
+    rd.close = lambda: None
+    monkeypatch.setattr(jobs.redis, "Redis", lambda **kwargs: rd)
+    monkeypatch.setattr(jobs, "replicate_version", lambda model_tag: model_tag)
+    # Webhooks are refused until a dedicated secret is set.
+    monkeypatch.setattr(jobs, "REPLICATE_WEBHOOK_SECRET", None)
+    try:
+        jobs.replicate_webhook_token(5, 0)
+        assert False
+    except Exception as e:
+        assert "REPLICATE_WEBHOOK_SECRET" in str(e)
+    monkeypatch.setattr(jobs, "REPLICATE_WEBHOOK_SECRET", "webhook-secret")
+    seen_steps = []
+
+    def create_prediction(**kwargs):
+        # The chain is already at the new step when the prediction is made.
+        seen_steps.append(json.loads(rd.get(jobs.replicate_chain_key(5)))["step"])
+        return SimpleNamespace(id="prediction-2")
+
+    create = MagicMock(side_effect=create_prediction)
+    monkeypatch.setattr(replicate.predictions, "create", create)
+    monkeypatch.setattr(jobs.image_prediction_done, "apply_async", MagicMock())
+    monkeypatch.setattr(
+        jobs.image_process_task,
+        "AsyncResult",
+        lambda task_id: SimpleNamespace(is_aborted=lambda: False),
+    )
+    filters = list(jobs.IMAGE_MODELS)[:2]
+    job_config = {
+        "job_id": 5,
+        "user_id": 1,
+        "config_json": {
+            "job_data": {
+                "filters": {
+                    x: {
+                        "active": True,
+                        **{
+                            v: 1
+                            for v in jobs.IMAGE_MODELS[x].get("params", {}).values()
+                        },
+                    }
+                    for x in filters
+                }
+            }
+        },
+    }
+    chain = {
+        "job_config": job_config,
+        "celery_id": "task",
+        "filters": filters,
+        "step": 0,
+        "started_at": 0,
+        "prediction_id": "prediction-1",
+    }
+    rd.set(jobs.replicate_chain_key(5), json.dumps(chain))
+    assert jobs.replicate_webhook_token(5, 0) != jobs.replicate_webhook_token(5, 1)
+
+    done = {"status": "succeeded", "output": "https://replicate.delivery/out.png"}
+    result = jobs.image_prediction_done(5, 0, done)
+    assert result == {"detail": "Success", "data": "prediction-2"}
+    kwargs = create.call_args.kwargs
+    assert kwargs["input"]["image"] == done["output"]
+    assert kwargs["webhook"].endswith(f"token={jobs.replicate_webhook_token(5, 1)}")
+    assert seen_steps == [1]
+    stored = json.loads(rd.get(jobs.replicate_chain_key(5)))
+    assert stored["step"] == 1
+    assert stored["prediction_id"] == "prediction-2"
+    # A prediction id that comes back after the chain moved on is dropped.
+    assert not jobs.store_prediction_id(rd, 5, 0, "prediction-1")
+    # A repeated callback for the same step does nothing.
+    assert jobs.image_prediction_done(5, 0, done)["detail"] == "Failed"
+    assert create.call_count == 1
+
+
+def test_fair_share_scheduler(monkeypatch):
+    from script_utils import scheduler
+
+    monkeypatch.setattr(scheduler, "SCHEDULER_BUDGETS", {"vast": 2, "runpod": 0})
+    monkeypatch.setattr(scheduler, "LANE_PROVIDERS", {"gpu": ["vast", "runpod"]})
+    rd = fakeredis.FakeStrictRedis()
+
+    def job(job_id, user_id):
+        return {"job_id": job_id, "user_id": user_id, "job_type": "video"}
+
+    # A burst from one free user doesn't hold back a later deluxe user.
+    for job_id in range(1, 5):
+        scheduler.enqueue(rd, job(job_id, 1), "free", 100)
+    scheduler.enqueue(rd, job(5, 2), "deluxe", 100)
+    scheduler.enqueue(rd, job(6, 3), "free", 100)
+    order = [int(x) for x in rd.zrange(scheduler.queue_key("gpu"), 0, -1)]
+    assert order[:3] == [5, 1, 6]
+
+    position = scheduler.queue_position(rd, "gpu", 4, running=2, now=1000)
+    assert position["position"] == 6
+    # Five jobs of 100s each ahead, run two at a time.
+    assert position["eta"] == 250
+    assert position["start_at"] == 1250
+
+    assert scheduler.remove(rd, "video", 6)
+    assert not scheduler.remove(rd, "video", 6)
+
+    monkeypatch.setattr(scheduler, "lane_running", lambda db, lane: 1)
+    dispatched = []
+    started = scheduler.schedule(None, rd, lambda x: dispatched.append(x) or True)
+    assert started == {"gpu": 1}
+    assert [x["job_id"] for x in dispatched] == [5]
+    assert scheduler.queue_length(rd, "gpu") == 4
+    # A newcomer starts from the lane's clock, not from zero.
+    scheduler.enqueue(rd, job(7, 4), "free", 100)
+    assert [int(x) for x in rd.zrange(scheduler.queue_key("gpu"), 0, 0)] == [1]
+
+    # A job whose dispatch fails goes back to the front of the queue.
+    def broken(job_config):
+        raise Exception("broker down")
+
+    assert scheduler.schedule(None, rd, broken) == {"gpu": 0}
+    assert scheduler.queue_length(rd, "gpu") == 5
+    assert [int(x) for x in rd.zrange(scheduler.queue_key("gpu"), 0, 0)] == [1]
+    assert float(rd.hget(scheduler.cost_key("gpu"), 1)) == 100
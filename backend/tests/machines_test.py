@@ -0,0 +1,830 @@
+import json
+import time
+from unittest.mock import MagicMock
+from fakeredis import FakeStrictRedis
+import models
+from routers import machines
+from script_utils import gpu_workers
+
+
+def test_reconcile_machines(create_test_db, test_db_session, monkeypatch):
+    db = test_db_session
+    now = int(time.time())
+    terminated = []
+    monkeypatch.setattr(
+        gpu_workers,
+        "terminate_instance",
+        lambda provider, instance_id: terminated.append((provider, instance_id)),
+    )
+    monkeypatch.setattr(machines, "job_email", MagicMock())
+    monkeypatch.setattr(machines, "send_discord_update", MagicMock())
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="reconcile_machines@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    jobs = {}
+    for name in ["exited", "loading", "expired"]:
+        jobs[name] = models.Jobs(
+            user_id=user.id,
+            job_name=name,
+            job_type="video",
+            job_status="Running",
+            job_key=True,
+            key=name,
+            created_at=now,
+        )
+        db.add(jobs[name])
+    db.commit()
+    db.add_all(
+        [
+            models.Content(
+                user_id=user.id,
+                job_id=jobs["exited"].job_id,
+                title=title,
+                content_type="video",
+                status=content_status,
+                created_at=now,
+            )
+            for title, content_status in [
+                ("a.mp4", "completed"),
+                ("b.mp4", "processing"),
+            ]
+        ]
+    )
+    rows = [
+        ("exited", "vast", "101", "RUNNING", now - 60, None),
+        ("loading", "runpod", "pod-1", "LOADING", now - 60, None),
+        ("expired", "vast", "102", "RUNNING", now - 7200, now - 60),
+    ]
+    for name, provider, instance_id, machine_status, created_at, expires_at in rows:
+        db.add(
+            models.Machines(
+                instance_id=instance_id,
+                user_id=user.id,
+                job_id=jobs[name].job_id,
+                machine_status=machine_status,
+                provider=provider,
+                created_at=created_at,
+                expires_at=expires_at,
+            )
+        )
+    db.commit()
+    listings = {
+        "vast": {
+            "102": {"id": 102, "status_msg": None, "ports": {}, "label": "x"},
+            "555": {"id": 555, "status_msg": None, "label": "jaeger-pipeline"},
+        },
+        "runpod": {"pod-1": {"id": "pod-1", "name": "jaeger-pipeline", "runtime": {}}},
+    }
+    rd = FakeStrictRedis()
+    counts_key = machines.pagination.counts_key(user.id)
+    rd.hset(counts_key, "past_jobs", 0)
+
+    result = machines.reconcile_machines(db, rd, listings, now)
+    assert result == {"machines": 3, "updated": 3, "finished": 2, "orphans": 0}
+    # The cached listing totals no longer match and are dropped.
+    assert not rd.exists(counts_key)
+    statuses = {
+        x.job_id: x.machine_status
+        for x in db.query(models.Machines).filter(models.Machines.user_id == user.id)
+    }
+    assert statuses[jobs["exited"].job_id] == "EXITED"
+    assert statuses[jobs["loading"].job_id] == "RUNNING"
+    assert statuses[jobs["expired"].job_id] == "FAILED"
+    for job in jobs.values():
+        db.refresh(job)
+    # One of the exited job's files never finished.
+    assert jobs["exited"].job_status == "Failed"
+    assert jobs["exited"].job_key == False
+    assert jobs["loading"].job_status == "Running"
+    assert jobs["expired"].job_status == "Failed"
+    assert sorted(terminated) == [("vast", "101"), ("vast", "102")]
+    assert machines.job_email.delay.call_count == 2
+
+    # The unknown instance is only terminated the second time it is seen.
+    terminated.clear()
+    result = machines.reconcile_machines(db, rd, listings, now)
+    assert result["orphans"] == 1
+    assert ("vast", "555") in terminated
+
+
+def test_finished_job_notifies_once(create_test_db, test_db_session, monkeypatch):
+    import asyncio
+    from routers import jobs as jobs_router
+
+    db = test_db_session
+    now = int(time.time())
+    monkeypatch.setattr(gpu_workers, "terminate_instance", lambda *a: None)
+    for module in [jobs_router, machines]:
+        monkeypatch.setattr(module, "job_email", MagicMock())
+        monkeypatch.setattr(module, "send_discord_update", MagicMock())
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="finished_job_notifies@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    job = models.Jobs(
+        user_id=user.id,
+        job_name="finished",
+        job_type="video",
+        job_status="Running",
+        job_key=True,
+        key="finished",
+        created_at=now,
+    )
+    db.add_all([job, models.Dashboard(user_id=user.id)])
+    db.commit()
+    db.add_all(
+        [
+            models.Content(
+                user_id=user.id,
+                job_id=job.job_id,
+                title="a.mp4",
+                content_type="video",
+                status="completed",
+                created_at=now,
+            ),
+            models.Machines(
+                instance_id="301",
+                user_id=user.id,
+                job_id=job.job_id,
+                machine_status="RUNNING",
+                provider="vast",
+                created_at=now - 60,
+                updated_at=now,
+            ),
+        ]
+    )
+    db.commit()
+
+    asyncio.run(
+        jobs_router.job_status(
+            jobs_router.JobStatus(job_id=job.job_id, job_key="finished"), db
+        )
+    )
+    jobs_router.job_email.delay.assert_called_once_with(
+        job_id=job.job_id, user_id=user.id, status="completed"
+    )
+    # The instance exits afterwards and the reconciler doesn't notify again.
+    machines.reconcile_machines(db, FakeStrictRedis(), {"vast": {}}, now)
+    machine = db.query(models.Machines).filter_by(job_id=job.job_id).one()
+    assert machine.machine_status == "EXITED"
+    assert machines.job_email.delay.call_count == 0
+
+
+def test_gpu_offers_snapshot(monkeypatch):
+    import pandas as pd
+
+    monkeypatch.setattr(
+        gpu_workers,
+        "vast_offers",
+        lambda requirements: pd.DataFrame(
+            {
+                "ID": [11, 12],
+                "N": [1, 1],
+                "Model": ["RTX_4090", "RTX_3090"],
+                "VRAM": [24, 24],
+                "RAM": [32, 8],
+                "vCPUs": [8, 8],
+                "Price": [0.5, 0.2],
+                "Cloud": ["vast", "vast"],
+            }
+        ),
+    )
+    monkeypatch.setattr(
+        gpu_workers,
+        "runpod_offers",
+        lambda: pd.DataFrame(
+            {
+                "ID": [0],
+                "N": [1],
+                "Model": ["NVIDIA RTX A5000"],
+                "VRAM": [24],
+                "RAM": ["29"],
+                "vCPUs": ["9"],
+                "Disk": [float("inf")],
+                "Price": ["0.36"],
+                "Cloud": ["runpod"],
+            }
+        ),
+    )
+    rd = FakeStrictRedis()
+    listing = gpu_workers.get_gpu_offers(rd)
+    # The offer with too little RAM is filtered out and the rest sorted by price.
+    assert list(listing["Cloud"]) == ["runpod", "vast"]
+    assert rd.ttl(gpu_workers.GPU_OFFERS_KEY) > 0
+
+    monkeypatch.setattr(gpu_workers, "vast_offers", MagicMock())
+    cached = gpu_workers.get_gpu_offers(rd)
+    assert gpu_workers.vast_offers.call_count == 0
+    assert list(cached["ID"]) == [0, 11]
+    assert list(cached.columns) == gpu_workers.OFFER_COLUMNS
+
+
+def test_hedged_launch_keeps_first_success():
+    import threading
+    from script_utils import launcher
+
+    release = threading.Event()
+
+    class FakeInstance:
+        def __init__(self, instance_id, ok, wait=False):
+            self.instance_id = instance_id
+            self.ok = ok
+            self.wait = wait
+            self.terminated = False
+
+        def launch_instance(self):
+            if self.wait:
+                release.wait(5)
+            return self.ok
+
+        def terminate_instance(self):
+            self.terminated = True
+            return True
+
+    slow = FakeInstance("slow", True, wait=True)
+    broken = FakeInstance("broken", False)
+    fast = FakeInstance("fast", True)
+    spare = FakeInstance("spare", True)
+    rd = FakeStrictRedis()
+    rd.zadd(launcher.FAILED_OFFERS_KEY, {"vast:4": time.time()})
+    candidates = [
+        ("vast:1", "vast", [slow]),
+        ("vast:2", "vast", [broken]),
+        ("vast:4", "vast", [FakeInstance("skipped", True)]),
+        ("runpod:A5000", "runpod", [fast]),
+        ("vast:5", "vast", [spare]),
+    ]
+    key, provider, instance = launcher.hedged_launch(rd, candidates, hedge=2)
+    assert (key, provider, instance) == ("runpod:A5000", "runpod", fast)
+    assert broken.terminated and not fast.terminated
+    assert launcher.failed_offers(rd) == {"vast:2", "vast:4"}
+
+    # The slower launch is torn down once it comes back.
+    release.set()
+    for _ in range(50):
+        if slow.terminated:
+            break
+        time.sleep(0.1)
+    assert slow.terminated
+    assert not spare.terminated
+
+
+def test_packed_jobs_share_machine(create_test_db, test_db_session, monkeypatch):
+    from types import SimpleNamespace
+    from routers import jobs as jobs_router
+
+    db = test_db_session
+    now = int(time.time())
+    launched = []
+
+    def launch_gpu_machine(
+        rd, job_config, eta, job_eta, disk, pipeline, onstart, skip_providers=()
+    ):
+        launched.append((job_config["job_id"], disk))
+        return "vast", SimpleNamespace(instance_id=900 + len(launched))
+
+    monkeypatch.setattr(jobs_router, "launch_gpu_machine", launch_gpu_machine)
+    monkeypatch.setattr(jobs_router, "get_content_estimate", lambda *a, **k: (60, 1))
+    monkeypatch.setattr(jobs_router, "pack_gpu_jobs", MagicMock())
+    monkeypatch.setattr(jobs_router, "PACKING_MAX_JOBS", 2)
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="packed_jobs@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    balance = models.Balance(user_id=user.id, balance=10)
+    source = models.Content(
+        user_id=user.id,
+        title="a.mp4",
+        content_type="video",
+        status="completed",
+        size=1024 * 1024 * 10,
+        created_at=now,
+    )
+    db.add_all([balance, source])
+    db.commit()
+    config_json = {
+        "job_data": {
+            "content_id": source.id,
+            "filters": {"super_resolution": {"active": False}},
+        }
+    }
+    rd = FakeStrictRedis()
+    packed = []
+    for name in ["first", "second", "third"]:
+        job = models.Jobs(
+            user_id=user.id,
+            job_name=name,
+            job_type="video",
+            job_status="Processing",
+            job_key=True,
+            key=name,
+            created_at=now,
+        )
+        db.add(job)
+        db.commit()
+        packed.append(job)
+        jobs_router.enqueue_packed_job(
+            rd,
+            {
+                "job_id": job.job_id,
+                "user_id": user.id,
+                "job_type": "video",
+                "key": name,
+                "config_json": config_json,
+            },
+        )
+    # Only the job that opened the window schedules a flush.
+    assert jobs_router.pack_gpu_jobs.apply_async.call_count == 1
+
+    packs = jobs_router.flush_packed_jobs(db, rd, "video")
+    assert [len(x) for x in packs] == [2, 1]
+    assert launched == [(packed[0].job_id, 60), (packed[2].job_id, 40)]
+    assert rd.llen(jobs_router.gpu_pack_queue("video")) == 0
+    for job in packed:
+        db.refresh(job)
+    machine_ids = [job.machine_id for job in packed]
+    assert machine_ids[0] == machine_ids[1] != machine_ids[2]
+    db.refresh(balance)
+    assert float(balance.balance) == 7
+
+    machine = db.query(models.Machines).filter_by(machine_id=machine_ids[0]).one()
+    assert machine.job_id == packed[0].job_id
+    members = machines.machine_jobs(db, [machine])
+    assert members[machine.machine_id] == [
+        (packed[0].job_id, user.id),
+        (packed[1].job_id, user.id),
+    ]
+    # The second job is charged from when the first one finished.
+    packed[0].job_key = False
+    packed[0].updated_at = int(machine.created_at) + 100
+    db.commit()
+    usage = jobs_router.packed_gpu_usage(
+        db, packed[1], machine, int(machine.created_at) + 250
+    )
+    assert usage == 150
+
+
+def test_warm_pool_claim_and_expiry(create_test_db, test_db_session, monkeypatch):
+    import pandas as pd
+    from types import SimpleNamespace
+    from routers import jobs as jobs_router
+    from script_utils import warm_pool
+
+    db = test_db_session
+    # Clear of the video jobs created by the other tests.
+    now = int(time.time()) + 10 * warm_pool.WARM_POOL_RATE_WINDOW
+    pool = {"12.1": 2, "12.2": 2}
+    monkeypatch.setattr(warm_pool, "WARM_POOL_SIZE", pool)
+    monkeypatch.setattr(machines, "WARM_POOL_SIZE", pool)
+    monkeypatch.setattr(gpu_workers, "get_gpu_offers", lambda rd: pd.DataFrame([{}]))
+    warm_launches = []
+
+    def launch_warm_machine(rd, df, cuda, used):
+        warm_launches.append(cuda)
+        instance = SimpleNamespace(instance_id=f"warm-{len(warm_launches)}")
+        return "vast", instance, f"key-{len(warm_launches)}"
+
+    monkeypatch.setattr(machines, "launch_warm_machine", launch_warm_machine)
+    cold_launches = MagicMock()
+    monkeypatch.setattr(jobs_router, "launch_gpu_machine", cold_launches)
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="warm_pool@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    for name in ["a", "b", "c"]:
+        db.add(
+            models.Jobs(
+                user_id=user.id,
+                job_name=name,
+                job_type="video",
+                job_status="Completed",
+                key=name,
+                created_at=now - 60,
+            )
+        )
+    db.add(models.Balance(user_id=user.id, balance=10))
+    db.commit()
+
+    # Three video jobs in the last half hour call for two warm machines.
+    assert warm_pool.pool_targets(3) == {"12.1": 1, "12.2": 1}
+    result = machines.maintain_warm_pool(db, FakeStrictRedis(), now)
+    assert result["launched"] == {"12.1": 1, "12.2": 1}
+    result = machines.maintain_warm_pool(db, FakeStrictRedis(), now)
+    assert result["launched"] == {}
+    idle = db.query(models.Machines).filter_by(machine_status="IDLE").all()
+    assert sorted(x.cuda for x in idle) == ["12.1", "12.2"]
+
+    job = models.Jobs(
+        user_id=user.id,
+        job_name="warm",
+        job_type="video",
+        job_status="Processing",
+        job_key=True,
+        key="warm",
+        created_at=now,
+    )
+    db.add(job)
+    db.commit()
+    balance = db.query(models.Balance).filter_by(user_id=user.id).one()
+    need = {
+        "config": {"job_id": job.job_id, "user_id": user.id, "job_type": "video"},
+        "job": job,
+        "balance": balance,
+        "disk": 20,
+        "eta": 60,
+        "price": 1.0,
+    }
+    machine = jobs_router.start_gpu_machine(db, [need])
+    assert cold_launches.call_count == 0
+    assert machine.key == "key-1"
+    assert machine.machine_status == "LOADING"
+    assert machine.job_id == job.job_id
+    db.refresh(job)
+    assert job.machine_id == machine.machine_id
+
+    # The unclaimed machine is cancelled and terminated once its TTL runs out.
+    terminated = []
+    monkeypatch.setattr(
+        gpu_workers,
+        "terminate_instance",
+        lambda provider, instance_id: terminated.append(instance_id),
+    )
+    monkeypatch.setattr(machines, "job_email", MagicMock())
+    monkeypatch.setattr(machines, "send_discord_update", MagicMock())
+    later = now + warm_pool.WARM_POOL_IDLE_TTL + 1
+    listings = {
+        "vast": {
+            "warm-1": {"id": "warm-1", "status_msg": None, "ports": {}},
+            "warm-2": {"id": "warm-2", "status_msg": None, "ports": {}},
+        },
+        "runpod": {},
+    }
+    machines.reconcile_machines(db, FakeStrictRedis(), listings, later)
+    assert "warm-2" in terminated
+    statuses = {
+        x.instance_id: x.machine_status
+        for x in db.query(models.Machines).filter(
+            models.Machines.instance_id.in_(["warm-1", "warm-2"])
+        )
+    }
+    assert statuses["warm-2"] == "CANCELLED"
+    assert statuses["warm-1"] != "CANCELLED"
+
+
+def test_provider_client_retries_and_breaker(monkeypatch):
+    import asyncio
+    import httpx
+    import requests
+    from script_utils import providers
+
+    monkeypatch.setattr(providers, "backoff", lambda attempt: 0)
+    responses = []
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append((method, url))
+        result = responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return SimpleResponse(result)
+
+    class SimpleResponse(requests.Response):
+        def __init__(self, status_code):
+            super().__init__()
+            self.status_code = status_code
+            self._content = b'{"instances": [{"id": 5}], "new_contract": 9}'
+
+    client = providers.VastClient(
+        api_key="x", breaker=providers.CircuitBreaker("vast", threshold=2)
+    )
+    monkeypatch.setattr(client.session, "request", fake_request)
+
+    # Reads are retried through transient errors.
+    responses[:] = [503, requests.ConnectTimeout(), 200]
+    assert client.instances() == {"5": {"id": 5}}
+    assert len(calls) == 3
+
+    # A create that timed out after being sent isn't repeated.
+    calls.clear()
+    responses[:] = [requests.ReadTimeout(), 200]
+    try:
+        client.create_instance(1, {})
+        assert False
+    except providers.ProviderUnavailable:
+        pass
+    assert len(calls) == 1
+
+    responses[:] = [503] * (providers.PROVIDER_RETRIES + 1)
+    try:
+        client.instances()
+        assert False
+    except providers.ProviderUnavailable:
+        pass
+    # Two failed calls in a row open the circuit, so nothing is sent.
+    calls.clear()
+    try:
+        client.instances()
+        assert False
+    except providers.ProviderUnavailable:
+        pass
+    assert calls == []
+    # Terminating still goes through, an instance left running keeps billing.
+    responses[:] = [200]
+    assert client.destroy_instance(5)
+    assert len(calls) == 1
+
+    import runpod
+
+    runpod_client = providers.RunpodClient(
+        api_key="x", breaker=providers.CircuitBreaker("runpod", threshold=2)
+    )
+
+    def sold_out(**kwargs):
+        raise runpod.error.QueryError("No instances available")
+
+    monkeypatch.setattr(runpod, "create_pod", sold_out)
+    monkeypatch.setattr(runpod, "get_pods", lambda: [{"id": "p"}])
+    # Sold out GPUs are answers from the API, not outages.
+    for _ in range(3):
+        try:
+            runpod_client.create_pod(name="x")
+            assert False
+        except runpod.error.QueryError:
+            pass
+    assert runpod_client.pods() == {"p": {"id": "p"}}
+
+    def unreachable(*args):
+        raise requests.ConnectionError()
+
+    monkeypatch.setattr(runpod, "get_pods", unreachable)
+    for _ in range(2):
+        try:
+            runpod_client.pods()
+            assert False
+        except providers.ProviderUnavailable:
+            pass
+    assert not runpod_client.breaker.allow()
+    monkeypatch.setattr(runpod, "terminate_pod", lambda pod_id: None)
+    assert runpod_client.terminate_pod("p")
+
+    async_client = providers.VastClient(api_key="x")
+    async_client._async_client = httpx.AsyncClient(
+        base_url=providers.VAST_API,
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, json={"instances": [{"id": 7}]})
+        ),
+    )
+    assert asyncio.run(async_client.ainstances()) == {"7": {"id": 7}}
+
+
+def test_cancel_refunds_only_charged_jobs(create_test_db, test_db_session, monkeypatch):
+    import asyncio
+    import pytest
+    from fastapi import HTTPException
+    from routers import jobs as jobs_router
+    from routers.auth import TokenData
+
+    db = test_db_session
+    now = int(time.time())
+    monkeypatch.setattr(jobs_router, "get_content_estimate", lambda *a, **k: (60, 2))
+    monkeypatch.setattr(jobs_router, "job_email", MagicMock())
+    monkeypatch.setattr(jobs_router, "send_discord_update", MagicMock())
+    terminated = []
+
+    async def aterminate_instance(provider, instance_id):
+        terminated.append((provider, instance_id))
+        return True
+
+    monkeypatch.setattr(jobs_router, "aterminate_instance", aterminate_instance)
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="cancel_refunds@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    balance = models.Balance(user_id=user.id, balance=10)
+    source = models.Content(
+        user_id=user.id,
+        title="a.mp4",
+        content_type="video",
+        status="completed",
+        created_at=now,
+    )
+    db.add_all([balance, source])
+    db.commit()
+    jobs = {}
+    for name, job_process in [("queued", "queued"), ("started", "running")]:
+        jobs[name] = models.Jobs(
+            user_id=user.id,
+            job_name=name,
+            job_type="video",
+            job_status="Processing",
+            job_process=job_process,
+            job_key=True,
+            key=name,
+            config_json=json.dumps({"job_data": {"filters": {}}}),
+            created_at=now,
+        )
+        db.add(jobs[name])
+    db.commit()
+    for job in jobs.values():
+        db.add(
+            models.Content(
+                user_id=user.id,
+                job_id=job.job_id,
+                id_related=source.id,
+                title="b.mp4",
+                content_type="video",
+                status="processing",
+                created_at=now,
+            )
+        )
+    machine = models.Machines(
+        instance_id="401",
+        user_id=user.id,
+        job_id=jobs["started"].job_id,
+        machine_status="RUNNING",
+        provider="vast",
+        created_at=now,
+    )
+    db.add(machine)
+    db.commit()
+    jobs["started"].machine_id = machine.machine_id
+    db.commit()
+    rd = FakeStrictRedis()
+    current_user = TokenData(user_id=user.id, refreshVersion=1, accessVersion=1)
+
+    def cancel(name):
+        return asyncio.run(
+            jobs_router.cancel_job(jobs[name].job_id, db, rd, current_user)
+        )
+
+    # A queued job was never charged, so cancelling it refunds nothing.
+    cancel("queued")
+    db.refresh(balance)
+    assert float(balance.balance) == 10
+    cancel("started")
+    db.refresh(balance)
+    assert float(balance.balance) == 12
+    assert terminated == [("vast", "401")]
+    # A finished job can't be cancelled for another refund.
+    with pytest.raises(HTTPException) as error:
+        cancel("started")
+    assert error.value.status_code == 400
+    db.refresh(balance)
+    assert float(balance.balance) == 12
+
+
+def test_packed_job_progress_reads_shared_machine(
+    create_test_db, test_db_session, monkeypatch
+):
+    import asyncio
+    from routers import jobs as jobs_router
+    from tests.conftest import TestingAsyncSessionLocal
+
+    db = test_db_session
+    now = int(time.time())
+    looked_up = []
+
+    async def latest_progress(job_id):
+        return None
+
+    async def fetch_instance_status(instance_id, provider):
+        looked_up.append((provider, instance_id))
+        return None
+
+    monkeypatch.setattr(jobs_router, "AsyncSessionLocal", TestingAsyncSessionLocal)
+    monkeypatch.setattr(jobs_router.progress_hub, "latest_progress", latest_progress)
+    monkeypatch.setattr(jobs_router, "fetch_instance_status", fetch_instance_status)
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="packed_progress@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    lead, packed = [
+        models.Jobs(
+            user_id=user.id,
+            job_name=name,
+            job_type="video",
+            job_status="Running",
+            job_key=True,
+            key=name,
+            created_at=now,
+        )
+        for name in ["lead", "packed"]
+    ]
+    db.add_all([lead, packed])
+    db.commit()
+    machine = models.Machines(
+        instance_id="501",
+        user_id=user.id,
+        job_id=lead.job_id,
+        machine_status="RUNNING",
+        provider="vast",
+        created_at=now,
+    )
+    db.add(machine)
+    db.commit()
+    packed.machine_id = machine.machine_id
+    db.commit()
+
+    asyncio.run(jobs_router.job_progress_snapshot(packed.job_id, {"tags": {}}))
+    assert looked_up == [("vast", "501")]
+
+
+def test_failed_jobs_free_their_lane_slots(
+    create_test_db, test_db_session, monkeypatch
+):
+    from routers import jobs as jobs_router
+    from script_utils import scheduler
+    from tests.conftest import engine as test_engine
+
+    db = test_db_session
+    now = int(time.time())
+    monkeypatch.setattr(jobs_router, "engine", test_engine)
+    monkeypatch.setattr(jobs_router, "job_email", MagicMock())
+    monkeypatch.setattr(jobs_router, "send_discord_update", MagicMock())
+    user = models.Users(
+        first_name="firstname",
+        last_name="lastname",
+        email="lane_slots@tnsr.ai",
+        user_tier="free",
+        verified=True,
+        created_at=now,
+    )
+    db.add(user)
+    db.commit()
+    jobs = {}
+    for job_type in ["image", "video"]:
+        jobs[job_type] = models.Jobs(
+            user_id=user.id,
+            job_name=job_type,
+            job_type=job_type,
+            job_status="Processing",
+            job_process="started",
+            job_key=True,
+            key=job_type,
+            created_at=now,
+        )
+        db.add(jobs[job_type])
+    db.commit()
+    running = {lane: scheduler.lane_running(db, lane) for lane in ["replicate", "gpu"]}
+
+    jobs_router.fail_image_job(
+        db,
+        {
+            "job_id": jobs["image"].job_id,
+            "content_id": None,
+            "user_id": user.id,
+            "job_type": "image",
+        },
+    )
+    assert scheduler.lane_running(db, "replicate") == running["replicate"] - 1
+    # The source content is gone, so the job can't get a machine.
+    jobs_router.gpu_process_task(
+        {
+            "job_id": jobs["video"].job_id,
+            "user_id": user.id,
+            "job_type": "video",
+            "config_json": {"job_data": {"content_id": -1, "filters": {}}},
+        }
+    )
+    assert scheduler.lane_running(db, "gpu") == running["gpu"] - 1
+    for job in jobs.values():
+        db.refresh(job)
+        assert job.job_status == "Failed"
+        assert not job.job_key
@@ -36,12 +36,18 @@ from starlette.routing import Match
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 from starlette.types import ASGIApp
 from celeryworker import celeryapp
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.orm import Session
+from database import engine, SessionLocal
 import requests
 import models
 import redis
 import json
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from script_utils.signer import presign_get, presign_get_many
 
 
 load_dotenv()
@@ -175,6 +181,7 @@ USER_TIER = {
             "max_filters": 2,
         },
         "max_jobs": 100,
+        "queue_weight": 1,
     },
     "standard": {
         "video": {
@@ -199,6 +206,7 @@ USER_TIER = {
             "max_filters": 5,
         },
         "max_jobs": 5,
+        "queue_weight": 2,
     },
     "deluxe": {
         "video": {
@@ -223,6 +231,7 @@ USER_TIER = {
             "max_filters": 8,
         },
         "max_jobs": 10,
+        "queue_weight": 4,
     },
 }
 
@@ -653,6 +662,34 @@ REQUESTS_IN_PROGRESS = Gauge(
     "Gauge of requests by method and path currently being processed",
     ["method", "path", "app_name"],
 )
+USER_CACHE_LOOKUPS = Counter(
+    "auth_user_cache_lookups_total",
+    "Total count of token version lookups by cache layer that answered them.",
+    ["result"],
+)
+CACHE_LOOKUPS = Counter(
+    "redis_cache_lookups_total",
+    "Total count of presign, object and tag cache lookups by cache and result.",
+    ["cache", "result"],
+)
+REDIS_ROUND_TRIPS = Histogram(
+    "fastapi_redis_round_trips",
+    "Histogram of cache round trips to Redis per request by path",
+    ["method", "path", "app_name"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 48),
+)
+
+# Mutable per-request counter installed by PrometheusMiddleware. The endpoint
+# runs in a child task or thread with a copy of the context, so it shares the
+# same list object.
+_redis_round_trips = ContextVar("redis_round_trips", default=None)
+
+
+def count_redis_round_trip(n: int = 1):
+    counter = _redis_round_trips.get()
+    if counter is not None:
+        counter[0] += n
+
 
 IMAGE_MODELS = {
     "super_resolution": {
@@ -676,6 +713,10 @@ IMAGE_MODELS = {
     },
 }
 
+# Bump when the jaeger-pipeline image changes its video/audio output, so
+# cached processing results from the old image stop matching.
+PIPELINE_VERSION = os.getenv("PIPELINE_VERSION", "1")
+
 MODEL_COMPUTE = {
     "video": {
         "super_resolution": {
@@ -712,13 +753,6 @@ MODEL_COMPUTE = {
     "audio": {"stem_seperation": 3, "speech_enhancement": 20, "transcription": 5},
 }
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, pool_size=20, max_overflow=40, pool_pre_ping=True
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-db = SessionLocal()
-
 r2_client = boto3.client(
     "s3",
     aws_access_key_id=CLOUDFLARE_ACCESS_KEY,
@@ -742,14 +776,21 @@ r2_resource = boto3.resource(
 password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+tags_redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+
+
 def allTags(id: bool = False):
-    rd = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    rd = tags_redis
     if id == False:
         rd_key = "all_tags"
     else:
         rd_key = "all_tags_id"
-    if rd.exists(rd_key):
-        return json.loads(rd.get(rd_key).decode("utf-8"))
+    cached = rd.get(rd_key)
+    count_redis_round_trip()
+    if cached is not None:
+        CACHE_LOOKUPS.labels(cache="tags", result="hit").inc()
+        return json.loads(cached.decode("utf-8"))
+    CACHE_LOOKUPS.labels(cache="tags", result="miss").inc()
     with Session(engine) as db:
         tags = db.query(models.Tags).all()
         all_tags = {}
@@ -759,16 +800,15 @@ def allTags(id: bool = False):
                     "id": int(tag.id),
                     "readable": tag.readable,
                 }
-            rd.set(rd_key, json.dumps(all_tags))
-            return all_tags
         else:
             for tag in tags:
                 all_tags[int(tag.id)] = {
                     "tag": tag.tag,
                     "readable": tag.readable,
                 }
-            rd.set(rd_key, json.dumps(all_tags))
-            return all_tags
+        rd.set(rd_key, json.dumps(all_tags))
+        count_redis_round_trip()
+        return all_tags
 
 
 def get_hashed_password(password: str) -> str:
@@ -784,6 +824,64 @@ def isValidEmail(email: str) -> bool:
     return re.match(pattern, email) is not None
 
 
+TOKEN_VERSION = 2
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+_decoded_tokens = OrderedDict()
+_decoded_tokens_lock = threading.Lock()
+
+
+def token_claims(subject: Union[str, Any]) -> dict:
+    if isinstance(subject, dict) and "id" in subject:
+        return {
+            "ver": TOKEN_VERSION,
+            "sub": str(subject["id"]),
+            "uid": int(subject["id"]),
+            "rv": int(subject["refreshVersion"]),
+            "av": int(subject["accessVersion"]),
+            "tier": subject.get("user_tier"),
+        }
+    return {"sub": str(subject)}
+
+
+def parse_token_claims(payload: dict) -> dict:
+    if payload.get("ver") == TOKEN_VERSION:
+        return {
+            "id": payload["uid"],
+            "refreshVersion": payload["rv"],
+            "accessVersion": payload["av"],
+            "user_tier": payload.get("tier"),
+            "exp": payload["exp"],
+        }
+    # Tokens issued before the structured format keep str(dict) in sub.
+    try:
+        claims = ast.literal_eval(payload["sub"])
+    except (ValueError, SyntaxError):
+        claims = None
+    if not isinstance(claims, dict):
+        return {"sub": payload.get("sub"), "exp": payload["exp"]}
+    claims["exp"] = payload["exp"]
+    return claims
+
+
+def decode_token(token: str, secret: str) -> dict:
+    cache_key = (secret, hashlib.sha256(token.encode("utf-8")).digest())
+    with _decoded_tokens_lock:
+        cached = _decoded_tokens.get(cache_key)
+        if cached is not None:
+            if cached["exp"] > time.time():
+                _decoded_tokens.move_to_end(cache_key)
+                # Callers get their own copy, the cached claims stay shared.
+                return dict(cached)
+            del _decoded_tokens[cache_key]
+    payload = jwt.decode(token, secret, algorithms=[JWT_ALGORITHM])
+    claims = parse_token_claims(payload)
+    with _decoded_tokens_lock:
+        _decoded_tokens[cache_key] = claims
+        while len(_decoded_tokens) > TOKEN_CACHE_SIZE:
+            _decoded_tokens.popitem(last=False)
+    return dict(claims)
+
+
 def create_access_token(subject: Union[str, Any], expires_delta: int = None) -> str:
     if expires_delta is not None:
         expires_delta = datetime.utcnow() + expires_delta
@@ -791,7 +889,7 @@ def create_access_token(subject: Union[str, Any], expires_delta: int = None) ->
         expires_delta = datetime.utcnow() + timedelta(
             minutes=JWT_ACCESS_TOKEN_EXPIRE_MINUTES
         )
-    to_encode = {"exp": expires_delta, "sub": str(subject)}
+    to_encode = {"exp": expires_delta, **token_claims(subject)}
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, JWT_ALGORITHM)
     return encoded_jwt
 
@@ -803,7 +901,7 @@ def create_refresh_token(subject: Union[str, Any], expires_delta: int = None) ->
         expires_delta = datetime.utcnow() + timedelta(
             minutes=JWT_REFRESH_TOKEN_EXPIRE_MINUTES
         )
-    to_encode = {"exp": expires_delta, "sub": str(subject)}
+    to_encode = {"exp": expires_delta, **token_claims(subject)}
     encoded_jwt = jwt.encode(to_encode, JWT_REFRESH_SECRET, JWT_ALGORITHM)
     return encoded_jwt
 
@@ -1038,60 +1136,52 @@ def paymentfailed_email(name: str, credits: int, amount: str, receiver_email: st
         return False
 
 
+def presigned_get_many(keys, bucket, rd, expire=None):
+    if expire is None:
+        expire = CONTENT_EXPIRE - 60
+    lookup = [key for key in dict.fromkeys(keys) if key is not None]
+    if not lookup:
+        return [None for _ in keys]
+    urls = {}
+    missing = []
+    # Signing needs no network, so a Redis error only costs the cache.
+    try:
+        cached_urls = rd.mget(lookup)
+        count_redis_round_trip()
+    except Exception as e:
+        logger.error(f"Presign cache read failed - {str(e)}")
+        cached_urls = [None for _ in lookup]
+    for key, cached in zip(lookup, cached_urls):
+        if cached is None:
+            missing.append(key)
+        else:
+            urls[key] = cached.decode("utf-8")
+    CACHE_LOOKUPS.labels(cache="presign", result="hit").inc(len(urls))
+    if missing:
+        CACHE_LOOKUPS.labels(cache="presign", result="miss").inc(len(missing))
+        signed = presign_get_many(missing, bucket, CONTENT_EXPIRE)
+        urls.update(zip(missing, signed))
+        try:
+            pipe = rd.pipeline(transaction=False)
+            for key, url in zip(missing, signed):
+                pipe.set(key, url, ex=expire)
+            pipe.execute()
+            count_redis_round_trip()
+        except Exception as e:
+            logger.error(f"Presign cache write failed - {str(e)}")
+    return [urls.get(key) for key in keys]
+
+
 def presigned_get(key, bucket, rd, expire=None):
     try:
-        if rd.exists(key):
-            return rd.get(key).decode("utf-8")
-        r2_client = boto3.client(
-            "s3",
-            aws_access_key_id=CLOUDFLARE_ACCESS_KEY,
-            aws_secret_access_key=CLOUDFLARE_SECRET_KEY,
-            endpoint_url=CLOUDFLARE_ACCOUNT_ENDPOINT,
-            config=botocore.config.Config(
-                s3={"addressing_style": "path"},
-                signature_version="s3v4",
-                retries=dict(max_attempts=3),
-            ),
-        )
-        if expire is None:
-            expire = CONTENT_EXPIRE - 60
-        response = r2_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={
-                "Bucket": bucket,
-                "Key": key,
-            },
-            ExpiresIn=CONTENT_EXPIRE,
-        )
-        rd.set(key, response)
-        rd.expire(key, expire)
-        return response
+        return presigned_get_many([key], bucket, rd, expire)[0]
     except Exception as e:
         return None
 
 
 def job_presigned_get(key, bucket):
     try:
-        r2_client = boto3.client(
-            "s3",
-            aws_access_key_id=CLOUDFLARE_ACCESS_KEY,
-            aws_secret_access_key=CLOUDFLARE_SECRET_KEY,
-            endpoint_url=CLOUDFLARE_ACCOUNT_ENDPOINT,
-            config=botocore.config.Config(
-                s3={"addressing_style": "path"},
-                signature_version="s3v4",
-                retries=dict(max_attempts=3),
-            ),
-        )
-        response = r2_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={
-                "Bucket": bucket,
-                "Key": key,
-            },
-            ExpiresIn=259200,
-        )
-        return response
+        return presign_get(key, bucket, 259200)
     except Exception as e:
         return None
 
@@ -1152,6 +1242,8 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             method=method, path=path, app_name=self.app_name
         ).inc()
         REQUESTS.labels(method=method, path=path, app_name=self.app_name).inc()
+        round_trips = [0]
+        round_trips_token = _redis_round_trips.set(round_trips)
         before_time = time.perf_counter()
         try:
             response = await call_next(request)
@@ -1184,6 +1276,10 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             REQUESTS_IN_PROGRESS.labels(
                 method=method, path=path, app_name=self.app_name
             ).dec()
+            REDIS_ROUND_TRIPS.labels(
+                method=method, path=path, app_name=self.app_name
+            ).observe(round_trips[0])
+            _redis_round_trips.reset(round_trips_token)
 
         return response
 
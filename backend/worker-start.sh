@@ -1,5 +1,22 @@
 #! /usr/bin/env bash
 set -e
 
-# Start Celery worker in the background
-celery -A celeryworker.celeryapp worker -Ofair --concurrency=8 --without-heartbeat --without-gossip --without-mingle --loglevel=info -E --statedb=/var/run/celery/worker.state
\ No newline at end of file
+# One worker per workload class, see TASK_ROUTES in celeryworker.py.
+#   CELERY_QUEUES       comma separated queues this worker consumes
+#   CELERY_POOL         prefork for CPU bound queues, threads for network bound ones
+#   CELERY_CONCURRENCY  processes (prefork) or threads per worker
+CELERY_QUEUES=${CELERY_QUEUES:-media,notify,storage,orchestrate,celery}
+CELERY_POOL=${CELERY_POOL:-prefork}
+CELERY_CONCURRENCY=${CELERY_CONCURRENCY:-8}
+WORKER_NAME=${CELERY_QUEUES%%,*}
+
+# Database pool size per process follows the pool type, see POOL_PROFILES in database.py
+if [ "$CELERY_POOL" = "prefork" ]; then
+    export DB_PROCESS_TYPE=${DB_PROCESS_TYPE:-celery_prefork}
+    POOL_ARGS="-Ofair"
+else
+    export DB_PROCESS_TYPE=${DB_PROCESS_TYPE:-celery_threads}
+    POOL_ARGS=""
+fi
+
+celery -A celeryworker.celeryapp worker -n "${WORKER_NAME}@%h" -Q "$CELERY_QUEUES" --pool="$CELERY_POOL" $POOL_ARGS --concurrency="$CELERY_CONCURRENCY" --without-heartbeat --without-gossip --without-mingle --loglevel=info -E --statedb="/var/run/celery/${WORKER_NAME}.state"
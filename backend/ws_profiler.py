@@ -0,0 +1,67 @@
+# Usage: PROFILE_TOKEN=<access token> PROFILE_JOB_ID=<running job> python ws_profiler.py
+# Opens growing numbers of /jobs/ws sockets against one job and reports how
+# many Postgres transactions the API ran while they were open. With the
+# progress hub the transaction rate should stay flat as sockets are added.
+import asyncio
+import json
+import os
+import time
+
+import websockets
+from sqlalchemy import text
+
+from database import create_db_engine
+
+WS_URL = os.getenv("PROFILE_WS_URL", "ws://localhost:8000/jobs/ws")
+TOKEN = os.getenv("PROFILE_TOKEN", "")
+JOB_ID = int(os.getenv("PROFILE_JOB_ID", 1))
+DURATION = int(os.getenv("PROFILE_DURATION", 30))
+SOCKET_COUNTS = [int(x) for x in os.getenv("PROFILE_SOCKETS", "1,10,50,100").split(",")]
+
+DB_STATS = text(
+    "SELECT xact_commit + xact_rollback FROM pg_stat_database "
+    "WHERE datname = current_database()"
+)
+
+
+async def socket(stop, received):
+    async with websockets.connect(WS_URL) as ws:
+        await ws.send(json.dumps({"token": TOKEN, "job_id": JOB_ID}))
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(ws.recv(), timeout=1)
+                received.append(time.time())
+            except asyncio.TimeoutError:
+                continue
+
+
+async def run(count: int, engine):
+    stop = asyncio.Event()
+    received = []
+    tasks = [asyncio.create_task(socket(stop, received)) for _ in range(count)]
+    # Give the sockets time to authenticate before measuring.
+    await asyncio.sleep(6)
+    with engine.connect() as conn:
+        before = conn.execute(DB_STATS).scalar()
+    await asyncio.sleep(DURATION)
+    with engine.connect() as conn:
+        after = conn.execute(DB_STATS).scalar()
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Our own two stat queries are counted too.
+    transactions = after - before - 2
+    print(
+        f"{count:>5} sockets  {transactions / DURATION:8.2f} tx/s  "
+        f"{len(received) / DURATION:8.2f} msg/s"
+    )
+
+
+async def main():
+    engine = create_db_engine()
+    print(f"job {JOB_ID}, {DURATION}s per step")
+    for count in SOCKET_COUNTS:
+        await run(count, engine)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())